@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bus eventi badge in-process
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Tutte le sorgenti di lettura (lettori hardware, lettore "ID Card Reader" in modalità
+tastiera, iniettori di test) pubblicano sul bus; NFCReader resta in attesa bloccante
+su get() e inoltra il badge alla callback appena arriva: nessun polling di file,
+latenza lettura -> callback sotto il millisecondo e CPU a riposo praticamente nulla.
+
+I file current_badge.txt / temp_badge_input.txt dei vecchi test restano supportati da
+SorgenteFileBadge: eventi del file system con watchdog (opzionale), altrimenti un
+controllo leggero con os.stat dei soli due file.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Iterable, Optional
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+FILE_BADGE_LEGACY = ('current_badge.txt', 'temp_badge_input.txt')
+LUNGHEZZA_MINIMA_BADGE = 3
+
+
+class EventoBadge:
+    """Lettura di un badge: id normalizzato, sorgente, istante di lettura"""
+
+    __slots__ = ('badge_id', 'sorgente', 'quando', 't_lettura')
+
+    def __init__(self, badge_id: str, sorgente: str):
+        self.badge_id = badge_id
+        self.sorgente = sorgente
+        self.quando = datetime.now()
+        self.t_lettura = time.perf_counter()
+
+    def eta(self) -> float:
+        """Secondi trascorsi dalla lettura"""
+        return time.perf_counter() - self.t_lettura
+
+    def __repr__(self):
+        return f"EventoBadge({self.badge_id!r}, {self.sorgente!r})"
+
+
+def normalizza_badge(valore) -> Optional[str]:
+    """Toglie BOM, NUL e spazi; None se non è un id badge valido"""
+    if valore is None:
+        return None
+    badge = str(valore).replace('\ufeff', '').replace('\x00', '').strip()
+    return badge if len(badge) >= LUNGHEZZA_MINIMA_BADGE else None
+
+
+class BusBadge:
+    """Coda thread-safe di EventoBadge con get() bloccante; oltre capacità scarta i più vecchi"""
+
+    def __init__(self, capacita: int = 64):
+        self._eventi = deque(maxlen=capacita)
+        self._cond = threading.Condition()
+        self._generazione = 0  # incrementata da sveglia()
+        self.pubblicati = 0
+        self.scartati = 0
+
+    def pubblica(self, badge_id, sorgente: str = 'test') -> bool:
+        """Pubblica una lettura; False se l'id non è valido"""
+        badge = normalizza_badge(badge_id)
+        if badge is None:
+            return False
+        evento = EventoBadge(badge, sorgente)
+        with self._cond:
+            if len(self._eventi) == self._eventi.maxlen:
+                self.scartati += 1
+            self._eventi.append(evento)
+            self.pubblicati += 1
+            self._cond.notify()
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[EventoBadge]:
+        """Prossimo evento; attende fino a timeout secondi (None = senza limite), None se scaduto"""
+        with self._cond:
+            if not self._eventi:
+                generazione = self._generazione
+                self._cond.wait_for(lambda: self._eventi or self._generazione != generazione, timeout)
+            return self._eventi.popleft() if self._eventi else None
+
+    def restituisci(self, evento: EventoBadge):
+        """Rimette in testa un evento prelevato da un consumatore che nel frattempo è stato fermato"""
+        with self._cond:
+            self._eventi.appendleft(evento)
+            self._cond.notify()
+
+    def svuota(self) -> int:
+        """Scarta gli eventi in coda (es. letture arrivate mentre nessuno era in ascolto)"""
+        with self._cond:
+            n = len(self._eventi)
+            self._eventi.clear()
+            return n
+
+    def sveglia(self):
+        """Sblocca i get() in attesa (che ritornano None): usato per fermare i consumatori"""
+        with self._cond:
+            self._generazione += 1
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._eventi)
+
+
+def _leggi_file_badge(path: str) -> Optional[str]:
+    """Legge e rimuove un file badge di test (UTF-8, UTF-16 con BOM o latin-1) con una sola apertura"""
+    try:
+        with open(path, 'rb') as f:
+            dati = f.read()
+        if not dati:
+            return None  # appena creato, non ancora scritto: lo ripresenta on_modified
+        os.remove(path)
+    except OSError:
+        return None
+    if dati.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return dati.decode('utf-16', errors='replace')
+    try:
+        return dati.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return dati.decode('latin-1')
+
+
+class _GestoreEventiFile(FileSystemEventHandler):
+    def __init__(self, sorgente: 'SorgenteFileBadge'):
+        super().__init__()
+        self.sorgente = sorgente
+
+    def on_created(self, event):
+        self.sorgente._controlla(getattr(event, 'src_path', ''))
+
+    on_modified = on_created
+
+    def on_moved(self, event):
+        self.sorgente._controlla(getattr(event, 'dest_path', ''))
+
+
+class SorgenteFileBadge:
+    """
+    Sorgente legacy: pubblica sul bus il contenuto di current_badge.txt / temp_badge_input.txt
+    appena compaiono nella cartella (watchdog), o al controllo periodico se watchdog manca.
+    """
+
+    def __init__(self, bus: BusBadge, cartella: str = '.', nomi: Iterable[str] = FILE_BADGE_LEGACY,
+                 intervallo_s: float = 0.5):
+        self.bus = bus
+        self.cartella = os.path.abspath(cartella)
+        self.nomi = tuple(nomi)
+        self.intervallo_s = intervallo_s
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._observer = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stop.clear()
+        # File lasciati prima dell'avvio
+        for nome in self.nomi:
+            self._controlla(os.path.join(self.cartella, nome))
+        if WATCHDOG_AVAILABLE:
+            self._observer = Observer()
+            self._observer.schedule(_GestoreEventiFile(self), self.cartella, recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+        else:
+            self._thread = threading.Thread(target=self._loop, name='badge-file', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def is_running(self) -> bool:
+        if self._observer is not None:
+            return self._observer.is_alive()
+        return bool(self._thread and self._thread.is_alive())
+
+    def _controlla(self, path: str):
+        if os.path.basename(path) not in self.nomi:
+            return
+        with self._lock:
+            if not os.path.exists(path):
+                return
+            testo = _leggi_file_badge(path)
+        if testo is not None:
+            sorgente = 'tastiera' if os.path.basename(path) == 'temp_badge_input.txt' else 'file'
+            if self.bus.pubblica(testo, sorgente):
+                print(f"[NFC] Badge da file di test ({os.path.basename(path)}): {normalizza_badge(testo)}")
+
+    def _loop(self):
+        percorsi = [os.path.join(self.cartella, nome) for nome in self.nomi]
+        while not self._stop.wait(self.intervallo_s):
+            for path in percorsi:
+                try:
+                    os.stat(path)
+                except OSError:
+                    continue
+                self._controlla(path)
+
+
+# Istanze di processo (come get_database_manager)
+_bus: Optional[BusBadge] = None
+_sorgente_file: Optional[SorgenteFileBadge] = None
+_lock_istanze = threading.Lock()
+
+
+def get_badge_bus() -> BusBadge:
+    global _bus
+    with _lock_istanze:
+        if _bus is None:
+            _bus = BusBadge()
+        return _bus
+
+
+def avvia_sorgente_file(cartella: str = '.') -> SorgenteFileBadge:
+    """Avvia (una volta per processo) la sorgente legacy dei file badge di test"""
+    global _sorgente_file
+    bus = get_badge_bus()
+    with _lock_istanze:
+        if _sorgente_file is None:
+            _sorgente_file = SorgenteFileBadge(bus, cartella)
+        if not _sorgente_file.is_running():
+            _sorgente_file.start()
+        return _sorgente_file
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    print("🧪 Test bus eventi badge")
+    print("=" * 40)
+    bus = BusBadge()
+    latenze = []
+    ricevuti = threading.Event()
+
+    def consumatore():
+        while True:
+            evento = bus.get(timeout=2.0)
+            if evento is None or evento.badge_id == 'FINE':
+                ricevuti.set()
+                return
+            latenze.append(evento.eta() * 1e6)
+
+    t = threading.Thread(target=consumatore, daemon=True)
+    t.start()
+    for i in range(1000):
+        bus.pubblica(f"BADGE{i:04d}", 'test')
+        time.sleep(0.0005)
+    bus.pubblica('FINE')
+    ricevuti.wait(5)
+    latenze.sort()
+    print(f"   ✅ latenza lettura -> consumatore: mediana {latenze[len(latenze) // 2]:.0f} µs, "
+          f"p99 {latenze[int(len(latenze) * 0.99)]:.0f} µs")
+
+    cpu0 = time.process_time()
+    bus.get(timeout=2.0)
+    print(f"   ✅ CPU in attesa per 2 s: {(time.process_time() - cpu0) * 1000:.1f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sorgente = SorgenteFileBadge(bus, tmp, intervallo_s=0.1)
+        sorgente.start()
+        with open(os.path.join(tmp, 'current_badge.txt'), 'w', encoding='utf-16') as f:
+            f.write('ABC123\n')
+        evento = bus.get(timeout=3.0)
+        sorgente.stop()
+        print(f"   ✅ sorgente file ({'watchdog' if WATCHDOG_AVAILABLE else 'os.stat'}): {evento}")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark del database SQLite di SmartTIM/TIGOTÀ.
+
+Confronta, su un database temporaneo popolato con N timbrature (default 100k):
+- PRIMA: una connessione aperta e chiusa per ogni chiamata (comportamento storico)
+- DOPO: connessioni persistenti per thread (SQLiteConnectionPool)
+
+Operazioni misurate: get_dipendente_by_badge e save_timbratura (incluso l'append al journal JSON).
+"""
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from database_sqlite import TigotaSQLiteManager
+
+
+class LegacyConnectionManager(TigotaSQLiteManager):
+    """Manager con il vecchio schema "connect/close per ogni chiamata" (baseline)."""
+
+    @contextmanager
+    def _get_db_connection(self):
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            yield conn
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                conn.close()
+
+
+def seed_database(db: TigotaSQLiteManager, rows: int, employees: int, seed: int = 42,
+                  sync_status: str = 'synced'):
+    """Popola anagrafica e timbrature con dati sintetici realistici."""
+    rnd = random.Random(seed)
+    badges = [f"{rnd.getrandbits(32):08X}" for _ in range(employees)]
+    start = datetime.now() - timedelta(days=365 * 2)
+    with db._get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO dipendenti (codice, nome, cognome, badge_id) VALUES (?, ?, ?, ?)",
+            [(str(1000 + i), f"Nome{i}", f"Cognome{i}", b) for i, b in enumerate(badges)]
+        )
+        step = (365 * 2 * 86400) / max(1, rows)
+        batch = []
+        for i in range(rows):
+            ts = start + timedelta(seconds=i * step)
+            batch.append((rnd.choice(badges), ts, 'entrata' if i % 2 == 0 else 'uscita', sync_status))
+            if len(batch) >= 10000:
+                conn.executemany(
+                    "INSERT INTO timbrature (badge_id, timestamp, tipo, sync_status) VALUES (?, ?, ?, ?)", batch
+                )
+                batch = []
+        if batch:
+            conn.executemany(
+                "INSERT INTO timbrature (badge_id, timestamp, tipo, sync_status) VALUES (?, ?, ?, ?)", batch
+            )
+        conn.commit()
+    return badges
+
+
+def _measure(fn, iterations: int):
+    """Esegue fn() iterations volte e ritorna le latenze in microsecondi."""
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return samples
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1] if samples else 0.0
+    return statistics.mean(samples), statistics.median(samples), p95
+
+
+def run_benchmark(rows: int, employees: int, lookups: int, inserts: int):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, cls in (('prima (connect per chiamata)', LegacyConnectionManager),
+                           ('dopo (pool per thread)', TigotaSQLiteManager)):
+            db_path = str(Path(tmp) / f"bench_{cls.__name__}.db")
+            db = cls(db_path=db_path, json_backup_path=str(Path(tmp) / 'bench.json'))
+            db.logger.disabled = True
+            badges = seed_database(db, rows, employees)
+            rnd = random.Random(7)
+
+            lookup_us = _measure(lambda: db.get_dipendente_by_badge(rnd.choice(badges)), lookups)
+            insert_us = _measure(lambda: db.save_timbratura(rnd.choice(badges), 'entrata'), inserts)
+            results[label] = {
+                'get_dipendente_by_badge': _summary(lookup_us),
+                'save_timbratura': _summary(insert_us),
+            }
+            db.logger.disabled = False
+            db._pool.close_all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark connessioni database SmartTIM")
+    parser.add_argument("--rows", type=int, default=100_000, help="Timbrature pre-caricate")
+    parser.add_argument("--employees", type=int, default=500, help="Dipendenti con badge")
+    parser.add_argument("--lookups", type=int, default=2000, help="Chiamate get_dipendente_by_badge")
+    parser.add_argument("--inserts", type=int, default=500, help="Chiamate save_timbratura")
+    args = parser.parse_args()
+
+    print(f"⏱️ Benchmark database SQLite ({args.rows} timbrature, {args.employees} dipendenti)")
+    print("=" * 72)
+    results = run_benchmark(args.rows, args.employees, args.lookups, args.inserts)
+    for label, ops in results.items():
+        print(f"\n{label}")
+        for op, (mean, median, p95) in ops.items():
+            print(f"   {op:<26} media {mean:9.1f} µs   mediana {median:9.1f} µs   p95 {p95:9.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark dei percorsi di export/trasferimento di SmartTIM/TIGOTÀ al crescere dei dati.
+
+Per ogni dimensione (default 10k e 100k; --sizes 10k,100k,1M,10M per la serie completa) popola
+un database con una distribuzione realistica (turni, dipendenti part/full-time, ~3% di badge
+non abbinati, storico già esportato e una coda pending) e misura:
+
+- export_txt     export journaled verso l'outbox (EsportatoreTrasferimenti, come lo scheduler)
+                 fasi: query, join, lookup, format, write, mark
+- export_csv     db.export_to_csv sugli ultimi 30 giorni          fasi: query, write
+- pending        db.get_timbrature_pending                        fasi: query
+- mark           db.mark_timbrature_synced sulla coda pending     fasi: mark
+
+Il report JSON (--output) contiene tempi totali e per fase; con --baseline viene confrontato
+con un report precedente e l'uscita è 1 se una misura peggiora oltre --soglia.
+I database popolati possono essere tenuti in --db-dir e riusati (il 10M richiede minuti).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import database_sqlite
+from database_sqlite import DEFAULT_TRANSFER_DEST, TigotaSQLiteManager
+from tracciati_payroll import compila_tracciato
+from trasferimenti import EsportatoreTrasferimenti
+
+GIORNI_STORICO = 730
+PERCORSI = ('export_txt', 'export_csv', 'pending', 'mark')
+SOGLIA_MINIMA_S = 0.005  # misure più brevi sono rumore: escluse dal confronto
+
+
+def _parse_size(valore: str) -> int:
+    valore = valore.strip().lower()
+    moltiplicatore = {'k': 1_000, 'm': 1_000_000}.get(valore[-1:], 1)
+    return int(float(valore.rstrip('km')) * moltiplicatore)
+
+
+def seed_realistico(db: TigotaSQLiteManager, rows: int, pending_frac: float, seed: int = 42) -> int:
+    """
+    Popola anagrafica e timbrature su GIORNI_STORICO giorni fino a oggi.
+
+    - ~1 dipendente ogni 2300 timbrature (3,2 timbrature/giorno lavorato), tra 20 e 5000
+    - pesi per dipendente: full-time, part-time, saltuari; 3% di badge senza anagrafica
+    - orari attorno ai cambi turno (06, 08, 09, 14, 18) con scarto gaussiano, entrata/uscita alternate
+    - le ultime pending_frac timbrature restano 'pending', lo storico è 'synced'
+
+    Returns:
+        int: id massimo dello storico già esportato (le timbrature oltre sono pending)
+    """
+    rnd = random.Random(seed)
+    employees = min(5000, max(20, rows // 2300))
+    badges = [f"{rnd.getrandbits(32):08X}" for _ in range(employees)]
+    pesi = [rnd.choice((1.0, 1.0, 1.0, 0.5, 0.5, 0.15)) for _ in badges]
+    sconosciuti = [f"{rnd.getrandbits(32):08X}" for _ in range(max(1, employees // 30))]
+    tutti = badges + sconosciuti
+    pesi_tutti = pesi + [sum(pesi) * 0.03 / len(sconosciuti)] * len(sconosciuti)
+    turni = (6, 8, 9, 14, 18)
+    confine = rows - int(rows * pending_frac)
+    inizio = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=GIORNI_STORICO - 1)
+
+    with db._get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO dipendenti (codice, nome, cognome, badge_id) VALUES (?, ?, ?, ?)",
+            [(str(1000 + i), f"Nome{i}", f"Cognome{i}", b) for i, b in enumerate(badges)]
+        )
+        prodotte = 0
+        for giorno in range(GIORNI_STORICO):
+            quante = rows * (giorno + 1) // GIORNI_STORICO - prodotte
+            if quante <= 0:
+                continue
+            base = inizio + timedelta(days=giorno)
+            minuti = sorted(
+                max(0, min(1439, int(rnd.choice(turni) * 60 + rnd.gauss(0, 25) + (0 if i % 2 else 8 * 60))))
+                for i in range(quante)
+            )
+            scelti = rnd.choices(tutti, weights=pesi_tutti, k=quante)
+            batch = []
+            for i in range(quante):
+                n = prodotte + i
+                ts = (base + timedelta(minutes=minuti[i], seconds=rnd.randrange(60))).strftime('%Y-%m-%d %H:%M:%S')
+                batch.append((scelti[i], ts, 'entrata' if n % 2 == 0 else 'uscita',
+                              'synced' if n < confine else 'pending'))
+            conn.executemany(
+                "INSERT INTO timbrature (badge_id, timestamp, tipo, sync_status) VALUES (?, ?, ?, ?)", batch
+            )
+            prodotte += quante
+        conn.commit()
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM timbrature WHERE sync_status = 'synced'").fetchone()[0]
+
+
+def _ripristina(db: TigotaSQLiteManager, confine: int):
+    """Riporta il database allo stato iniziale: coda pending oltre il confine, nessun watermark/batch"""
+    with db._get_db_connection() as conn:
+        conn.execute("UPDATE timbrature SET sync_status = 'pending' WHERE id > ? AND sync_status != 'pending'", (confine,))
+        conn.execute("UPDATE timbrature SET sync_status = 'synced' WHERE sync_status = 'pending' AND id <= ?", (confine,))
+        conn.execute("DELETE FROM transfer_watermark")
+        conn.execute("DELETE FROM transfer_batches")
+        conn.commit()
+
+
+def _apri_database(rows: int, pending_frac: float, cartella: str) -> tuple:
+    """Database della dimensione richiesta: riusato se già popolato in cartella, altrimenti creato"""
+    path = Path(cartella) / f"bench_export_{rows}_{pending_frac:g}.db"
+    esistente = path.exists()
+    if esistente:
+        with sqlite3.connect(path) as conn:
+            esistente = conn.execute("SELECT COUNT(*) FROM timbrature").fetchone()[0] == rows
+        if not esistente:
+            for suffisso in ('', '-wal', '-shm'):
+                if os.path.exists(str(path) + suffisso):
+                    os.remove(str(path) + suffisso)
+    db = TigotaSQLiteManager(db_path=str(path), json_backup_path=str(path.with_suffix('.json')))
+    db.logger.disabled = True
+    t0 = time.perf_counter()
+    if esistente:
+        with db._get_db_connection() as conn:
+            confine = conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM timbrature WHERE id <= ?", (rows - int(rows * pending_frac),)
+            ).fetchone()[0]
+        _ripristina(db, confine)
+    else:
+        confine = seed_realistico(db, rows, pending_frac)
+    return db, confine, time.perf_counter() - t0, esistente
+
+
+def _misura_export_txt(db, cartella: str, tracciato, confine: int) -> dict:
+    """
+    Fasi misurate una per una su un batch vero (begin -> join -> format -> write -> mark),
+    poi database ripristinato ed export completo cronometrato per il totale:
+    query   range pending senza anagrafica (solo timbrature)
+    join    la query dell'export (range + LEFT JOIN dipendenti), cronometrata da sola
+    lookup  le sole ricerche in dipendenti per badge delle righe del range (il costo del join)
+    mark    conferma del batch: avanzamento del watermark (confirm_transfer_batch)
+    """
+    after_id, upto_id = db.get_transfer_watermark(), db.get_max_timbratura_id()
+
+    t0 = time.perf_counter()
+    with db._get_db_connection() as conn:
+        badge = [r[0] for r in conn.execute("""
+            SELECT badge_id FROM timbrature
+            WHERE id > ? AND id <= ? AND +sync_status = 'pending' ORDER BY timestamp, id
+        """, (after_id, upto_id))]
+    query_s = time.perf_counter() - t0
+    n_query = len(badge)
+
+    with db._get_db_connection() as conn:
+        t0 = time.perf_counter()
+        for badge_id in badge:
+            conn.execute("SELECT codice, nome, cognome FROM dipendenti WHERE badge_id = ?", (badge_id,)).fetchone()
+        lookup_s = time.perf_counter() - t0
+    del badge
+
+    batch = db.begin_transfer_batch(DEFAULT_TRANSFER_DEST, 'fase_write.TXT')
+    t0 = time.perf_counter()
+    righe = list(db.iter_timbrature_pending_export(batch['from_id'], batch['to_id']))
+    join_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    formatta = tracciato.formatta
+    testo = [formatta(r) for r in righe]
+    format_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    path = os.path.join(cartella, 'fase_write.TXT')
+    with open(path, 'wb') as f:
+        for i in range(0, len(testo), 4096):
+            f.write(''.join(testo[i:i + 4096]).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+    write_s = time.perf_counter() - t0
+    os.remove(path)
+    del righe, testo
+
+    db.update_transfer_batch(batch['batch_id'], 'pubblicato', righe=n_query)
+    t0 = time.perf_counter()
+    assert db.confirm_transfer_batch(batch['batch_id'])
+    mark_s = time.perf_counter() - t0
+    _ripristina(db, confine)
+
+    esportatore = EsportatoreTrasferimenti(db, os.path.join(cartella, 'outbox'), tracciato.contesto)
+    t0 = time.perf_counter()
+    count = esportatore.esporta()
+    totale_s = time.perf_counter() - t0
+    assert count == n_query, f"export_txt: {count} righe esportate, {n_query} attese"
+    return {'totale_s': totale_s, 'righe': count,
+            'fasi': {'query': query_s, 'join': join_s, 'lookup': lookup_s, 'format': format_s,
+                     'write': write_s, 'mark': mark_s}}
+
+
+def _misura_export_csv(db) -> dict:
+    inizio, fine = datetime.now() - timedelta(days=30), datetime.now()
+    t0 = time.perf_counter()
+    righe = sum(1 for _ in db._iter_timbrature_range(inizio, fine))
+    query_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    path = db.export_to_csv(inizio, fine)
+    totale_s = time.perf_counter() - t0
+    if path:
+        os.remove(path)
+    return {'totale_s': totale_s, 'righe': righe,
+            'fasi': {'query': query_s, 'write': max(0.0, totale_s - query_s)}}
+
+
+def _misura_pending(db) -> dict:
+    t0 = time.perf_counter()
+    righe = db.get_timbrature_pending()
+    totale_s = time.perf_counter() - t0
+    return {'totale_s': totale_s, 'righe': len(righe), 'fasi': {'query': totale_s}}, [r['id'] for r in righe]
+
+
+def _misura_mark(db, ids) -> dict:
+    t0 = time.perf_counter()
+    assert db.mark_timbrature_synced(ids)
+    totale_s = time.perf_counter() - t0
+    return {'totale_s': totale_s, 'righe': len(ids), 'fasi': {'mark': totale_s}}
+
+
+def _migliore(misure: list) -> dict:
+    """Ripetizioni ridotte al minimo per ogni misura (il meno disturbato dal sistema)"""
+    migliore = dict(min(misure, key=lambda m: m['totale_s']))
+    migliore['fasi'] = {fase: min(m['fasi'][fase] for m in misure) for fase in misure[0]['fasi']}
+    return migliore
+
+
+def esegui(sizes, pending_frac: float, ripetizioni: int, db_dir: str = None) -> dict:
+    report = {
+        'versione': 1,
+        'creato': datetime.now().isoformat(timespec='seconds'),
+        'ambiente': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                     'piattaforma': platform.platform(), 'cpu': os.cpu_count()},
+        'parametri': {'pending_frac': pending_frac, 'ripetizioni': ripetizioni},
+        'risultati': {},
+    }
+    tracciato = compila_tracciato('ORE', {'sede': '12', 'negozio': '345'})
+    with tempfile.TemporaryDirectory() as tmp:
+        export_dir_originale = database_sqlite.EXPORT_DIR
+        database_sqlite.EXPORT_DIR = Path(tmp)  # export_to_csv scrive in EXPORT_DIR
+        try:
+            for rows in sizes:
+                db, confine, seed_s, riusato = _apri_database(rows, pending_frac, db_dir or tmp)
+                print(f"\n📦 {rows:,} timbrature ({'riuso database' if riusato else 'popolamento'} {seed_s:.1f}s)")
+                misure = {p: [] for p in PERCORSI}
+                try:
+                    for _ in range(ripetizioni):
+                        misure['export_txt'].append(_misura_export_txt(db, tmp, tracciato, confine))
+                        _ripristina(db, confine)
+                        misure['export_csv'].append(_misura_export_csv(db))
+                        pending, ids = _misura_pending(db)
+                        misure['pending'].append(pending)
+                        misure['mark'].append(_misura_mark(db, ids))
+                        _ripristina(db, confine)
+                finally:
+                    db._writer.stop()
+                    db._pool.close_all()
+                risultati = {p: _migliore(m) for p, m in misure.items()}
+                report['risultati'][str(rows)] = {'seed_s': seed_s, 'percorsi': risultati}
+                for percorso, r in risultati.items():
+                    fasi = '  '.join(f"{f} {s:.3f}" for f, s in r['fasi'].items())
+                    velocita = r['righe'] / r['totale_s'] if r['totale_s'] else 0
+                    print(f"   {percorso:<11} {r['totale_s']:8.3f} s  {r['righe']:>9,} righe  "
+                          f"{velocita:>12,.0f} righe/s   [{fasi}]")
+        finally:
+            database_sqlite.EXPORT_DIR = export_dir_originale
+    return report
+
+
+def confronta(report: dict, baseline: dict, soglia: float) -> list:
+    """Stampa il confronto con la baseline; ritorna le misure peggiorate oltre la soglia"""
+    regressioni = []
+    print(f"\n📊 Confronto con baseline del {baseline.get('creato', '?')} (soglia {soglia:.0%})")
+    for rows, dati in report['risultati'].items():
+        base = baseline.get('risultati', {}).get(rows)
+        if not base:
+            print(f"   {int(rows):,}: assente nella baseline")
+            continue
+        for percorso, r in dati['percorsi'].items():
+            b = base['percorsi'].get(percorso)
+            if not b:
+                continue
+            voci = [('totale', r['totale_s'], b['totale_s'])]
+            voci += [(f, s, b['fasi'][f]) for f, s in r['fasi'].items() if f in b.get('fasi', {})]
+            for nome, nuovo, vecchio in voci:
+                if max(nuovo, vecchio) < SOGLIA_MINIMA_S:
+                    continue
+                delta = (nuovo - vecchio) / vecchio if vecchio else float('inf')
+                segno = '❌' if delta > soglia else ('✅' if delta < -soglia else '  ')
+                if delta > soglia:
+                    regressioni.append(f"{rows}/{percorso}/{nome}")
+                print(f"   {segno} {int(rows):>10,} {percorso:<11} {nome:<7} {vecchio:8.3f}s -> {nuovo:8.3f}s  {delta:+7.1%}")
+    return regressioni
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark percorsi di export/trasferimento")
+    parser.add_argument("--sizes", default='10k,100k', help="Dimensioni, es. 10k,100k,1M,10M")
+    parser.add_argument("--pending", type=float, default=0.05, help="Frazione di timbrature in coda pending")
+    parser.add_argument("--ripetizioni", type=int, default=1, help="Ripetizioni per dimensione (vale la migliore)")
+    parser.add_argument("--db-dir", help="Cartella dove tenere/riusare i database popolati")
+    parser.add_argument("--output", default='benchmark_export_report.json', help="Report JSON prodotto")
+    parser.add_argument("--baseline", help="Report JSON di riferimento da confrontare")
+    parser.add_argument("--soglia", type=float, default=0.10, help="Peggioramento tollerato (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    sizes = [_parse_size(s) for s in args.sizes.split(',') if s.strip()]
+    if args.db_dir:
+        os.makedirs(args.db_dir, exist_ok=True)
+    print(f"⏱️ Benchmark export/trasferimento: {', '.join(f'{s:,}' for s in sizes)} timbrature, "
+          f"{args.pending:.0%} pending")
+    print("=" * 72)
+    report = esegui(sizes, args.pending, max(1, args.ripetizioni), args.db_dir)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Report salvato in {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressioni = confronta(report, baseline, args.soglia)
+        if regressioni:
+            print(f"\n❌ {len(regressioni)} misure peggiorate oltre la soglia: {', '.join(regressioni)}")
+            sys.exit(1)
+        print("\n✅ Nessuna regressione oltre la soglia")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark dell'ingestione in sede centrale (ingestione_sede.IngestioneSede).
+
+Genera un albero di cartelle di trasferimento (N negozi x F file x R record, tracciato ORE
+compilato con tracciati_payroll, ~1% di righe duplicate) e misura i record/s sostenuti
+importando lo stesso albero con 1 processo di parsing e con tutti i core disponibili.
+
+Le fasi sono riportate separatamente: analisi (parsing nei processi del pool, tempo CPU
+sommato e stimato per processo) e caricamento (SQLite, un solo writer nel processo
+principale). Il parsing scala con i processi, il caricamento no: con più core è il
+caricamento a dominare il tempo totale, e il benchmark lo segnala.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from ingestione_sede import IngestioneSede
+from tracciati_payroll import compila_tracciato
+
+
+def genera_albero(radice: str, negozi: int, file_per_negozio: int, righe_per_file: int, seed: int = 42) -> int:
+    """Crea i file ORE dei negozi; ritorna il numero di record scritti"""
+    rnd = random.Random(seed)
+    inizio = datetime(2025, 1, 1, 6, 0)
+    totale = 0
+    for n in range(negozi):
+        negozio = f"{100 + n}"
+        cartella = os.path.join(radice, f"negozio_{negozio}", 'export')
+        os.makedirs(cartella, exist_ok=True)
+        tracciato = compila_tracciato('ORE', {'sede': f"{n % 20:02d}", 'negozio': negozio})
+        badges = [f"{rnd.randrange(10**6):06d}" for _ in range(80)]
+        for f in range(file_per_negozio):
+            giorno = inizio + timedelta(days=f)
+            righe = []
+            for i in range(righe_per_file):
+                ts = giorno + timedelta(minutes=rnd.randrange(16 * 60))
+                riga = {'codice': rnd.choice(badges), 'badge_id': '', 'tipo': 'entrata' if i % 2 else 'uscita',
+                        'timestamp': str(ts)}
+                righe.append(riga)
+                if rnd.random() < 0.01:
+                    righe.append(riga)  # duplicato (doppia lettura badge)
+            path = os.path.join(cartella, tracciato.nome_file(giorno + timedelta(days=1)))
+            totale += tracciato.scrivi(path, righe)
+    # File "vecchi" abbastanza da superare ETA_MINIMA_FILE
+    passato = time.time() - 60
+    for cartella, _, files in os.walk(radice):
+        for nome in files:
+            os.utime(os.path.join(cartella, nome), (passato, passato))
+    return totale
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestione file ORE in sede centrale")
+    parser.add_argument("--negozi", type=int, default=200, help="Negozi (cartelle di trasferimento)")
+    parser.add_argument("--file", type=int, default=5, help="File ORE per negozio")
+    parser.add_argument("--righe", type=int, default=1000, help="Record per file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processi di parsing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        radice = os.path.join(tmp, 'negozi')
+        t0 = time.perf_counter()
+        totale = genera_albero(radice, args.negozi, args.file, args.righe)
+        print(f"⏱️ Benchmark ingestione: {args.negozi} negozi, {args.negozi * args.file} file, "
+              f"{totale} record (generati in {time.perf_counter() - t0:.1f}s)")
+        print("=" * 72)
+        for workers in sorted({1, args.workers}):
+            ingestione = IngestioneSede(radice, os.path.join(tmp, f"centrale_{workers}"), workers=workers)
+            ingestione.logger.disabled = True
+            t0 = time.perf_counter()
+            files = ingestione.scansiona()
+            scan_s = time.perf_counter() - t0
+            stats = ingestione.importa(files)
+            totale_s = scan_s + stats['secondi']
+            analisi_s, caricamento_s = stats['secondi_analisi'], stats['secondi_caricamento']
+            print(f"   {workers:>2} processi   {totale_s:7.2f} s   {stats['record'] / totale_s:12,.0f} record/s"
+                  f"   (scansione {scan_s:.2f}s)")
+            print(f"                 analisi     {analisi_s:7.2f} s CPU ({analisi_s / workers:.2f} s per processo, "
+                  f"{stats['record'] / max(analisi_s, 1e-9):,.0f} record/s per processo)")
+            print(f"                 caricamento {caricamento_s:7.2f} s      (1 writer, "
+                  f"{stats['record'] / max(caricamento_s, 1e-9):,.0f} record/s)")
+            collo = 'caricamento' if caricamento_s >= analisi_s / workers else 'analisi'
+            print(f"                 collo di bottiglia: {collo}")
+            print(f"                 nuove {stats['nuove']}, duplicati {stats['duplicati']}, errori {stats['errori']}")
+            # Secondo giro: nessun file nuovo, nessun duplicato reinserito
+            assert not ingestione.scansiona()
+            ingestione.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Load-test della sincronizzazione cloud (sync_cloud.SincronizzatoreCloud) contro server_sync_locale.
+
+Carica N timbrature pending in un database temporaneo e le invia al server locale con latenza,
+costo per riga ed errori simulati; riporta record/s, richieste, byte compressi, connessioni
+aperte (keep-alive: 1) e la dimensione di batch a cui l'adattamento si è stabilizzato.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from benchmark_database import seed_database
+from database_sqlite import TigotaSQLiteManager
+from server_sync_locale import ServerSyncLocale
+from sync_cloud import DEST_CLOUD, ErroreSync, SincronizzatoreCloud
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test sincronizzazione cloud su server locale")
+    parser.add_argument("--rows", type=int, default=100_000, help="Timbrature da sincronizzare")
+    parser.add_argument("--latenza", type=float, default=0.02, help="Latenza fissa per richiesta (s)")
+    parser.add_argument("--ms-per-riga", type=float, default=0.01, help="Costo server per timbratura (ms)")
+    parser.add_argument("--errori", type=float, default=0.02, help="Frazione di richieste con 503")
+    parser.add_argument("--max-righe", type=int, default=4000, help="Limite server per batch (413 oltre)")
+    parser.add_argument("--obiettivo", type=float, default=0.5, help="Tempo di risposta obiettivo (s)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = TigotaSQLiteManager(db_path=str(Path(tmp) / 'bench_sync.db'),
+                                 json_backup_path=str(Path(tmp) / 'bench_sync.json'))
+        db.logger.disabled = True
+        db.get_transfer_watermark(DEST_CLOUD)  # destinazione configurata prima delle timbrature
+        seed_database(db, args.rows, 500, sync_status='pending')
+        server = ServerSyncLocale(latenza_s=args.latenza, ms_per_riga=args.ms_per_riga,
+                                  tasso_errori=args.errori, max_righe=args.max_righe, seed=42).start()
+        sync = SincronizzatoreCloud(db, server.url, {'sede': '12', 'negozio': '345'},
+                                    batch_max=10_000, obiettivo_s=args.obiettivo, retry_min_s=0.01, retry_max_s=0.05)
+        print(f"⏱️ Load-test sync cloud: {args.rows} timbrature, latenza {args.latenza}s, errori {args.errori:.0%}")
+        print("=" * 72)
+        t0 = time.perf_counter()
+        tentativi = 0
+        while True:
+            try:
+                sync.sincronizza()
+                break
+            except ErroreSync:
+                tentativi += 1
+                time.sleep(0.01)
+        durata = time.perf_counter() - t0
+        st, srv = sync.stato(), server.stato()
+        print(f"   {durata:7.2f} s   {st['inviate'] / durata:12,.0f} timbrature/s")
+        print(f"   richieste {srv['richieste']} (batch {srv['batch']}, replay {srv['replay']}, "
+              f"413 {srv['rifiutate_413']}, 503 {srv['errori_simulati']}), connessioni {srv['connessioni']}")
+        print(f"   {st['byte_inviati'] / 1024:,.0f} KiB gzip ({st['byte_inviati'] / max(1, st['inviate']):.1f} byte/timbratura),"
+              f" batch finale {st['dimensione_batch']}, duplicati lato server {srv['duplicate']}")
+        print(f"   {'✅' if srv['timbrature'] == args.rows and st['in_attesa'] == 0 else '❌'} "
+              f"server {srv['timbrature']}/{args.rows}, in attesa {st['in_attesa']}")
+        sync.stop()
+        server.stop()
+        db._writer.stop()
+        db._pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
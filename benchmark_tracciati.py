@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark dell'export payroll (tracciato ORE) di SmartTIM/TIGOTÀ.
+
+Confronta, su N record (default 1M):
+- PRIMA: formattazione riga per riga come nel vecchio export_pending_timbrature_to_txt
+  (split/replace di str(timestamp), una write() per riga)
+- DOPO: tracciato 'ORE' compilato da tracciati_payroll, scritto a blocchi con buffer grande
+
+Con --db misura anche l'export completo da SQLite (query unita + scrittura file).
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from tracciati_payroll import compila_tracciato
+
+
+def genera_righe(n: int, employees: int = 500, seed: int = 42):
+    """Righe sintetiche con le colonne di iter_timbrature_pending_export"""
+    rnd = random.Random(seed)
+    badges = [(f"{rnd.getrandbits(32):08X}", str(1000 + i) if i % 10 else None) for i in range(employees)]
+    start = datetime.now() - timedelta(days=30)
+    step = 30 * 86400 / max(1, n)
+    righe = []
+    for i in range(n):
+        badge, codice = badges[rnd.randrange(employees)]
+        righe.append({
+            'id': i + 1, 'badge_id': badge, 'codice': codice, 'nome': None, 'cognome': None,
+            'tipo': 'entrata' if i % 2 == 0 else 'uscita',
+            'timestamp': str(start + timedelta(seconds=i * step)),
+        })
+    return righe
+
+
+def export_legacy(path: str, righe, cod_sede: str) -> int:
+    """Formattazione del vecchio export (baseline)"""
+    def _fmt_dt(ts_val):
+        s = str(ts_val)
+        try:
+            date_part, time_part = s.split(' ')
+        except ValueError:
+            date_part = s[:10]
+            time_part = s[11:19]
+        ymd = date_part.replace('-', '')
+        hms = time_part.split('.')[0].replace(':', '')
+        return ymd, hms
+
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for r in righe:
+            raw_badge = (r['badge_id'] or '').strip()
+            emp_code_digits = ''
+            if r['codice'] is not None:
+                emp_code_digits = ''.join(ch for ch in str(r['codice']) if ch.isdigit())
+            if not emp_code_digits:
+                emp_code_digits = ''.join(ch for ch in raw_badge if ch.isdigit()) or '0'
+            badge10 = emp_code_digits[-10:].rjust(10, '0')
+            tipo_flag = '1' if (r['tipo'] or '').strip().lower() == 'entrata' else '0'
+            ymd, hms = _fmt_dt(r['timestamp'])
+            ddmmyy = ymd[6:8] + ymd[4:6] + ymd[2:4]
+            hhmm = hms[0:2] + hms[2:4]
+            sede_code = (cod_sede or '').strip()
+            f.write(f"{sede_code}{badge10}{tipo_flag}0000{ddmmyy}{hhmm}\r\n")
+            count += 1
+    return count
+
+
+def export_db(tmp: str, rows: int, tracciato) -> dict:
+    """Export completo da SQLite: seed, query unita in streaming, scrittura tracciato"""
+    from benchmark_database import seed_database
+    from database_sqlite import TigotaSQLiteManager
+
+    db = TigotaSQLiteManager(db_path=str(Path(tmp) / 'bench_export.db'),
+                             json_backup_path=str(Path(tmp) / 'bench_export.json'))
+    db.logger.disabled = True
+    try:
+        t0 = time.perf_counter()
+        seed_database(db, rows, 500, sync_status='pending')
+        seed_s = time.perf_counter() - t0
+        after_id, upto_id = db.get_transfer_watermark(), db.get_max_timbratura_id()
+        t0 = time.perf_counter()
+        count = tracciato.scrivi(str(Path(tmp) / 'ORE_db.TXT'), db.iter_timbrature_pending_export(after_id, upto_id))
+        return {'seed_s': seed_s, 'export_s': time.perf_counter() - t0, 'count': count}
+    finally:
+        db.logger.disabled = False
+        db._writer.stop()
+        db._pool.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark export tracciato ORE")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Record da esportare")
+    parser.add_argument("--db", action="store_true", help="Misura anche l'export completo da SQLite")
+    args = parser.parse_args()
+
+    print(f"⏱️ Benchmark export tracciato ORE ({args.rows} record)")
+    print("=" * 72)
+    righe = genera_righe(args.rows)
+    tracciato = compila_tracciato('ORE', {'sede': '12', 'negozio': '345'})
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'ORE_legacy.TXT')
+        t0 = time.perf_counter()
+        export_legacy(legacy_path, righe, '12')
+        legacy_s = time.perf_counter() - t0
+
+        compiled_path = os.path.join(tmp, 'ORE_compilato.TXT')
+        t0 = time.perf_counter()
+        tracciato.scrivi(compiled_path, righe)
+        compiled_s = time.perf_counter() - t0
+
+        with open(legacy_path, 'rb') as a, open(compiled_path, 'rb') as b:
+            identici = a.read() == b.read()
+        print(f"   prima (riga per riga)   {legacy_s:7.2f} s   {args.rows / legacy_s:12,.0f} record/s")
+        print(f"   dopo (compilato)        {compiled_s:7.2f} s   {args.rows / compiled_s:12,.0f} record/s")
+        print(f"   {'✅' if identici else '❌'} file identici")
+
+        if args.db:
+            res = export_db(tmp, args.rows, tracciato)
+            print(f"   da SQLite               {res['export_s']:7.2f} s   {res['count'] / res['export_s']:12,.0f} record/s"
+                  f"   (seed {res['seed_s']:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
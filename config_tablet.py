@@ -80,7 +80,15 @@ NFC_CONFIG = {
     'feedback_duration': 4000,    # Feedback più lungo
     'pulse_animation': True,      # Animazione pulse attiva
     'sound_feedback': False,      # Audio feedback (opzionale)
-    'vibration_feedback': False   # Vibrazione (se supportata)
+    'vibration_feedback': False,  # Vibrazione (se supportata)
+    'badge_file_source': True,    # File di test current_badge.txt / temp_badge_input.txt sul bus badge
+    'serial_port': None,          # Lettore seriale (es. 'COM3', '/dev/ttyUSB0'); None = non usato
+    'serial_baudrate': 9600,
+    'serial_checksum': 'auto',    # 'auto', 'xor' (STX/ETX tipo RDM6300) o 'nessuno'
+    'pcsc_enabled': False,        # Lettori PC/SC (pyscard), es. ACR122U
+    'pcsc_formato_uid': 'hex',    # 'hex', 'hex_inverso', 'decimale' o 'decimale_inverso'
+    'duplicate_window_s': 2.0,    # Letture ripetute dello stesso badge entro questa finestra: soppresse
+    'near_duplicate_window_s': 60 # Timbratura dello stesso badge entro questa finestra: segnalata
 }
 
 # Configurazione finestra per tablet
@@ -110,9 +118,25 @@ DATA_CONFIG = {
     # Database principale (SQLite per produzione)
     'database_file': str(DATA_DIR / 'timbrature.db'),
     'use_database': True,  # True per produzione, False per sviluppo
-    
+
+    # Connessioni SQLite persistenti (una per thread)
+    'sqlite_journal_mode': 'WAL',     # WAL: letture non bloccate dalle scritture
+    'sqlite_synchronous': 'NORMAL',   # NORMAL in WAL: durabile, senza fsync per commit
+    'sqlite_cache_size_kb': 8192,     # Page cache per connessione (KiB)
+    'sqlite_cached_statements': 256,  # Prepared statement in cache per connessione
+
     # File JSON per compatibilità/backup
     'timbrature_file': str(DATA_DIR / 'timbrature.json'),
+    'timbrature_journal_file': str(DATA_DIR / 'timbrature.jsonl'),  # Journal incrementale (JSON-Lines)
+    'journal_compact_interval': 3600,  # Compattazione journal -> snapshot JSON (secondi)
+    'journal_compact_min_bytes': 1048576,  # Compatta solo oltre questa dimensione del journal (byte)
+    'timbrature_queue_file': str(DATA_DIR / 'timbrature_queue.jsonl'),  # Spool coda write-behind
+    'write_behind_batch_size': 256,    # Max timbrature per group commit
+    'write_behind_fsync': True,        # fsync dello spool a ogni group commit (durabile anche a corrente persa)
+    'write_behind_retry_s': 30,        # Riaccoda dopo N secondi i gruppi falliti (0 = solo al riavvio)
+    'roster_refresh_interval': 2.0,    # Controllo versione anagrafica (modifiche da altri processi, s)
+    'archive_dir': str(DATA_DIR / 'archivio'),  # Partizioni mensili timbrature sincronizzate
+    'archive_after_days': 90,          # Età minima (giorni) per archiviare timbrature 'synced'
     'daily_export_dir': str(EXPORT_DIR),
     
     # Logging
@@ -129,13 +153,36 @@ DATA_CONFIG = {
     'backup_dir': str(BACKUP_DIR),
     'backup_interval': 3600,      # Backup ogni ora
     'daily_export': True,         # Export giornaliero automatico
-    'compress_backups': True,     # Compressione backup
+    'compress_backups': True,     # Compressione backup (gzip)
+    'backup_step_pages': 256,     # Pagine SQLite copiate per passo di backup online
     'max_backup_days': 30,        # Retention backup (30 giorni)
+
+    # Scheduler unico dei job periodici (cron "min ora giorno mese giorno_settimana", '' = disattivato)
+    'scheduler_state_file': str(DATA_DIR / 'scheduler_stato.json'),  # Ultime esecuzioni e storico job
+    'job_backup_cron': '30 1 * * *',              # Backup giornaliero alle 01:30
+    'job_pulizia_backup_cron': '0 5 * * *',       # Pulizia backup oltre la retention
+    'job_integrita_cron': '0 3 * * 0',            # PRAGMA integrity_check la domenica
+    'job_compattazione_journal_cron': '0 * * * *',  # Journal -> snapshot JSON (se oltre la soglia)
+    'job_archiviazione_cron': '0 4 * * *',        # Archivio mensile timbrature esportate
+
+    # Outbox trasferimenti: file prodotti in locale, consegnati in background alla cartella (anche di rete)
+    'transfer_outbox_dir': str(DATA_DIR / 'outbox'),
+    'transfer_timeout_s': 30,        # Timeout di ogni operazione sulla cartella di destinazione
+    'transfer_retry_min_s': 5,       # Primo tentativo dopo un errore, poi raddoppia...
+    'transfer_retry_max_s': 900,     # ...fino a 15 minuti
+    'transfer_workers': 3,           # Export concorrenti (una destinazione per thread)
+    # Watermark di una destinazione nuova: 'ultimo' (default, solo timbrature future), 'pending'
+    # (dalla più vecchia ancora pending: migrazione di ore_txt) o un id esplicito (0 = tutto lo storico)
+    'transfer_watermark_iniziale': {'ore_txt': 'pending'},
     
     # Sync cloud (opzionale)
     'cloud_sync_enabled': False,  # Da attivare se necessario
     'cloud_provider': 'onedrive', # onedrive, dropbox, googledrive
     'sync_interval': 900,         # Sync ogni 15 minuti
+    'cloud_sync_url': '',         # Endpoint HTTP(S) POST batch timbrature (sync_cloud.py)
+    'cloud_sync_token': '',       # Bearer token (vuoto = nessuna autenticazione)
+    'cloud_sync_batch_max': 5000, # Timbrature massime per batch (la dimensione si adatta sotto)
+    'cloud_sync_target_s': 2.0,   # Tempo di risposta obiettivo per batch
     
     # Sicurezza
     'encrypt_data': False,        # Crittografia dati (opzionale)
@@ -162,8 +209,118 @@ CREATE TABLE IF NOT EXISTS timbrature (
 );
 
 CREATE INDEX IF NOT EXISTS idx_badge_timestamp ON timbrature(badge_id, timestamp);
-CREATE INDEX IF NOT EXISTS idx_sync_status ON timbrature(sync_status);
-CREATE INDEX IF NOT EXISTS idx_date ON timbrature(DATE(timestamp));
+-- Timbrature per stato di sincronizzazione in ordine di timestamp (archiviazione, migrazione watermark)
+CREATE INDEX IF NOT EXISTS idx_sync_timestamp ON timbrature(sync_status, timestamp);
+DROP INDEX IF EXISTS idx_sync_status;
+-- Filtri giorno/range come predicati half-open (timestamp >= ? AND timestamp < ?)
+CREATE INDEX IF NOT EXISTS idx_timestamp ON timbrature(timestamp);
+DROP INDEX IF EXISTS idx_date;
+
+-- Contatori statistiche mantenuti da trigger (dashboard in O(1) indipendentemente dallo storico)
+-- Giorno = substr(timestamp, 1, 10) ('YYYY-MM-DD'). Ricostruzione: TigotaSQLiteManager.rebuild_stats()
+CREATE TABLE IF NOT EXISTS daily_stats (
+    giorno TEXT PRIMARY KEY,
+    timbrature INTEGER NOT NULL DEFAULT 0,
+    badge_attivi INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS badge_stats (
+    badge_id TEXT NOT NULL,
+    giorno TEXT NOT NULL,
+    timbrature INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (badge_id, giorno)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS badge_totals (
+    badge_id TEXT PRIMARY KEY,
+    timbrature INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    timbrature INTEGER NOT NULL DEFAULT 0,
+    badge_unici INTEGER NOT NULL DEFAULT 0
+);
+-- Riga presente = cancellazioni che non toccano i contatori (archiviazione: le timbrature spostate
+-- nelle partizioni restano contate). Impostata e tolta dentro la stessa transazione.
+CREATE TABLE IF NOT EXISTS stats_sospese (
+    id INTEGER PRIMARY KEY CHECK (id = 1)
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_timbrature_stats_ins AFTER INSERT ON timbrature
+BEGIN
+    INSERT INTO daily_stats (giorno, timbrature, badge_attivi)
+    VALUES (substr(NEW.timestamp, 1, 10), 1,
+            NOT EXISTS (SELECT 1 FROM badge_stats WHERE badge_id = NEW.badge_id AND giorno = substr(NEW.timestamp, 1, 10)))
+    ON CONFLICT(giorno) DO UPDATE SET
+        timbrature = timbrature + 1,
+        badge_attivi = badge_attivi + excluded.badge_attivi;
+    INSERT INTO badge_stats (badge_id, giorno, timbrature)
+    VALUES (NEW.badge_id, substr(NEW.timestamp, 1, 10), 1)
+    ON CONFLICT(badge_id, giorno) DO UPDATE SET timbrature = timbrature + 1;
+    INSERT INTO stats_totals (id, timbrature, badge_unici)
+    VALUES (1, 1, NOT EXISTS (SELECT 1 FROM badge_totals WHERE badge_id = NEW.badge_id))
+    ON CONFLICT(id) DO UPDATE SET
+        timbrature = timbrature + 1,
+        badge_unici = badge_unici + excluded.badge_unici;
+    INSERT INTO badge_totals (badge_id, timbrature) VALUES (NEW.badge_id, 1)
+    ON CONFLICT(badge_id) DO UPDATE SET timbrature = timbrature + 1;
+END;
+
+DROP TRIGGER IF EXISTS trg_timbrature_stats_del;
+CREATE TRIGGER IF NOT EXISTS trg_timbrature_stats_elimina AFTER DELETE ON timbrature
+WHEN NOT EXISTS (SELECT 1 FROM stats_sospese)
+BEGIN
+    UPDATE badge_stats SET timbrature = timbrature - 1
+    WHERE badge_id = OLD.badge_id AND giorno = substr(OLD.timestamp, 1, 10);
+    UPDATE daily_stats SET
+        timbrature = timbrature - 1,
+        badge_attivi = badge_attivi - EXISTS (SELECT 1 FROM badge_stats WHERE badge_id = OLD.badge_id
+                                              AND giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0)
+    WHERE giorno = substr(OLD.timestamp, 1, 10);
+    DELETE FROM badge_stats WHERE badge_id = OLD.badge_id AND giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0;
+    DELETE FROM daily_stats WHERE giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0;
+    UPDATE badge_totals SET timbrature = timbrature - 1 WHERE badge_id = OLD.badge_id;
+    UPDATE stats_totals SET
+        timbrature = timbrature - 1,
+        badge_unici = badge_unici - EXISTS (SELECT 1 FROM badge_totals WHERE badge_id = OLD.badge_id AND timbrature <= 0)
+    WHERE id = 1;
+    DELETE FROM badge_totals WHERE badge_id = OLD.badge_id AND timbrature <= 0;
+END;
+
+-- Modifica di badge o giorno: equivale a cancellazione + inserimento
+CREATE TRIGGER IF NOT EXISTS trg_timbrature_stats_upd AFTER UPDATE OF badge_id, timestamp ON timbrature
+WHEN OLD.badge_id IS NOT NEW.badge_id OR substr(OLD.timestamp, 1, 10) IS NOT substr(NEW.timestamp, 1, 10)
+BEGIN
+    UPDATE badge_stats SET timbrature = timbrature - 1
+    WHERE badge_id = OLD.badge_id AND giorno = substr(OLD.timestamp, 1, 10);
+    UPDATE daily_stats SET
+        timbrature = timbrature - 1,
+        badge_attivi = badge_attivi - EXISTS (SELECT 1 FROM badge_stats WHERE badge_id = OLD.badge_id
+                                              AND giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0)
+    WHERE giorno = substr(OLD.timestamp, 1, 10);
+    DELETE FROM badge_stats WHERE badge_id = OLD.badge_id AND giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0;
+    DELETE FROM daily_stats WHERE giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0;
+    UPDATE badge_totals SET timbrature = timbrature - 1 WHERE badge_id = OLD.badge_id;
+    UPDATE stats_totals SET
+        timbrature = timbrature - 1,
+        badge_unici = badge_unici - EXISTS (SELECT 1 FROM badge_totals WHERE badge_id = OLD.badge_id AND timbrature <= 0)
+    WHERE id = 1;
+    DELETE FROM badge_totals WHERE badge_id = OLD.badge_id AND timbrature <= 0;
+    INSERT INTO daily_stats (giorno, timbrature, badge_attivi)
+    VALUES (substr(NEW.timestamp, 1, 10), 1,
+            NOT EXISTS (SELECT 1 FROM badge_stats WHERE badge_id = NEW.badge_id AND giorno = substr(NEW.timestamp, 1, 10)))
+    ON CONFLICT(giorno) DO UPDATE SET
+        timbrature = timbrature + 1,
+        badge_attivi = badge_attivi + excluded.badge_attivi;
+    INSERT INTO badge_stats (badge_id, giorno, timbrature)
+    VALUES (NEW.badge_id, substr(NEW.timestamp, 1, 10), 1)
+    ON CONFLICT(badge_id, giorno) DO UPDATE SET timbrature = timbrature + 1;
+    INSERT INTO stats_totals (id, timbrature, badge_unici)
+    VALUES (1, 1, NOT EXISTS (SELECT 1 FROM badge_totals WHERE badge_id = NEW.badge_id))
+    ON CONFLICT(id) DO UPDATE SET
+        timbrature = timbrature + 1,
+        badge_unici = badge_unici + excluded.badge_unici;
+    INSERT INTO badge_totals (badge_id, timbrature) VALUES (NEW.badge_id, 1)
+    ON CONFLICT(badge_id) DO UPDATE SET timbrature = timbrature + 1;
+END;
 
 -- Anagrafica dipendenti con abbinamento badge NFC
 CREATE TABLE IF NOT EXISTS dipendenti (
@@ -179,6 +336,50 @@ CREATE TABLE IF NOT EXISTS dipendenti (
 
 CREATE INDEX IF NOT EXISTS idx_dipendenti_codice ON dipendenti(codice);
 CREATE INDEX IF NOT EXISTS idx_dipendenti_badge ON dipendenti(badge_id);
+
+-- Versione anagrafica: incrementata dai trigger, confrontata dagli indici in memoria dei processi
+CREATE TABLE IF NOT EXISTS roster_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO roster_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_dipendenti_version_ins AFTER INSERT ON dipendenti
+BEGIN
+    UPDATE roster_version SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_dipendenti_version_upd AFTER UPDATE ON dipendenti
+BEGIN
+    UPDATE roster_version SET version = version + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_dipendenti_version_del AFTER DELETE ON dipendenti
+BEGIN
+    UPDATE roster_version SET version = version + 1 WHERE id = 1;
+END;
+
+-- Watermark trasferimenti: ultimo id timbrature esportato per destinazione (export = range id > last_id)
+CREATE TABLE IF NOT EXISTS transfer_watermark (
+    destinazione TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL DEFAULT 0,
+    righe_esportate INTEGER NOT NULL DEFAULT 0,       -- Righe dell'ultimo export
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Journal dei batch di trasferimento (exactly-once): fase registrata prima/dopo ogni passo
+CREATE TABLE IF NOT EXISTS transfer_batches (
+    batch_id TEXT PRIMARY KEY,
+    destinazione TEXT NOT NULL,
+    from_id INTEGER NOT NULL,                        -- Watermark di partenza (escluso)
+    to_id INTEGER NOT NULL,                          -- Ultimo id del batch (incluso)
+    file_name TEXT NOT NULL,
+    righe INTEGER,
+    sha256 TEXT,                                     -- Checksum del file scritto
+    fase TEXT NOT NULL CHECK (fase IN ('preparato', 'scritto', 'pubblicato', 'confermato', 'annullato')),
+    errore TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_transfer_batches_aperti ON transfer_batches(destinazione, fase);
 """
 
 # Configurazione per diversi ambienti
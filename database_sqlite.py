@@ -2,7 +2,14 @@
 TIGOTÀ Sistema Timbratura - Database Manager SQLite Professionale
 Gestione storage robusto con SQLite per produzione aziendale
 - Thread-safe operations
-- Backup automatico 
+- Connessioni persistenti (una per thread) con cache statement
+- Backup automatico online (SQLite backup API), compresso e verificato
+- Journal JSON-Lines incrementale (append O(1) per timbratura)
+- Scrittura write-behind con group commit (UI mai bloccata dal database)
+- Indice anagrafica in memoria per risoluzione badge/codice
+- Contatori statistiche mantenuti da trigger (daily_stats / badge_stats)
+- Archivio mensile delle timbrature sincronizzate (un file SQLite per mese)
+- Import massivo (executemany a blocchi) e import del JSON legacy
 - Integrità dati garantita
 - Export CSV/JSON
 """
@@ -10,15 +17,19 @@ Gestione storage robusto con SQLite per produzione aziendale
 import sqlite3
 import json
 import os
-import shutil
 import csv
+import gzip
+import heapq
 from datetime import datetime, date, timedelta
 from pathlib import Path
 import hashlib
 import logging
 import threading
+import queue
+import time
+import uuid
 from contextlib import contextmanager
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 try:
     from config_tablet import DATA_CONFIG, DATABASE_SCHEMA, DATA_DIR, LOGS_DIR, BACKUP_DIR, EXPORT_DIR
@@ -27,11 +38,47 @@ except ImportError:
     DATA_CONFIG = {
         'database_file': 'timbrature.db',
         'timbrature_file': 'timbrature.json',
+        'timbrature_journal_file': 'timbrature.jsonl',
+        'journal_compact_interval': 3600,
+        'journal_compact_min_bytes': 1048576,
+        'timbrature_queue_file': 'timbrature_queue.jsonl',
+        'write_behind_batch_size': 256,
+        'write_behind_fsync': True,
+        'write_behind_retry_s': 30,
+        'roster_refresh_interval': 2.0,
+        'archive_dir': 'archivio',
+        'archive_after_days': 90,
         'use_database': True,
         'daily_export': True,
         'backup_interval': 3600,
-        'max_backup_days': 30
+        'max_backup_days': 30,
+        'compress_backups': True,
+        'backup_step_pages': 256,
+        'sqlite_journal_mode': 'WAL',
+        'sqlite_synchronous': 'NORMAL',
+        'sqlite_cache_size_kb': 8192,
+        'sqlite_cached_statements': 256,
+        'scheduler_state_file': 'scheduler_stato.json',
+        'job_backup_cron': '30 1 * * *',
+        'job_pulizia_backup_cron': '0 5 * * *',
+        'job_integrita_cron': '0 3 * * 0',
+        'job_compattazione_journal_cron': '0 * * * *',
+        'job_archiviazione_cron': '0 4 * * *',
+        'transfer_outbox_dir': 'outbox',
+        'transfer_timeout_s': 30,
+        'transfer_retry_min_s': 5,
+        'transfer_retry_max_s': 900,
+        'transfer_workers': 3,
+        'cloud_sync_enabled': False,
+        'sync_interval': 900,
+        'cloud_sync_url': '',
+        'cloud_sync_token': '',
+        'cloud_sync_batch_max': 5000,
+        'cloud_sync_target_s': 2.0,
+        'transfer_watermark_iniziale': {'ore_txt': 'pending'}
     }
+    # Stesso schema di config_tablet.DATABASE_SCHEMA (tabelle, contatori, trigger, journal trasferimenti):
+    # va tenuto allineato, il manager legge tutte queste tabelle
     DATABASE_SCHEMA = """
     CREATE TABLE IF NOT EXISTS timbrature (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -42,10 +89,185 @@ except ImportError:
         tipo TEXT NOT NULL CHECK (tipo IN ('entrata', 'uscita')),
         location TEXT DEFAULT 'tablet_principale',
         tablet_id TEXT DEFAULT 'TIGOTA_001',
-        sync_status TEXT DEFAULT 'pending',
+        sync_status TEXT DEFAULT 'pending' CHECK (sync_status IN ('pending', 'synced', 'error')),
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        hash_verify TEXT
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        hash_verify TEXT,
+        notes TEXT
     );
+
+    CREATE INDEX IF NOT EXISTS idx_badge_timestamp ON timbrature(badge_id, timestamp);
+    -- Timbrature per stato di sincronizzazione in ordine di timestamp (archiviazione, migrazione watermark)
+    CREATE INDEX IF NOT EXISTS idx_sync_timestamp ON timbrature(sync_status, timestamp);
+    DROP INDEX IF EXISTS idx_sync_status;
+    -- Filtri giorno/range come predicati half-open (timestamp >= ? AND timestamp < ?)
+    CREATE INDEX IF NOT EXISTS idx_timestamp ON timbrature(timestamp);
+    DROP INDEX IF EXISTS idx_date;
+
+    -- Contatori statistiche mantenuti da trigger (dashboard in O(1) indipendentemente dallo storico)
+    -- Giorno = substr(timestamp, 1, 10) ('YYYY-MM-DD'). Ricostruzione: TigotaSQLiteManager.rebuild_stats()
+    CREATE TABLE IF NOT EXISTS daily_stats (
+        giorno TEXT PRIMARY KEY,
+        timbrature INTEGER NOT NULL DEFAULT 0,
+        badge_attivi INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS badge_stats (
+        badge_id TEXT NOT NULL,
+        giorno TEXT NOT NULL,
+        timbrature INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (badge_id, giorno)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS badge_totals (
+        badge_id TEXT PRIMARY KEY,
+        timbrature INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stats_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        timbrature INTEGER NOT NULL DEFAULT 0,
+        badge_unici INTEGER NOT NULL DEFAULT 0
+    );
+    -- Riga presente = cancellazioni che non toccano i contatori (archiviazione: le timbrature spostate
+    -- nelle partizioni restano contate). Impostata e tolta dentro la stessa transazione.
+    CREATE TABLE IF NOT EXISTS stats_sospese (
+        id INTEGER PRIMARY KEY CHECK (id = 1)
+    );
+
+    CREATE TRIGGER IF NOT EXISTS trg_timbrature_stats_ins AFTER INSERT ON timbrature
+    BEGIN
+        INSERT INTO daily_stats (giorno, timbrature, badge_attivi)
+        VALUES (substr(NEW.timestamp, 1, 10), 1,
+                NOT EXISTS (SELECT 1 FROM badge_stats WHERE badge_id = NEW.badge_id AND giorno = substr(NEW.timestamp, 1, 10)))
+        ON CONFLICT(giorno) DO UPDATE SET
+            timbrature = timbrature + 1,
+            badge_attivi = badge_attivi + excluded.badge_attivi;
+        INSERT INTO badge_stats (badge_id, giorno, timbrature)
+        VALUES (NEW.badge_id, substr(NEW.timestamp, 1, 10), 1)
+        ON CONFLICT(badge_id, giorno) DO UPDATE SET timbrature = timbrature + 1;
+        INSERT INTO stats_totals (id, timbrature, badge_unici)
+        VALUES (1, 1, NOT EXISTS (SELECT 1 FROM badge_totals WHERE badge_id = NEW.badge_id))
+        ON CONFLICT(id) DO UPDATE SET
+            timbrature = timbrature + 1,
+            badge_unici = badge_unici + excluded.badge_unici;
+        INSERT INTO badge_totals (badge_id, timbrature) VALUES (NEW.badge_id, 1)
+        ON CONFLICT(badge_id) DO UPDATE SET timbrature = timbrature + 1;
+    END;
+
+    DROP TRIGGER IF EXISTS trg_timbrature_stats_del;
+    CREATE TRIGGER IF NOT EXISTS trg_timbrature_stats_elimina AFTER DELETE ON timbrature
+    WHEN NOT EXISTS (SELECT 1 FROM stats_sospese)
+    BEGIN
+        UPDATE badge_stats SET timbrature = timbrature - 1
+        WHERE badge_id = OLD.badge_id AND giorno = substr(OLD.timestamp, 1, 10);
+        UPDATE daily_stats SET
+            timbrature = timbrature - 1,
+            badge_attivi = badge_attivi - EXISTS (SELECT 1 FROM badge_stats WHERE badge_id = OLD.badge_id
+                                                  AND giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0)
+        WHERE giorno = substr(OLD.timestamp, 1, 10);
+        DELETE FROM badge_stats WHERE badge_id = OLD.badge_id AND giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0;
+        DELETE FROM daily_stats WHERE giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0;
+        UPDATE badge_totals SET timbrature = timbrature - 1 WHERE badge_id = OLD.badge_id;
+        UPDATE stats_totals SET
+            timbrature = timbrature - 1,
+            badge_unici = badge_unici - EXISTS (SELECT 1 FROM badge_totals WHERE badge_id = OLD.badge_id AND timbrature <= 0)
+        WHERE id = 1;
+        DELETE FROM badge_totals WHERE badge_id = OLD.badge_id AND timbrature <= 0;
+    END;
+
+    -- Modifica di badge o giorno: equivale a cancellazione + inserimento
+    CREATE TRIGGER IF NOT EXISTS trg_timbrature_stats_upd AFTER UPDATE OF badge_id, timestamp ON timbrature
+    WHEN OLD.badge_id IS NOT NEW.badge_id OR substr(OLD.timestamp, 1, 10) IS NOT substr(NEW.timestamp, 1, 10)
+    BEGIN
+        UPDATE badge_stats SET timbrature = timbrature - 1
+        WHERE badge_id = OLD.badge_id AND giorno = substr(OLD.timestamp, 1, 10);
+        UPDATE daily_stats SET
+            timbrature = timbrature - 1,
+            badge_attivi = badge_attivi - EXISTS (SELECT 1 FROM badge_stats WHERE badge_id = OLD.badge_id
+                                                  AND giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0)
+        WHERE giorno = substr(OLD.timestamp, 1, 10);
+        DELETE FROM badge_stats WHERE badge_id = OLD.badge_id AND giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0;
+        DELETE FROM daily_stats WHERE giorno = substr(OLD.timestamp, 1, 10) AND timbrature <= 0;
+        UPDATE badge_totals SET timbrature = timbrature - 1 WHERE badge_id = OLD.badge_id;
+        UPDATE stats_totals SET
+            timbrature = timbrature - 1,
+            badge_unici = badge_unici - EXISTS (SELECT 1 FROM badge_totals WHERE badge_id = OLD.badge_id AND timbrature <= 0)
+        WHERE id = 1;
+        DELETE FROM badge_totals WHERE badge_id = OLD.badge_id AND timbrature <= 0;
+        INSERT INTO daily_stats (giorno, timbrature, badge_attivi)
+        VALUES (substr(NEW.timestamp, 1, 10), 1,
+                NOT EXISTS (SELECT 1 FROM badge_stats WHERE badge_id = NEW.badge_id AND giorno = substr(NEW.timestamp, 1, 10)))
+        ON CONFLICT(giorno) DO UPDATE SET
+            timbrature = timbrature + 1,
+            badge_attivi = badge_attivi + excluded.badge_attivi;
+        INSERT INTO badge_stats (badge_id, giorno, timbrature)
+        VALUES (NEW.badge_id, substr(NEW.timestamp, 1, 10), 1)
+        ON CONFLICT(badge_id, giorno) DO UPDATE SET timbrature = timbrature + 1;
+        INSERT INTO stats_totals (id, timbrature, badge_unici)
+        VALUES (1, 1, NOT EXISTS (SELECT 1 FROM badge_totals WHERE badge_id = NEW.badge_id))
+        ON CONFLICT(id) DO UPDATE SET
+            timbrature = timbrature + 1,
+            badge_unici = badge_unici + excluded.badge_unici;
+        INSERT INTO badge_totals (badge_id, timbrature) VALUES (NEW.badge_id, 1)
+        ON CONFLICT(badge_id) DO UPDATE SET timbrature = timbrature + 1;
+    END;
+
+    -- Anagrafica dipendenti con abbinamento badge NFC
+    CREATE TABLE IF NOT EXISTS dipendenti (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        codice TEXT NOT NULL UNIQUE,                     -- Codice dipendente (univoco)
+        nome TEXT NOT NULL,                              -- Nome
+        cognome TEXT,                                    -- Cognome facoltativo
+        badge_id TEXT UNIQUE,                            -- Codice badge NFC (univoco, può essere NULL fino ad abbinamento)
+        attivo INTEGER DEFAULT 1,                        -- Flag attivo
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_dipendenti_codice ON dipendenti(codice);
+    CREATE INDEX IF NOT EXISTS idx_dipendenti_badge ON dipendenti(badge_id);
+
+    -- Versione anagrafica: incrementata dai trigger, confrontata dagli indici in memoria dei processi
+    CREATE TABLE IF NOT EXISTS roster_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO roster_version (id, version) VALUES (1, 0);
+
+    CREATE TRIGGER IF NOT EXISTS trg_dipendenti_version_ins AFTER INSERT ON dipendenti
+    BEGIN
+        UPDATE roster_version SET version = version + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_dipendenti_version_upd AFTER UPDATE ON dipendenti
+    BEGIN
+        UPDATE roster_version SET version = version + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_dipendenti_version_del AFTER DELETE ON dipendenti
+    BEGIN
+        UPDATE roster_version SET version = version + 1 WHERE id = 1;
+    END;
+
+    -- Watermark trasferimenti: ultimo id timbrature esportato per destinazione (export = range id > last_id)
+    CREATE TABLE IF NOT EXISTS transfer_watermark (
+        destinazione TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0,
+        righe_esportate INTEGER NOT NULL DEFAULT 0,       -- Righe dell'ultimo export
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Journal dei batch di trasferimento (exactly-once): fase registrata prima/dopo ogni passo
+    CREATE TABLE IF NOT EXISTS transfer_batches (
+        batch_id TEXT PRIMARY KEY,
+        destinazione TEXT NOT NULL,
+        from_id INTEGER NOT NULL,                        -- Watermark di partenza (escluso)
+        to_id INTEGER NOT NULL,                          -- Ultimo id del batch (incluso)
+        file_name TEXT NOT NULL,
+        righe INTEGER,
+        sha256 TEXT,                                     -- Checksum del file scritto
+        fase TEXT NOT NULL CHECK (fase IN ('preparato', 'scritto', 'pubblicato', 'confermato', 'annullato')),
+        errore TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_transfer_batches_aperti ON transfer_batches(destinazione, fase);
     """
     DATA_DIR = Path('./data')
     LOGS_DIR = Path('./logs')
@@ -53,6 +275,470 @@ except ImportError:
     EXPORT_DIR = Path('./export')
 
 
+# Partizioni di archivio mensili: stesse colonne di timbrature, id originale conservato
+ARCHIVE_COLUMNS = (
+    'id', 'badge_id', 'dipendente_nome', 'dipendente_cognome', 'timestamp', 'tipo',
+    'location', 'tablet_id', 'sync_status', 'created_at', 'updated_at', 'hash_verify', 'notes'
+)
+ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS {db}.timbrature (
+        id INTEGER PRIMARY KEY,
+        badge_id TEXT NOT NULL,
+        dipendente_nome TEXT,
+        dipendente_cognome TEXT,
+        timestamp DATETIME NOT NULL,
+        tipo TEXT NOT NULL,
+        location TEXT,
+        tablet_id TEXT,
+        sync_status TEXT,
+        created_at DATETIME,
+        updated_at DATETIME,
+        hash_verify TEXT,
+        notes TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS {db}.idx_timestamp ON timbrature(timestamp)",
+)
+# Limite SQLite di database collegati (ATTACH) per connessione
+MAX_ATTACHED = 10
+# Destinazione predefinita dei trasferimenti (file ORE*.TXT per il payroll)
+DEFAULT_TRANSFER_DEST = 'ore_txt'
+# Parametri per statement ben sotto SQLITE_MAX_VARIABLE_NUMBER (999 nelle build più vecchie)
+MAX_SQL_PARAMS = 500
+
+
+class SQLiteConnectionPool:
+    """
+    Pool di connessioni SQLite persistenti: una connessione per thread.
+
+    Ogni connessione viene aperta e configurata una sola volta (PRAGMA journal_mode,
+    synchronous, cache_size) e mantiene la propria cache di prepared statement
+    (`cached_statements`), evitando a ogni query i costi di apertura file e parsing schema.
+    """
+
+    def __init__(self, db_path: str, timeout: float = 30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.journal_mode = str(DATA_CONFIG.get('sqlite_journal_mode', 'WAL')).upper()
+        self.synchronous = str(DATA_CONFIG.get('sqlite_synchronous', 'NORMAL')).upper()
+        self.cache_size_kb = int(DATA_CONFIG.get('sqlite_cache_size_kb', 8192))
+        self.cached_statements = int(DATA_CONFIG.get('sqlite_cached_statements', 256))
+        # Connessioni per thread (chiave: ident del thread)
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+        # Profondità di annidamento dei context manager per thread
+        self._local = threading.local()
+
+    def _open(self) -> sqlite3.Connection:
+        """Apre e configura una nuova connessione"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,  # Timeout per evitare deadlock
+            check_same_thread=False,  # La connessione può essere chiusa da altri thread
+            cached_statements=self.cached_statements
+        )
+        # Row factory per accesso per nome colonna
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        # Valore negativo = dimensione in KiB
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def open_dedicated(self) -> sqlite3.Connection:
+        """Connessione configurata ma non gestita dal pool (es. letture con ATTACH); va chiusa dal chiamante"""
+        return self._open()
+
+    def _prune_dead_threads(self):
+        """Chiude le connessioni dei thread terminati (chiamato con lock acquisito)"""
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._connections if i not in alive]:
+            try:
+                self._connections.pop(ident).close()
+            except Exception:
+                pass
+
+    def acquire(self) -> sqlite3.Connection:
+        """Ritorna la connessione del thread corrente, aprendola al primo uso"""
+        ident = threading.get_ident()
+        conn = self._connections.get(ident)
+        if conn is None:
+            with self._lock:
+                self._prune_dead_threads()
+                conn = self._open()
+                self._connections[ident] = conn
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager sulla connessione del thread corrente.
+
+        All'uscita del blocco più esterno una transazione lasciata aperta viene annullata,
+        come avveniva chiudendo la connessione: nessun lock di scrittura resta appeso.
+        """
+        conn = self.acquire()
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._local.depth = depth
+            if depth == 0 and conn.in_transaction:
+                conn.rollback()
+
+    def close_all(self):
+        """Chiude tutte le connessioni aperte dal pool"""
+        with self._lock:
+            for conn in self._connections.values():
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._connections.clear()
+
+    def size(self) -> int:
+        """Numero di connessioni attualmente aperte"""
+        return len(self._connections)
+
+
+class TimbratureJournal:
+    """
+    Journal append-only in formato JSON-Lines: una riga per timbratura salvata.
+
+    Sostituisce il dump completo di `timbrature.json` a ogni timbratura: il costo per
+    scrittura resta costante al crescere della tabella. Lo snapshot nel formato legacy
+    (array JSON) viene rigenerato dalla compattazione in background; le righe del journal
+    con id già inclusi nello snapshot vengono poi eliminate.
+    """
+
+    def __init__(self, journal_path: str):
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._fh = None
+
+    def append(self, record: Dict):
+        """Aggiunge un record (una riga JSON) in coda al journal"""
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.journal_path, 'a', encoding='utf-8')
+            self._fh.write(line)
+            self._fh.flush()
+
+    def records(self, after_id: int = 0):
+        """Itera i record del journal con id > after_id (righe troncate ignorate)"""
+        with self._lock:
+            if self._fh is not None:
+                self._fh.flush()
+            if not os.path.exists(self.journal_path):
+                return []
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        result = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Riga incompleta (es. crash durante la scrittura)
+            if (record.get('id') or 0) > after_id:
+                result.append(record)
+        return result
+
+    def truncate_through(self, max_id: int):
+        """Rimuove dal journal i record con id <= max_id (già presenti nello snapshot)"""
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            if not os.path.exists(self.journal_path):
+                return
+            tmp_path = self.journal_path + ".tmp"
+            with open(self.journal_path, 'r', encoding='utf-8') as src, \
+                    open(tmp_path, 'w', encoding='utf-8') as dst:
+                for line in src:
+                    try:
+                        if (json.loads(line).get('id') or 0) <= max_id:
+                            continue
+                    except ValueError:
+                        continue
+                    dst.write(line)
+            os.replace(tmp_path, self.journal_path)
+
+    def size_bytes(self) -> int:
+        """Dimensione corrente del file journal (0 se assente)"""
+        with self._lock:
+            if self._fh is not None:
+                self._fh.flush()
+            try:
+                return os.path.getsize(self.journal_path)
+            except OSError:
+                return 0
+
+    def reset(self):
+        """Svuota il journal"""
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+class TimbratureWriteBehind:
+    """
+    Coda write-behind durevole per le timbrature.
+
+    Il thread UI accoda la timbratura e ritorna subito: il record viene prima scritto
+    (una riga) nel file di spool, poi un thread dedicato raggruppa le timbrature in coda
+    e le salva in un'unica transazione (group commit). L'esito viene notificato alla
+    callback `callback(ok, record)` dal thread writer. Allo startup lo spool viene
+    riprodotto, saltando i record già presenti nel database.
+
+    Durabilità: con `fsync=True` lo spool viene sincronizzato su disco (os.fsync) una volta
+    per gruppo, prima del commit; una timbratura accodata è quindi al sicuro da un crash
+    del processo subito, da un'interruzione di corrente dal group commit in cui entra.
+    Con `fsync=False` lo spool copre solo il crash del processo.
+    Un gruppo che fallisce 3 volte resta nello spool e viene riaccodato dopo `retry_s`.
+    """
+
+    def __init__(self, manager: 'TigotaSQLiteManager', spool_path: str, batch_size: int = 256,
+                 fsync: bool = True, retry_s: float = 30.0):
+        self.manager = manager
+        self.spool_path = spool_path
+        self.batch_size = max(1, batch_size)
+        self.fsync = fsync
+        self.retry_s = retry_s
+        self._queue = queue.Queue()
+        self._spool_lock = threading.Lock()
+        self._spool_fh = None
+        self._pending = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._retry_timers = []
+
+    def start(self):
+        """Riproduce lo spool residuo e avvia il thread writer"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._replay_spool()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='TimbratureWriter', daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict, callback=None):
+        """Accoda un record preparato da `_prepare_timbratura` (non bloccante)"""
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._spool_lock:
+            if self._spool_fh is None:
+                self._spool_fh = open(self.spool_path, 'a', encoding='utf-8')
+            self._spool_fh.write(line)
+            self._spool_fh.flush()
+            self._pending += 1
+        self._queue.put((record, callback))
+
+    def _replay_spool(self):
+        """Salva le timbrature rimaste nello spool (es. dopo un crash) non ancora nel database"""
+        if not os.path.exists(self.spool_path):
+            return
+        records = []
+        with open(self.spool_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                    records.append(record)
+                except (ValueError, KeyError, TypeError):
+                    continue  # Riga incompleta
+        missing = self.manager._filter_unsaved(records)
+        if missing:
+            self.manager._insert_timbrature(missing)
+            self.manager.logger.info(f"♻️ Spool timbrature riprodotto: {len(missing)} record recuperati")
+        with self._spool_lock:
+            if self._pending == 0:
+                self._truncate_spool()
+
+    def _sync_spool(self):
+        """Porta su disco le righe di spool scritte finora (una fsync per group commit)"""
+        with self._spool_lock:
+            if self._spool_fh is not None:
+                self._spool_fh.flush()
+                os.fsync(self._spool_fh.fileno())
+
+    def _truncate_spool(self):
+        """Svuota lo spool (chiamato con _spool_lock acquisito)"""
+        if self._spool_fh is not None:
+            self._spool_fh.close()
+            self._spool_fh = None
+        open(self.spool_path, 'w', encoding='utf-8').close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            stop_after = False
+            while len(batch) < self.batch_size:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop_after = True
+                    break
+                batch.append(nxt)
+            self._write_batch(batch)
+            if stop_after:
+                break
+
+    def _write_batch(self, batch):
+        records = [record for record, _ in batch]
+        if self.fsync:
+            try:
+                self._sync_spool()
+            except OSError as e:
+                self.manager.logger.error(f"❌ Errore fsync spool timbrature: {e}")
+        ok = False
+        for attempt in range(3):
+            try:
+                self.manager._insert_timbrature(records)
+                ok = True
+                break
+            except Exception as e:
+                self.manager.logger.error(f"❌ Errore group commit ({len(records)} timbrature, tentativo {attempt + 1}): {e}")
+                time.sleep(0.5 * (attempt + 1))
+        if ok:
+            self.manager.logger.info(f"✅ Group commit: {len(records)} timbrature salvate")
+            with self._spool_lock:
+                self._pending -= len(records)
+                if self._pending == 0:
+                    self._truncate_spool()
+        else:
+            # Lo spool resta intatto: il gruppo viene riaccodato più tardi (o riprodotto al riavvio)
+            self._schedule_retry(records)
+        for record, callback in batch:
+            if callback:
+                try:
+                    callback(ok, record)
+                except Exception as e:
+                    self.manager.logger.error(f"Errore callback timbratura: {e}")
+
+    def _schedule_retry(self, records: List[Dict]):
+        """Riaccoda dopo retry_s le timbrature di un gruppo fallito (già nello spool, senza callback)"""
+        if self.retry_s <= 0 or self._stop.is_set():
+            return
+
+        def _requeue():
+            with self._spool_lock:
+                if timer in self._retry_timers:
+                    self._retry_timers.remove(timer)
+            if self._stop.is_set():
+                return
+            self.manager.logger.info(f"♻️ Nuovo tentativo group commit: {len(records)} timbrature riaccodate")
+            for record in records:
+                self._queue.put((record, None))
+
+        timer = threading.Timer(self.retry_s, _requeue)
+        timer.daemon = True
+        with self._spool_lock:
+            self._retry_timers.append(timer)
+        timer.start()
+
+    def pending_count(self) -> int:
+        return self._pending
+
+    def stop(self, timeout: float = 5.0):
+        """Svuota la coda e ferma il thread writer (i gruppi in attesa di retry restano nello spool)"""
+        self._stop.set()
+        with self._spool_lock:
+            timers, self._retry_timers = self._retry_timers, []
+        for timer in timers:
+            timer.cancel()
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=timeout)
+        with self._spool_lock:
+            if self._spool_fh is not None:
+                self._spool_fh.close()
+                self._spool_fh = None
+
+
+class RosterIndex:
+    """
+    Indice in memoria dell'anagrafica dipendenti, per badge_id normalizzato e per codice.
+
+    Caricato una volta all'avvio e aggiornato in place dalle scritture del manager.
+    `version` rispecchia il contatore `roster_version` del database (incrementato da
+    trigger su `dipendenti`): se un altro processo modifica l'anagrafica il contatore
+    cambia e l'indice viene ricaricato.
+    """
+
+    def __init__(self):
+        self._by_badge: Dict[str, Dict] = {}
+        self._by_codice: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self.version = -1
+        self.last_check = 0.0
+
+    @staticmethod
+    def normalize_badge(badge_id) -> str:
+        return str(badge_id or '').strip()
+
+    def load(self, rows, version: int):
+        """Sostituisce l'intero contenuto dell'indice"""
+        by_badge, by_codice = {}, {}
+        for row in rows:
+            dip = dict(row)
+            by_codice[dip['codice']] = dip
+            badge = self.normalize_badge(dip.get('badge_id'))
+            if badge:
+                by_badge[badge] = dip
+        with self._lock:
+            self._by_badge, self._by_codice = by_badge, by_codice
+            self.version = version
+
+    def put(self, row):
+        """Inserisce/aggiorna un dipendente, mantenendo l'unicità del badge"""
+        dip = dict(row)
+        badge = self.normalize_badge(dip.get('badge_id'))
+        with self._lock:
+            old = self._by_codice.get(dip['codice'])
+            if old is not None:
+                old_badge = self.normalize_badge(old.get('badge_id'))
+                if old_badge and self._by_badge.get(old_badge) is old:
+                    del self._by_badge[old_badge]
+            if badge:
+                previous = self._by_badge.get(badge)
+                if previous is not None and previous['codice'] != dip['codice']:
+                    previous['badge_id'] = None
+                self._by_badge[badge] = dip
+            self._by_codice[dip['codice']] = dip
+
+    def by_badge(self, badge_id) -> Optional[Dict]:
+        dip = self._by_badge.get(self.normalize_badge(badge_id))
+        return dict(dip) if dip else None
+
+    def by_codice(self, codice) -> Optional[Dict]:
+        dip = self._by_codice.get(codice)
+        return dict(dip) if dip else None
+
+    def __len__(self):
+        return len(self._by_codice)
+
+
 class TigotaSQLiteManager:
     """
     Database Manager SQLite professionale per sistema timbratura TIGOTÀ
@@ -66,13 +752,30 @@ class TigotaSQLiteManager:
     - Logging completo operazioni
     """
     
-    def __init__(self):
-        self.db_path = DATA_CONFIG.get('database_file', str(DATA_DIR / 'timbrature.db'))
-        self.json_backup_path = DATA_CONFIG.get('timbrature_file', str(DATA_DIR / 'timbrature.json'))
+    def __init__(self, db_path: Optional[str] = None, json_backup_path: Optional[str] = None):
+        self.db_path = db_path or DATA_CONFIG.get('database_file', str(DATA_DIR / 'timbrature.db'))
+        self.json_backup_path = json_backup_path or DATA_CONFIG.get('timbrature_file', str(DATA_DIR / 'timbrature.json'))
         
         # Thread lock per operazioni sicure multi-thread
         self._db_lock = threading.Lock()
         
+        # Pool connessioni persistenti (una per thread)
+        self._pool = SQLiteConnectionPool(self.db_path, timeout=30.0)
+        
+        # Journal JSON-Lines incrementale + compattazione periodica in background
+        # Con percorsi espliciti i file dati stanno accanto allo snapshot JSON
+        self._custom_paths = bool(json_backup_path)
+        self.journal_path = self._companion_path('timbrature_journal_file', '.jsonl')
+        self.archive_dir = self._archive_dir()
+        self._journal = TimbratureJournal(self.journal_path)
+        self._compaction_lock = threading.Lock()
+        self._compactor_stop = threading.Event()
+        self._compactor_thread = None
+        
+        # Destinazioni di trasferimento configurate, per gruppo (vedi set_transfer_destinations)
+        self._transfer_destinations: Dict[str, List[str]] = {}
+        self._transfer_destinations_lock = threading.Lock()
+        
         # Setup directory struttura PRIMA di tutto
         self._setup_directories()
         
@@ -82,8 +785,38 @@ class TigotaSQLiteManager:
         # Inizializza database
         self._init_database()
         
+        # Indice anagrafica in memoria (badge/codice)
+        self._roster = RosterIndex()
+        self._roster_refresh_interval = float(DATA_CONFIG.get('roster_refresh_interval', 2.0))
+        self._reload_roster()
+        
+        # Avvia compattazione periodica del journal
+        self._start_journal_compactor()
+        
+        # Writer write-behind (group commit) con spool durevole
+        self._writer = TimbratureWriteBehind(
+            self,
+            self._companion_path('timbrature_queue_file', '_queue.jsonl'),
+            batch_size=int(DATA_CONFIG.get('write_behind_batch_size', 256)),
+            fsync=bool(DATA_CONFIG.get('write_behind_fsync', True)),
+            retry_s=float(DATA_CONFIG.get('write_behind_retry_s', 30))
+        )
+        self._writer.start()
+        
         self.logger.info("TigotaSQLiteManager inizializzato con successo")
     
+    def _companion_path(self, config_key: str, suffix: str) -> str:
+        """Percorso di un file dati: da DATA_CONFIG, oppure accanto allo snapshot JSON"""
+        configured = None if self._custom_paths else DATA_CONFIG.get(config_key)
+        return configured or os.path.splitext(self.json_backup_path)[0] + suffix
+    
+    def _archive_dir(self) -> str:
+        """Cartella delle partizioni di archivio mensili"""
+        configured = DATA_CONFIG.get('archive_dir', 'archivio')
+        if self._custom_paths or not os.path.isabs(str(configured)):
+            return os.path.join(os.path.dirname(os.path.abspath(self.db_path)), os.path.basename(str(configured)))
+        return str(configured)
+    
     def _setup_directories(self):
         """Crea struttura directory produzione"""
         directories = [DATA_DIR, LOGS_DIR, BACKUP_DIR, EXPORT_DIR]
@@ -133,6 +866,12 @@ class TigotaSQLiteManager:
                 self.logger.info(f"Database SQLite inizializzato: {self.db_path}")
                 self.logger.info(f"Tabelle create: {[table[0] for table in tables]}")
                 
+                # Contatori statistiche appena creati su un database esistente: popolali dallo storico
+                if 'stats_totals' in [t[0] for t in tables]:
+                    cursor.execute("SELECT COUNT(*) FROM stats_totals")
+                    if cursor.fetchone()[0] == 0:
+                        self.rebuild_stats()
+                
                 # Test di integrità
                 self._verify_database_integrity()
                 
@@ -142,25 +881,13 @@ class TigotaSQLiteManager:
     
     @contextmanager 
     def _get_db_connection(self):
-        """Context manager per connessioni SQLite thread-safe"""
-        conn = None
+        """Context manager per connessioni SQLite thread-safe (connessione persistente del thread)"""
         try:
-            conn = sqlite3.connect(
-                self.db_path,
-                timeout=30.0,  # Timeout 30 secondi per evitare deadlock
-                check_same_thread=False  # Permette uso multi-thread
-            )
-            # Row factory per accesso per nome colonna
-            conn.row_factory = sqlite3.Row
-            yield conn
+            with self._pool.connection() as conn:
+                yield conn
         except Exception as e:
-            if conn:
-                conn.rollback()
             self.logger.error(f"Errore connessione database: {e}")
             raise
-        finally:
-            if conn:
-                conn.close()
     
     def _verify_database_integrity(self):
         """Verifica integrità database SQLite"""
@@ -199,6 +926,162 @@ class TigotaSQLiteManager:
         except Exception:
             return None
     
+    # --- Query layer: filtri giorno/range index-friendly ---
+    # Predicati half-open su idx_timestamp: mai DATE(timestamp), che impedisce l'uso dell'indice.
+    _RANGE_QUERIES = {
+        'timbrature_range': """
+            SELECT * FROM timbrature
+            WHERE timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp DESC
+        """,
+    }
+    # Contatori della dashboard: lookup per chiave primaria sulle tabelle statistiche
+    _STATS_QUERIES = {
+        'stats_totals': "SELECT timbrature, badge_unici FROM stats_totals WHERE id = 1",
+        'daily_stats': "SELECT timbrature, badge_attivi FROM daily_stats WHERE giorno = ?",
+    }
+    # Trasferimenti: watermark per destinazione e range sulla chiave primaria oltre il watermark.
+    # '+sync_status' esclude idx_sync_timestamp e '+timestamp' impedisce di percorrere tutto
+    # idx_timestamp per evitare l'ordinamento: la scansione resta limitata al range di id.
+    _TRANSFER_QUERIES = {
+        'transfer_watermark': "SELECT last_id FROM transfer_watermark WHERE destinazione = ?",
+        'transfer_count': "SELECT COUNT(*) FROM timbrature WHERE id > ? AND +sync_status = 'pending'",
+        'transfer_pending': """
+            SELECT * FROM timbrature WHERE id > ? AND +sync_status = 'pending' ORDER BY +timestamp, id
+        """,
+        'transfer_export': """
+            SELECT t.id, t.badge_id, t.tipo, t.timestamp, d.codice,
+                   COALESCE(d.nome, t.dipendente_nome) AS nome,
+                   COALESCE(d.cognome, t.dipendente_cognome) AS cognome
+            FROM timbrature t
+            LEFT JOIN dipendenti d ON d.badge_id = t.badge_id
+            WHERE t.id > ? AND t.id <= ? AND +t.sync_status = 'pending'
+            ORDER BY t.timestamp, t.id
+        """,
+    }
+
+    @staticmethod
+    def _ts_bound(value) -> str:
+        """Formatta un limite di range come il testo salvato da sqlite3 ('YYYY-MM-DD HH:MM:SS[.ffffff]')"""
+        if isinstance(value, datetime):
+            return value.isoformat(sep=' ')
+        if isinstance(value, date):
+            return datetime.combine(value, datetime.min.time()).isoformat(sep=' ')
+        return datetime.fromisoformat(str(value).strip()).isoformat(sep=' ')
+
+    @classmethod
+    def _day_range(cls, day=None) -> Tuple[str, str]:
+        """Limiti [inizio giorno, inizio giorno successivo) per una data (default: oggi)"""
+        if day is None:
+            day = date.today()
+        elif isinstance(day, datetime):
+            day = day.date()
+        elif not isinstance(day, date):
+            day = date.fromisoformat(str(day).strip()[:10])
+        return cls._ts_bound(day), cls._ts_bound(day + timedelta(days=1))
+
+    @classmethod
+    def _timestamp_range(cls, start, end) -> Tuple[str, str]:
+        """
+        Limiti half-open [start, end) da estremi inclusivi.
+        Una `date` come fine include l'intero giorno; un `datetime` include l'istante esatto.
+        """
+        if isinstance(end, str):
+            end = end.strip()
+            end = date.fromisoformat(end) if len(end) == 10 else datetime.fromisoformat(end)
+        if isinstance(end, datetime):
+            end_excl = end + timedelta(microseconds=1)
+        else:
+            end_excl = end + timedelta(days=1)
+        return cls._ts_bound(start), cls._ts_bound(end_excl)
+
+    def explain_range_queries(self) -> Dict[str, Dict]:
+        """
+        EXPLAIN QUERY PLAN delle query giorno/range, dei contatori statistiche e dei trasferimenti.
+        Ritorna {nome_query: {'plan': [dettagli], 'full_scan': bool}}; full_scan=True indica
+        una scansione completa di timbrature (nessun uso di indice o chiave primaria).
+        """
+        queries = [(name, sql, self._day_range()) for name, sql in self._RANGE_QUERIES.items()]
+        queries += [
+            ('stats_totals', self._STATS_QUERIES['stats_totals'], ()),
+            ('daily_stats', self._STATS_QUERIES['daily_stats'], (date.today().isoformat(),)),
+            ('transfer_watermark', self._TRANSFER_QUERIES['transfer_watermark'], (DEFAULT_TRANSFER_DEST,)),
+            ('transfer_count', self._TRANSFER_QUERIES['transfer_count'], (0,)),
+            ('transfer_pending', self._TRANSFER_QUERIES['transfer_pending'], (0,)),
+            ('transfer_export', self._TRANSFER_QUERIES['transfer_export'], (0, 0)),
+        ]
+        report = {}
+        with self._get_db_connection() as conn:
+            for name, sql, params in queries:
+                rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+                details = [row[3] for row in rows]
+                # 'timbrature' o il suo alias 't' (export unito all'anagrafica)
+                full_scan = any(d.split(' ')[:2] in (['SCAN', 'timbrature'], ['SCAN', 't']) for d in details)
+                report[name] = {'plan': details, 'full_scan': full_scan}
+        return report
+    
+    def _prepare_timbratura(self, badge_id: str, tipo: str, nome: str = None, cognome: str = None,
+                            timestamp: Optional[datetime] = None) -> Dict:
+        """Prepara il record di una timbratura (timestamp + hash di verifica integrità)"""
+        timestamp = timestamp or datetime.now()
+        hash_data = f"{badge_id}{timestamp.isoformat()}{tipo}"
+        return {
+            'badge_id': badge_id,
+            'dipendente_nome': nome,
+            'dipendente_cognome': cognome,
+            'timestamp': timestamp,
+            'tipo': tipo,
+            'hash_verify': hashlib.sha256(hash_data.encode()).hexdigest()[:16],
+        }
+
+    def _insert_timbrature(self, records: List[Dict]) -> List[int]:
+        """
+        Inserisce le timbrature in un'unica transazione (group commit) e le registra nel journal.
+        Ritorna gli id assegnati; solleva eccezione in caso di errore (nessun record salvato).
+        """
+        with self._db_lock:  # Thread-safe operation
+            with self._get_db_connection() as conn:
+                cursor = conn.cursor()
+                ids = []
+                for r in records:
+                    cursor.execute("""
+                        INSERT INTO timbrature (
+                            badge_id, dipendente_nome, dipendente_cognome,
+                            timestamp, tipo, hash_verify, location, tablet_id
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (
+                        r['badge_id'], r.get('dipendente_nome'), r.get('dipendente_cognome'),
+                        r['timestamp'], r['tipo'], r['hash_verify'],
+                        'tablet_principale', 'TIGOTA_001'
+                    ))
+                    ids.append(cursor.lastrowid)
+                conn.commit()
+                
+                # Journal JSON incrementale: una riga per timbratura
+                cursor.execute(
+                    f"SELECT * FROM timbrature WHERE id IN ({','.join(['?'] * len(ids))}) ORDER BY id", ids
+                )
+                rows = cursor.fetchall()
+        try:
+            for row in rows:
+                self._journal.append(dict(row))
+        except Exception as je:
+            self.logger.error(f"Errore scrittura journal JSON: {je}")
+        return ids
+
+    def _filter_unsaved(self, records: List[Dict]) -> List[Dict]:
+        """Ritorna i record non ancora presenti nel database (stesso badge, timestamp e hash)"""
+        missing = []
+        with self._get_db_connection() as conn:
+            for r in records:
+                row = conn.execute(
+                    "SELECT 1 FROM timbrature WHERE badge_id = ? AND timestamp = ? AND hash_verify = ?",
+                    (r['badge_id'], r['timestamp'], r['hash_verify'])
+                ).fetchone()
+                if row is None:
+                    missing.append(r)
+        return missing
+    
     def save_timbratura(self, badge_id: str, tipo: str, nome: str = None, cognome: str = None) -> bool:
         """
         Salva timbratura nel database SQLite con tutte le garanzie di integrità
@@ -212,57 +1095,166 @@ class TigotaSQLiteManager:
         Returns:
             bool: True se salvata con successo
         """
-        with self._db_lock:  # Thread-safe operation
-            try:
-                timestamp = datetime.now()
-                
-                # Genera hash per verifica integrità
-                hash_data = f"{badge_id}{timestamp.isoformat()}{tipo}"
-                hash_verify = hashlib.sha256(hash_data.encode()).hexdigest()[:16]
-                
+        try:
+            record = self._prepare_timbratura(badge_id, tipo, nome, cognome)
+            timbratura_id = self._insert_timbrature([record])[0]
+            
+            self.logger.info(
+                f"✅ Timbratura salvata - ID: {timbratura_id}, "
+                f"Badge: {badge_id}, Tipo: {tipo}, Hash: {record['hash_verify']}"
+            )
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"❌ Errore salvataggio timbratura: {e}")
+            return False
+    
+    def save_timbratura_async(self, badge_id: str, tipo: str, nome: str = None, cognome: str = None,
+                              callback=None) -> Dict:
+        """
+        Accoda la timbratura al writer write-behind e ritorna subito (da usare dal thread UI).
+        
+        Args:
+            callback: chiamata come callback(ok, record) dal thread writer a salvataggio
+                      avvenuto (ok=True) o fallito (ok=False)
+            
+        Returns:
+            Dict: record accodato (timestamp e hash già assegnati)
+        """
+        record = self._prepare_timbratura(badge_id, tipo, nome, cognome)
+        self._writer.submit(record, callback)
+        return record
+    
+    # --- Import massivo ---
+    _TIPO_ALIASES = {
+        'entrata': 'entrata', 'ingresso': 'entrata', 'in': 'entrata', '1': 'entrata',
+        'uscita': 'uscita', 'out': 'uscita', '0': 'uscita',
+    }
+
+    @staticmethod
+    def _parse_timestamp(value) -> datetime:
+        """Timestamp da datetime o stringa ISO; gli orari con fuso vengono convertiti in ora locale"""
+        if isinstance(value, datetime):
+            ts = value
+        else:
+            ts = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+        if ts.tzinfo is not None:
+            ts = ts.astimezone().replace(tzinfo=None)
+        return ts
+
+    def _bulk_row(self, record: Dict, sync_status: str) -> Optional[Tuple]:
+        """Converte un record (formato snapshot o legacy TimbratureManager) nella tupla di insert"""
+        try:
+            badge_id = str(record.get('badge_id') or '').strip()
+            tipo = self._TIPO_ALIASES.get(str(record.get('tipo') or record.get('tipo_movimento') or '').strip().lower())
+            if not badge_id or not tipo:
+                return None
+            ts = self._parse_timestamp(record.get('timestamp') or datetime.now())
+        except (ValueError, TypeError):
+            return None
+        return (
+            badge_id,
+            record.get('dipendente_nome', record.get('nome')),
+            record.get('dipendente_cognome', record.get('cognome')),
+            ts, tipo, f"{badge_id}{ts.isoformat()}{tipo}",
+            record.get('location') or 'tablet_principale',
+            record.get('tablet_id') or 'TIGOTA_001',
+            record.get('sync_status') or sync_status,
+        )
+
+    def save_timbrature_bulk(self, timbrature: Iterable[Dict], chunk_size: int = 5000,
+                             sync_status: str = 'pending', skip_existing: bool = False) -> int:
+        """
+        Inserisce molte timbrature (anche con timestamp storici) con executemany, una transazione
+        per blocco di chunk_size record. Gli hash di verifica sono calcolati per blocco.
+        
+        Args:
+            timbrature: iterabile di dict con badge_id, tipo (o tipo_movimento), timestamp e
+                        facoltativi dipendente_nome/nome, dipendente_cognome/cognome, sync_status
+            sync_status: stato assegnato ai record che non lo specificano
+            skip_existing: salta i record già presenti (stesso badge, timestamp e hash)
+            
+        Returns:
+            int: timbrature inserite (-1 in caso di errore)
+        """
+        inserted = 0
+        skipped = 0
+        chunk = []
+        
+        def _flush(rows):
+            # Hash di verifica calcolati per l'intero blocco
+            rows = [r[:5] + (hashlib.sha256(r[5].encode()).hexdigest()[:16],) + r[6:] for r in rows]
+            with self._db_lock:
                 with self._get_db_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Insert con tutti i campi
-                    cursor.execute("""
+                    if skip_existing:
+                        rows = [r for r in rows if conn.execute(
+                            "SELECT 1 FROM timbrature WHERE badge_id = ? AND timestamp = ? AND hash_verify = ?",
+                            (r[0], r[3], r[5])
+                        ).fetchone() is None]
+                    conn.executemany("""
                         INSERT INTO timbrature (
-                            badge_id, dipendente_nome, dipendente_cognome,
-                            timestamp, tipo, hash_verify, location, tablet_id
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        badge_id, nome, cognome, timestamp, tipo, 
-                        hash_verify, 'tablet_principale', 'TIGOTA_001'
-                    ))
-                    
-                    timbratura_id = cursor.lastrowid
+                            badge_id, dipendente_nome, dipendente_cognome, timestamp, tipo,
+                            hash_verify, location, tablet_id, sync_status
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, rows)
                     conn.commit()
-                    
-                    self.logger.info(
-                        f"✅ Timbratura salvata - ID: {timbratura_id}, "
-                        f"Badge: {badge_id}, Tipo: {tipo}, Hash: {hash_verify}"
-                    )
-                    
-                    # Backup JSON automatico dopo ogni salvataggio
-                    self._create_json_backup()
-                    
-                    return True
-                    
-            except Exception as e:
-                self.logger.error(f"❌ Errore salvataggio timbratura: {e}")
-                return False
+            return len(rows)
+        
+        try:
+            for record in timbrature:
+                row = self._bulk_row(record, sync_status)
+                if row is None:
+                    skipped += 1
+                    continue
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    inserted += _flush(chunk)
+                    chunk = []
+            if chunk:
+                inserted += _flush(chunk)
+        except Exception as e:
+            self.logger.error(f"❌ Errore import massivo (salvate {inserted} timbrature prima dell'errore): {e}")
+            return -1
+        finally:
+            if inserted:
+                # Snapshot JSON rigenerato in background (il journal copre solo le timbrature singole)
+                threading.Thread(target=self.compact_journal, kwargs={'force': True},
+                                 name='JournalCompactBulk', daemon=True).start()
+        
+        if skipped:
+            self.logger.warning(f"Import massivo: {skipped} record non validi scartati")
+        self.logger.info(f"📥 Import massivo: {inserted} timbrature inserite")
+        return inserted
+
+    def import_legacy_json(self, json_path: str, sync_status: str = 'synced', chunk_size: int = 5000) -> int:
+        """
+        Importa un timbrature.json legacy (array prodotto dal vecchio TimbratureManager o dal
+        backup JSON). Le timbrature già presenti vengono saltate, quindi l'import è ripetibile.
+        Di default i record storici sono marcati 'synced' per non ritrasmetterli al payroll.
+        
+        Returns:
+            int: timbrature inserite (-1 in caso di errore)
+        """
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            self.logger.error(f"Errore lettura JSON legacy {json_path}: {e}")
+            return -1
+        if isinstance(data, dict):
+            data = data.get('timbrature', [])
+        if not isinstance(data, list):
+            self.logger.error(f"Formato JSON legacy non riconosciuto: {json_path}")
+            return -1
+        records = (r for r in data if isinstance(r, dict))
+        return self.save_timbrature_bulk(records, chunk_size=chunk_size, sync_status=sync_status, skip_existing=True)
     
     def get_timbrature_today(self) -> List[Dict]:
         """Ottiene tutte le timbrature di oggi dal database SQLite"""
         try:
-            today = datetime.now().date()
-            
             with self._get_db_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT * FROM timbrature 
-                    WHERE DATE(timestamp) = ?
-                    ORDER BY timestamp DESC
-                """, (today,))
+                cursor.execute(self._RANGE_QUERIES['timbrature_range'], self._day_range())
                 
                 rows = cursor.fetchall()
                 timbrature = [dict(row) for row in rows]
@@ -298,29 +1290,281 @@ class TigotaSQLiteManager:
             self.logger.error(f"Errore lettura ultima timbratura badge {badge_id}: {e}")
             return None
 
-    def get_timbrature_pending(self) -> List[Dict]:
-        """Ritorna timbrature con sync_status='pending' ordinate per timestamp"""
+    def get_ultime_timbrature_per_badge(self, dal: datetime) -> List[Dict]:
+        """Ultima timbratura (badge_id, tipo, timestamp) di ogni badge che ha timbrato da 'dal' in poi"""
         try:
+            with self._get_db_connection() as conn:
+                # Range su idx_timestamp; con MAX() SQLite restituisce il tipo della riga massima
+                rows = conn.execute("""
+                    SELECT badge_id, tipo, MAX(timestamp) AS timestamp
+                    FROM timbrature
+                    WHERE timestamp >= ?
+                    GROUP BY badge_id
+                """, (dal,)).fetchall()
+                return [dict(row) for row in rows]
+        except Exception as e:
+            self.logger.error(f"Errore lettura ultime timbrature per badge: {e}")
+            return []
+
+    # --- Trasferimenti incrementali (watermark per destinazione) ---
+    def get_transfer_watermark(self, destinazione: str = DEFAULT_TRANSFER_DEST) -> int:
+        """
+        Ultimo id timbrature già esportato verso la destinazione.
+        Alla prima lettura il watermark viene inizializzato dal punto configurato in
+        `transfer_watermark_iniziale` (vedi _watermark_seed_sql): di default una destinazione
+        nuova riceve solo le timbrature successive, non tutto lo storico.
+        """
+        with self._get_db_connection() as conn:
+            row = conn.execute(self._TRANSFER_QUERIES['transfer_watermark'], (destinazione,)).fetchone()
+            if row:
+                return row[0]
+            seed_sql, seed_params = self._watermark_seed_sql(destinazione)
+            conn.execute(f"""
+                INSERT OR IGNORE INTO transfer_watermark (destinazione, last_id)
+                VALUES (?, {seed_sql})
+            """, (destinazione, *seed_params))
+            conn.commit()
+            last_id = conn.execute(self._TRANSFER_QUERIES['transfer_watermark'], (destinazione,)).fetchone()[0]
+            self.logger.info(f"🚩 Watermark {destinazione} inizializzato a id {last_id}")
+            return last_id
+
+    def _watermark_seed_sql(self, destinazione: str) -> Tuple[str, Tuple]:
+        """
+        Espressione SQL del watermark iniziale di una destinazione, da
+        DATA_CONFIG['transfer_watermark_iniziale'] (dict destinazione -> punto; default 'ultimo'):
+        - 'ultimo': id massimo attuale (solo le timbrature future)
+        - 'pending': subito prima della più vecchia timbratura 'pending' (migrazione dal
+          vecchio modello basato su sync_status; di default per ore_txt)
+        - un intero: id esplicito (0 = tutto lo storico)
+        """
+        punti = DATA_CONFIG.get('transfer_watermark_iniziale') or {}
+        punto = punti.get(destinazione, 'ultimo')
+        if punto == 'pending':
+            return ("""COALESCE(
+                (SELECT MIN(id) - 1 FROM timbrature WHERE sync_status = 'pending'),
+                (SELECT MAX(id) FROM timbrature),
+                0)""", ())
+        if punto != 'ultimo':
+            try:
+                valore = int(punto)
+                if valore < 0:
+                    raise ValueError(punto)
+                return "?", (valore,)
+            except (TypeError, ValueError):
+                self.logger.error(f"Watermark iniziale non valido per {destinazione}: {punto!r} (uso 'ultimo')")
+        return "(SELECT COALESCE(MAX(id), 0) FROM timbrature)", ()
+
+    def set_transfer_destinations(self, gruppo: str, destinazioni: Iterable[str]):
+        """
+        Dichiara le destinazioni configurate di un gruppo (es. 'trasferimenti', 'cloud').
+        L'archiviazione considera solo i watermark delle destinazioni dichiarate: una
+        destinazione tolta dalla configurazione non blocca più l'archivio.
+        """
+        with self._transfer_destinations_lock:
+            self._transfer_destinations[gruppo] = sorted(set(destinazioni))
+
+    def _configured_transfer_destinations(self) -> Optional[List[str]]:
+        """Unione delle destinazioni dichiarate (None se nessun gruppo le ha dichiarate)"""
+        with self._transfer_destinations_lock:
+            if not self._transfer_destinations:
+                return None
+            return sorted({d for nomi in self._transfer_destinations.values() for d in nomi})
+
+    def get_max_timbratura_id(self) -> int:
+        """Id massimo in timbrature: limite superiore stabile di un export"""
+        with self._get_db_connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM timbrature").fetchone()[0]
+
+    def commit_transfer_watermark(self, destinazione: str, last_id: int, righe: int = 0) -> bool:
+        """
+        Conferma un export: avanza il watermark della destinazione a last_id (una sola riga
+        aggiornata, indipendentemente dal numero di timbrature esportate). Mai all'indietro.
+        """
+        try:
+            with self._get_db_connection() as conn:
+                conn.execute("""
+                    UPDATE transfer_watermark
+                    SET last_id = ?, righe_esportate = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE destinazione = ? AND last_id < ?
+                """, (last_id, righe, destinazione, last_id))
+                conn.commit()
+            return True
+        except Exception as e:
+            self.logger.error(f"Errore aggiornamento watermark {destinazione}: {e}")
+            return False
+
+    # --- Journal dei batch di trasferimento (exactly-once) ---
+    TRANSFER_OPEN_PHASES = ('preparato', 'scritto', 'pubblicato')
+
+    def get_open_transfer_batches(self, destinazione: Optional[str] = None) -> List[Dict]:
+        """Batch non ancora confermati né annullati (da riprendere dopo un crash), dal più vecchio"""
+        sql = f"SELECT * FROM transfer_batches WHERE fase IN ({','.join('?' * len(self.TRANSFER_OPEN_PHASES))})"
+        params = list(self.TRANSFER_OPEN_PHASES)
+        if destinazione is not None:
+            sql += " AND destinazione = ?"
+            params.append(destinazione)
+        with self._get_db_connection() as conn:
+            return [dict(r) for r in conn.execute(sql + " ORDER BY created_at, rowid", params)]
+
+    def get_transfer_file_phase(self, destinazione: str, file_name: str) -> Optional[str]:
+        """Fase del batch che ha usato il nome file per la destinazione (None se mai usato)"""
+        with self._get_db_connection() as conn:
+            row = conn.execute(
+                "SELECT fase FROM transfer_batches WHERE destinazione = ? AND file_name = ?", (destinazione, file_name)
+            ).fetchone()
+            return row[0] if row else None
+
+    def begin_transfer_batch(self, destinazione: str, file_name: str, limite: Optional[int] = None) -> Optional[Dict]:
+        """
+        Apre un batch in fase 'preparato' sul range (watermark, id massimo attuale].
+        Il range e il nome file sono registrati prima di scrivere qualsiasi cosa.
+        Con limite il range si ferma alle prime `limite` timbrature oltre il watermark.
+        
+        Returns:
+            Dict del batch; None se non ci sono timbrature nuove
+            
+        Raises:
+            RuntimeError: esiste già un batch aperto per la destinazione (va ripreso prima)
+        """
+        from_id = self.get_transfer_watermark(destinazione)
+        with self._get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            aperto = conn.execute(
+                f"SELECT batch_id FROM transfer_batches WHERE destinazione = ? AND fase IN "
+                f"({','.join('?' * len(self.TRANSFER_OPEN_PHASES))})",
+                (destinazione, *self.TRANSFER_OPEN_PHASES)
+            ).fetchone()
+            if aperto:
+                conn.rollback()
+                raise RuntimeError(f"Batch {aperto[0]} ancora aperto per {destinazione}")
+            if limite:
+                to_id = conn.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM (SELECT id FROM timbrature WHERE id > ? ORDER BY id LIMIT ?)",
+                    (from_id, limite)
+                ).fetchone()[0]
+            else:
+                to_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM timbrature").fetchone()[0]
+            if to_id <= from_id:
+                conn.rollback()
+                return None
+            batch_id = uuid.uuid4().hex
+            conn.execute("""
+                INSERT INTO transfer_batches (batch_id, destinazione, from_id, to_id, file_name, fase)
+                VALUES (?, ?, ?, ?, ?, 'preparato')
+            """, (batch_id, destinazione, from_id, to_id, file_name))
+            conn.commit()
+            return dict(conn.execute("SELECT * FROM transfer_batches WHERE batch_id = ?", (batch_id,)).fetchone())
+
+    def update_transfer_batch(self, batch_id: str, fase: str, righe: Optional[int] = None,
+                              sha256: Optional[str] = None, errore: Optional[str] = None) -> bool:
+        """Registra il passaggio di fase di un batch (righe/sha256 invariati se None)"""
+        try:
+            with self._get_db_connection() as conn:
+                conn.execute("""
+                    UPDATE transfer_batches
+                    SET fase = ?, righe = COALESCE(?, righe), sha256 = COALESCE(?, sha256),
+                        errore = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE batch_id = ?
+                """, (fase, righe, sha256, errore, batch_id))
+                conn.commit()
+            return True
+        except Exception as e:
+            self.logger.error(f"Errore aggiornamento batch {batch_id}: {e}")
+            return False
+
+    def confirm_transfer_batch(self, batch_id: str) -> bool:
+        """
+        Conferma un batch: nella stessa transazione avanza il watermark della destinazione
+        da from_id a to_id e porta il batch in fase 'confermato'. Idempotente.
+        """
+        try:
+            with self._get_db_connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                batch = conn.execute("SELECT * FROM transfer_batches WHERE batch_id = ?", (batch_id,)).fetchone()
+                if batch is None:
+                    conn.rollback()
+                    return False
+                if batch['fase'] == 'confermato':
+                    conn.rollback()
+                    return True
+                wm = conn.execute(
+                    "SELECT last_id FROM transfer_watermark WHERE destinazione = ?", (batch['destinazione'],)
+                ).fetchone()
+                if wm is None or wm[0] != batch['from_id']:
+                    conn.rollback()
+                    self.logger.error(f"Batch {batch_id}: watermark {wm and wm[0]} diverso da from_id {batch['from_id']}")
+                    return False
+                conn.execute("""
+                    UPDATE transfer_watermark
+                    SET last_id = ?, righe_esportate = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE destinazione = ?
+                """, (batch['to_id'], batch['righe'] or 0, batch['destinazione']))
+                conn.execute("""
+                    UPDATE transfer_batches SET fase = 'confermato', errore = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE batch_id = ?
+                """, (batch_id,))
+                conn.commit()
+            return True
+        except Exception as e:
+            self.logger.error(f"Errore conferma batch {batch_id}: {e}")
+            return False
+
+    def count_timbrature_to_transfer(self, destinazione: str = DEFAULT_TRANSFER_DEST) -> int:
+        """Numero di timbrature oltre il watermark ancora da esportare"""
+        try:
+            last_id = self.get_transfer_watermark(destinazione)
+            with self._get_db_connection() as conn:
+                return conn.execute(self._TRANSFER_QUERIES['transfer_count'], (last_id,)).fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"Errore conteggio timbrature da trasferire: {e}")
+            return 0
+
+    def get_timbrature_pending(self, destinazione: str = DEFAULT_TRANSFER_DEST) -> List[Dict]:
+        """Ritorna le timbrature non ancora esportate verso la destinazione, ordinate per timestamp"""
+        try:
+            last_id = self.get_transfer_watermark(destinazione)
             with self._get_db_connection() as conn:
                 cur = conn.cursor()
-                cur.execute("""
-                    SELECT * FROM timbrature WHERE sync_status = 'pending' ORDER BY timestamp
-                """)
+                cur.execute(self._TRANSFER_QUERIES['transfer_pending'], (last_id,))
                 rows = cur.fetchall()
                 return [dict(r) for r in rows]
         except Exception as e:
             self.logger.error(f"Errore get_timbrature_pending: {e}")
             return []
 
+    def iter_timbrature_pending_export(self, after_id: int, upto_id: int, chunk_size: int = 1000):
+        """
+        Itera (timestamp crescente) le timbrature pending con after_id < id <= upto_id, già unite
+        al codice dipendente: una sola query (range sulla chiave primaria + LEFT JOIN su dipendenti),
+        letta a blocchi di chunk_size righe. '+sync_status' esclude idx_sync_timestamp, così la
+        scansione resta limitata al range di id e non cresce con lo storico.
+        Ogni riga espone id, badge_id, tipo, timestamp, codice (None se badge non abbinato),
+        nome e cognome (anagrafica, altrimenti quelli salvati con la timbratura).
+        La lettura usa una connessione dedicata, chiusa al termine.
+        """
+        conn = self._pool.open_dedicated()
+        try:
+            cursor = conn.execute(self._TRANSFER_QUERIES['transfer_export'], (after_id, upto_id))
+            yield from self._fetch_chunks(cursor, chunk_size)
+        finally:
+            conn.close()
+
     def mark_timbrature_synced(self, ids: List[int]) -> bool:
-        """Imposta sync_status='synced' alle timbrature con id nella lista."""
+        """
+        Imposta sync_status='synced' alle timbrature con id nella lista (a blocchi, una transazione).
+        Non fa parte dell'export (che avanza il watermark della destinazione): resta per chi marca
+        a mano le timbrature già consegnate; una timbratura 'synced' è archiviabile anche oltre
+        i watermark.
+        """
         if not ids:
             return True
         try:
             with self._get_db_connection() as conn:
                 cur = conn.cursor()
-                q = f"UPDATE timbrature SET sync_status='synced', updated_at=CURRENT_TIMESTAMP WHERE id IN ({','.join(['?']*len(ids))})"
-                cur.execute(q, ids)
+                for i in range(0, len(ids), MAX_SQL_PARAMS):
+                    chunk = ids[i:i + MAX_SQL_PARAMS]
+                    q = f"UPDATE timbrature SET sync_status='synced', updated_at=CURRENT_TIMESTAMP WHERE id IN ({','.join(['?']*len(chunk))})"
+                    cur.execute(q, chunk)
                 conn.commit()
             return True
         except Exception as e:
@@ -328,33 +1572,168 @@ class TigotaSQLiteManager:
             return False
     
     def get_timbrature_range(self, start_date: datetime, end_date: datetime) -> List[Dict]:
-        """Ottiene timbrature in un range di date"""
+        """Ottiene timbrature in un range di date (database principale + partizioni di archivio)"""
         try:
-            with self._get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT * FROM timbrature 
-                    WHERE timestamp BETWEEN ? AND ?
-                    ORDER BY timestamp DESC
-                """, (start_date, end_date))
-                
-                rows = cursor.fetchall()
-                return [dict(row) for row in rows]
+            return [dict(row) for row in self._iter_timbrature_range(start_date, end_date)]
                 
         except Exception as e:
             self.logger.error(f"Errore lettura timbrature range: {e}")
             return []
     
+    def _iter_timbrature_range(self, start_date, end_date, chunk_size: int = 1000):
+        """
+        Itera (timestamp decrescente) le timbrature del range, unendo il database principale
+        e le partizioni mensili di archivio coinvolte. Le partizioni vengono collegate con
+        ATTACH e lette in UNION ALL, a gruppi di al massimo MAX_ATTACHED per connessione.
+        """
+        lo, hi = self._timestamp_range(start_date, end_date)
+        partitions = ['main'] + self._archive_files_for_range(lo, hi)
+        cols = ', '.join(ARCHIVE_COLUMNS)
+        iterators = []
+        connections = []
+        try:
+            for g in range(0, len(partitions), MAX_ATTACHED):
+                group = partitions[g:g + MAX_ATTACHED]
+                conn = self._pool.open_dedicated()
+                connections.append(conn)
+                selects = []
+                for i, part in enumerate(group):
+                    alias = 'main'
+                    if part != 'main':
+                        alias = f"p{i}"
+                        conn.execute(f"ATTACH DATABASE ? AS {alias}", (part,))
+                    selects.append(f"SELECT {cols} FROM {alias}.timbrature WHERE timestamp >= ? AND timestamp < ?")
+                # ORDER BY sul compound: SQLite fonde le partizioni già ordinate per indice (nessun sort)
+                sql = f"{' UNION ALL '.join(selects)} ORDER BY timestamp DESC"
+                cursor = conn.execute(sql, (lo, hi) * len(selects))
+                iterators.append(self._fetch_chunks(cursor, chunk_size))
+            if len(iterators) == 1:
+                yield from iterators[0]
+            else:
+                yield from heapq.merge(*iterators, key=lambda r: r['timestamp'], reverse=True)
+        finally:
+            for conn in connections:
+                conn.close()
+    
+    @staticmethod
+    def _fetch_chunks(cursor, chunk_size: int):
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    
+    def _archive_path(self, month: str) -> str:
+        """Percorso della partizione di archivio per il mese 'YYYY-MM'"""
+        return os.path.join(self.archive_dir, f"timbrature_{month.replace('-', '_')}.db")
+    
+    def _archive_files_for_range(self, lo: str, hi: str) -> List[str]:
+        """Partizioni di archivio esistenti per i mesi compresi nel range [lo, hi)"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        year, month = int(lo[:4]), int(lo[5:7])
+        last = hi[:7]
+        files = []
+        while f"{year:04d}-{month:02d}" <= last:
+            path = self._archive_path(f"{year:04d}-{month:02d}")
+            if os.path.exists(path):
+                files.append(path)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return files
+    
+    def _archive_files(self) -> List[str]:
+        """Tutte le partizioni di archivio mensili presenti in archive_dir"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(os.path.join(self.archive_dir, name) for name in os.listdir(self.archive_dir)
+                      if name.startswith('timbrature_') and name.endswith('.db'))
+    
+    def archive_synced_timbrature(self, older_than_days: Optional[int] = None,
+                                  destinazioni: Optional[Iterable[str]] = None) -> int:
+        """
+        Sposta le timbrature sincronizzate (o già esportate verso tutte le destinazioni)
+        più vecchie di N giorni (default: archive_after_days) nelle partizioni mensili di archivio (un file SQLite per mese in archive_dir).
+        Lo spostamento non modifica i contatori statistiche: le timbrature archiviate restano contate.
+        
+        Args:
+            destinazioni: destinazioni di cui attendere l'export (default: quelle dichiarate con
+                          set_transfer_destinations; se nessuna è dichiarata, tutti i watermark)
+        
+        Returns:
+            int: numero di timbrature archiviate (-1 in caso di errore)
+        """
+        days = DATA_CONFIG.get('archive_after_days', 90) if older_than_days is None else older_than_days
+        cutoff = self._ts_bound(date.today() - timedelta(days=int(days)))
+        moved = 0
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with self._db_lock:
+                with self._get_db_connection() as conn:
+                    # Esportate verso tutte le destinazioni: 'synced' oppure id entro il watermark minimo
+                    if destinazioni is None:
+                        destinazioni = self._configured_transfer_destinations()
+                    if destinazioni is None:
+                        exported = conn.execute(
+                            "SELECT COALESCE(MIN(last_id), 0) FROM transfer_watermark"
+                        ).fetchone()[0]
+                    else:
+                        # Solo destinazioni configurate (quelle senza watermark vengono inizializzate ora)
+                        destinazioni = sorted(set(destinazioni))
+                        ignorate = [r[0] for r in conn.execute("SELECT destinazione FROM transfer_watermark")
+                                    if r[0] not in destinazioni]
+                        if ignorate:
+                            self.logger.info(f"🗄️ Watermark ignorati (destinazioni non configurate): {', '.join(ignorate)}")
+                        exported = min((self.get_transfer_watermark(d) for d in destinazioni),
+                                       default=self.get_max_timbratura_id())
+                    months = [r[0] for r in conn.execute(
+                        "SELECT DISTINCT substr(timestamp, 1, 7) FROM timbrature "
+                        "WHERE timestamp < ? AND (sync_status = 'synced' OR id <= ?)", (cutoff, exported)
+                    )]
+                    cols = ', '.join(ARCHIVE_COLUMNS)
+                    for month in months:
+                        lo = self._ts_bound(date.fromisoformat(month + '-01'))
+                        hi = min(cutoff, self._ts_bound((date.fromisoformat(month + '-01') + timedelta(days=32)).replace(day=1)))
+                        conn.execute("ATTACH DATABASE ? AS archivio", (self._archive_path(month),))
+                        try:
+                            for ddl in ARCHIVE_SCHEMA:
+                                conn.execute(ddl.format(db='archivio'))
+                            conn.execute("BEGIN IMMEDIATE")
+                            # DELETE senza aggiornare i contatori (trigger trg_timbrature_stats_elimina)
+                            conn.execute("INSERT OR IGNORE INTO stats_sospese (id) VALUES (1)")
+                            # INSERT OR IGNORE: ripetibile se un run precedente si è interrotto
+                            conn.execute(f"""
+                                INSERT OR IGNORE INTO archivio.timbrature ({cols})
+                                SELECT {cols} FROM main.timbrature
+                                WHERE timestamp >= ? AND timestamp < ? AND (sync_status = 'synced' OR id <= ?)
+                            """, (lo, hi, exported))
+                            deleted = conn.execute("""
+                                DELETE FROM main.timbrature
+                                WHERE timestamp >= ? AND timestamp < ? AND (sync_status = 'synced' OR id <= ?)
+                            """, (lo, hi, exported)).rowcount
+                            conn.execute("DELETE FROM stats_sospese")
+                            conn.commit()
+                            moved += deleted
+                            self.logger.info(f"🗄️ Archiviate {deleted} timbrature in {os.path.basename(self._archive_path(month))}")
+                        finally:
+                            if conn.in_transaction:
+                                conn.rollback()
+                            conn.execute("DETACH DATABASE archivio")
+            return moved
+        except Exception as e:
+            self.logger.error(f"Errore archiviazione timbrature: {e}")
+            return -1
+    
+    def _stats_row(self, sql: str, params: Tuple = ()) -> Optional[sqlite3.Row]:
+        with self._get_db_connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
     def get_unique_badge_count(self):
         """Conta badge unici nel database (solo dati reali)"""
         try:
-            with self._get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(DISTINCT badge_id) FROM timbrature")
-                result = cursor.fetchone()
-                count = result[0] if result else 0
-                self.logger.info(f"📊 Badge unici nel database: {count}")
-                return count
+            row = self._stats_row(self._STATS_QUERIES['stats_totals'])
+            count = row['badge_unici'] if row else 0
+            self.logger.debug(f"📊 Badge unici nel database: {count}")
+            return count
         except Exception as e:
             self.logger.error(f"Errore conteggio badge unici: {e}")
             return 0
@@ -362,17 +1741,10 @@ class TigotaSQLiteManager:
     def get_today_entries_count(self):
         """Conta timbrature di oggi (solo dati reali)"""
         try:
-            today = date.today().strftime('%Y-%m-%d')
-            with self._get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT COUNT(*) FROM timbrature 
-                    WHERE DATE(timestamp) = ?
-                """, (today,))
-                result = cursor.fetchone()
-                count = result[0] if result else 0
-                self.logger.info(f"📊 Timbrature oggi: {count}")
-                return count
+            row = self._stats_row(self._STATS_QUERIES['daily_stats'], (date.today().isoformat(),))
+            count = row['timbrature'] if row else 0
+            self.logger.debug(f"📊 Timbrature oggi: {count}")
+            return count
         except Exception as e:
             self.logger.error(f"Errore conteggio timbrature oggi: {e}")
             return 0
@@ -380,65 +1752,239 @@ class TigotaSQLiteManager:
     def get_active_employees_today(self):
         """Conta dipendenti attivi oggi (con almeno una timbratura)"""
         try:
-            today = date.today().strftime('%Y-%m-%d')
-            with self._get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT COUNT(DISTINCT badge_id) FROM timbrature 
-                    WHERE DATE(timestamp) = ?
-                """, (today,))
-                result = cursor.fetchone()
-                count = result[0] if result else 0
-                self.logger.info(f"📊 Dipendenti attivi oggi: {count}")
-                return count
+            row = self._stats_row(self._STATS_QUERIES['daily_stats'], (date.today().isoformat(),))
+            count = row['badge_attivi'] if row else 0
+            self.logger.debug(f"📊 Dipendenti attivi oggi: {count}")
+            return count
         except Exception as e:
             self.logger.error(f"Errore conteggio dipendenti attivi: {e}")
             return 0
     
-    def _create_json_backup(self):
-        """Crea backup JSON per compatibilità e sicurezza"""
+    def rebuild_stats(self) -> bool:
+        """
+        Ricostruisce da zero i contatori statistiche (daily_stats, badge_stats, badge_totals,
+        stats_totals) a partire da timbrature e dalle partizioni di archivio (l'archiviazione
+        non toglie timbrature dai contatori). Da usare dopo import massivi o reset_database.
+        """
         try:
+            # Conteggi per badge e giorno delle partizioni, letti prima della transazione (niente ATTACH)
+            archiviate = []
+            for path in self._archive_files():
+                part = sqlite3.connect(path)
+                try:
+                    archiviate.extend(part.execute("""
+                        SELECT badge_id, substr(timestamp, 1, 10), COUNT(*)
+                        FROM timbrature GROUP BY badge_id, substr(timestamp, 1, 10)
+                    """).fetchall())
+                finally:
+                    part.close()
             with self._get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM timbrature ORDER BY timestamp")
-                rows = cursor.fetchall()
-                
-                # Converti in formato JSON compatibile
-                timbrature_json = []
-                for row in rows:
-                    timbratura = dict(row)
-                    # Converti datetime per compatibilità JSON
-                    for key, value in timbratura.items():
-                        if isinstance(value, datetime):
-                            timbratura[key] = value.isoformat()
-                    timbrature_json.append(timbratura)
-                
-                # Salva backup JSON
-                with open(self.json_backup_path, 'w', encoding='utf-8') as f:
-                    json.dump(timbrature_json, f, indent=2, ensure_ascii=False)
+                conn.execute("BEGIN IMMEDIATE")
+                for table in ('badge_stats', 'daily_stats', 'badge_totals', 'stats_totals'):
+                    conn.execute(f"DELETE FROM {table}")
+                conn.execute("""
+                    INSERT INTO badge_stats (badge_id, giorno, timbrature)
+                    SELECT badge_id, substr(timestamp, 1, 10), COUNT(*)
+                    FROM timbrature GROUP BY badge_id, substr(timestamp, 1, 10)
+                """)
+                conn.executemany("""
+                    INSERT INTO badge_stats (badge_id, giorno, timbrature) VALUES (?, ?, ?)
+                    ON CONFLICT(badge_id, giorno) DO UPDATE SET timbrature = timbrature + excluded.timbrature
+                """, archiviate)
+                conn.execute("""
+                    INSERT INTO daily_stats (giorno, timbrature, badge_attivi)
+                    SELECT giorno, SUM(timbrature), COUNT(*) FROM badge_stats GROUP BY giorno
+                """)
+                conn.execute("""
+                    INSERT INTO badge_totals (badge_id, timbrature)
+                    SELECT badge_id, SUM(timbrature) FROM badge_stats GROUP BY badge_id
+                """)
+                conn.execute("""
+                    INSERT INTO stats_totals (id, timbrature, badge_unici)
+                    SELECT 1, COALESCE(SUM(timbrature), 0), COUNT(*) FROM badge_totals
+                """)
+                conn.commit()
+            self.logger.info("📊 Contatori statistiche ricostruiti")
+            return True
+        except Exception as e:
+            self.logger.error(f"Errore ricostruzione statistiche: {e}")
+            return False
+    
+    def _create_json_backup(self):
+        """Crea backup JSON per compatibilità e sicurezza (compattazione journal -> snapshot)"""
+        self.compact_journal(force=True)
+    
+    def compact_journal(self, force: bool = False) -> bool:
+        """
+        Rigenera lo snapshot JSON legacy (array) dal database e tronca il journal.
+        Lo snapshot viene scritto in streaming su file temporaneo e sostituito atomicamente,
+        una timbratura per riga (senza indentazione).
+        
+        Senza `force` la compattazione parte solo se il journal ha superato
+        `journal_compact_min_bytes`: finché resta piccolo, snapshot + journal bastano a
+        ricostruire il formato legacy (rebuild_legacy_json) e la tabella non viene riletta.
+        """
+        if not force:
+            soglia = int(DATA_CONFIG.get('journal_compact_min_bytes', 1048576) or 0)
+            dimensione = self._journal.size_bytes()
+            if dimensione < soglia:
+                self.logger.debug(f"Compattazione journal saltata: {dimensione} byte < soglia {soglia}")
+                return True
+        with self._compaction_lock:
+            tmp_path = self.json_backup_path + ".tmp"
+            try:
+                count = 0
+                max_id = 0
+                with self._get_db_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT * FROM timbrature ORDER BY timestamp")
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write("[")
+                        while True:
+                            rows = cursor.fetchmany(1000)
+                            if not rows:
+                                break
+                            for row in rows:
+                                timbratura = dict(row)
+                                max_id = max(max_id, timbratura.get('id') or 0)
+                                item = json.dumps(timbratura, ensure_ascii=False, default=str)
+                                f.write(("," if count else "") + "\n" + item)
+                                count += 1
+                        f.write("\n]" if count else "]")
+                os.replace(tmp_path, self.json_backup_path)
+                self._journal.truncate_through(max_id)
                 
-                self.logger.info(f"💾 Backup JSON creato: {len(timbrature_json)} timbrature")
+                self.logger.info(f"💾 Backup JSON creato: {count} timbrature")
+                return True
                 
+            except Exception as e:
+                self.logger.error(f"Errore backup JSON: {e}")
+                try:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                except Exception:
+                    pass
+                return False
+    
+    def rebuild_legacy_json(self, output_path: Optional[str] = None) -> List[Dict]:
+        """
+        Ricostruisce il formato legacy (array JSON ordinato per timestamp) da snapshot + journal.
+        Se output_path è indicato, scrive anche il file.
+        """
+        timbrature = []
+        try:
+            if os.path.exists(self.json_backup_path):
+                with open(self.json_backup_path, 'r', encoding='utf-8') as f:
+                    timbrature = json.load(f)
         except Exception as e:
-            self.logger.error(f"Errore backup JSON: {e}")
+            self.logger.error(f"Errore lettura snapshot JSON: {e}")
+        max_id = max((t.get('id') or 0 for t in timbrature), default=0)
+        timbrature.extend(self._journal.records(after_id=max_id))
+        timbrature.sort(key=lambda t: str(t.get('timestamp') or ''))
+        if output_path:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(timbrature, f, indent=2, ensure_ascii=False, default=str)
+        return timbrature
+    
+    def _start_journal_compactor(self):
+        """Avvia il thread daemon di compattazione periodica del journal"""
+        interval = int(DATA_CONFIG.get('journal_compact_interval', 3600) or 0)
+        if interval <= 0 or (self._compactor_thread and self._compactor_thread.is_alive()):
+            return
+        
+        def _loop():
+            while not self._compactor_stop.wait(interval):
+                self.compact_journal()
+        
+        self._compactor_stop.clear()
+        self._compactor_thread = threading.Thread(target=_loop, name='JournalCompactor', daemon=True)
+        self._compactor_thread.start()
+    
+    def register_maintenance_jobs(self, scheduler) -> List[str]:
+        """
+        Registra sullo scheduler unico (scheduler_manutenzione.SchedulerManutenzione) i job di
+        manutenzione: backup giornaliero, pulizia backup, verifica integrità, compattazione
+        journal e archiviazione. Specifiche cron vuote in DATA_CONFIG disattivano il job.
+        La compattazione passa allo scheduler: il thread JournalCompactor interno viene fermato.
+        
+        Returns:
+            List[str]: nomi dei job registrati
+        """
+        jobs = [
+            ('backup_giornaliero', 'job_backup_cron', self.create_daily_backup),
+            ('pulizia_backup', 'job_pulizia_backup_cron', self._cleanup_old_backups),
+            ('compattazione_journal', 'job_compattazione_journal_cron', self.compact_journal),
+            ('archiviazione', 'job_archiviazione_cron', lambda: self.archive_synced_timbrature() >= 0),
+        ]
+        if DATA_CONFIG.get('data_integrity_check', True):
+            jobs.append(('verifica_integrita', 'job_integrita_cron', self._verify_database_integrity))
+        registered = []
+        for name, config_key, func in jobs:
+            spec = (DATA_CONFIG.get(config_key) or '').strip()
+            if not spec:
+                continue
+            try:
+                scheduler.aggiungi(name, spec, func)
+                registered.append(name)
+            except ValueError as e:
+                self.logger.error(f"Job {name} non pianificato ({config_key}): {e}")
+        if 'compattazione_journal' in registered:
+            self._compactor_stop.set()
+        self.logger.info(f"🗓️ Job di manutenzione pianificati: {', '.join(registered) or 'nessuno'}")
+        return registered
     
-    def create_daily_backup(self):
-        """Crea backup completo giornaliero (SQLite + JSON)"""
+    def create_daily_backup(self, progress=None) -> bool:
+        """
+        Crea backup completo giornaliero (SQLite + JSON) senza fermare il database.
+        
+        La copia usa l'API di backup SQLite a passi di `backup_step_pages` pagine (le scritture
+        del kiosk proseguono tra un passo e l'altro), viene verificata con integrity_check,
+        compressa in gzip se `compress_backups` e infine verificata confrontando l'hash SHA-256
+        del contenuto decompresso con quello della copia.
+        
+        Args:
+            progress: callback opzionale progress(fase, completati, totale) con fase in
+                      'copia', 'compressione', 'verifica'
+        """
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        compress = bool(DATA_CONFIG.get('compress_backups', True))
+        step_pages = int(DATA_CONFIG.get('backup_step_pages', 256))
+        copy_path = BACKUP_DIR / f"timbrature_backup_{timestamp}.db.tmp"
+        
+        def _report(fase, done, total):
+            if progress:
+                try:
+                    progress(fase, done, total)
+                except Exception:
+                    pass
+        
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            # Backup database SQLite (online, a passi)
+            with self._get_db_connection() as src:
+                dst = sqlite3.connect(str(copy_path))
+                try:
+                    src.backup(
+                        dst, pages=step_pages, sleep=0.005,
+                        progress=lambda status, remaining, total: _report('copia', total - remaining, total)
+                    )
+                    check = dst.execute("PRAGMA integrity_check").fetchone()
+                finally:
+                    dst.close()
+            if not check or check[0] != 'ok':
+                raise RuntimeError(f"integrity_check backup fallito: {check}")
             
-            # Backup database SQLite
-            backup_db_name = f"timbrature_backup_{timestamp}.db"
-            backup_db_path = BACKUP_DIR / backup_db_name
-            shutil.copy2(self.db_path, backup_db_path)
+            suffix = '.db.gz' if compress else '.db'
+            backup_db_path = BACKUP_DIR / f"timbrature_backup_{timestamp}{suffix}"
+            self._store_backup_file(copy_path, backup_db_path, compress, _report)
             
-            # Backup JSON
-            backup_json_name = f"timbrature_backup_{timestamp}.json"
-            backup_json_path = BACKUP_DIR / backup_json_name
-            if os.path.exists(self.json_backup_path):
-                shutil.copy2(self.json_backup_path, backup_json_path)
+            # Backup JSON (snapshot + journal incrementale)
+            for source, name in ((self.json_backup_path, f"timbrature_backup_{timestamp}.json"),
+                                 (self.journal_path, f"timbrature_backup_{timestamp}.jsonl")):
+                if os.path.exists(source):
+                    target = BACKUP_DIR / (name + ('.gz' if compress else ''))
+                    self._store_backup_file(Path(source), target, compress, None, keep_source=True)
             
-            self.logger.info(f"📦 Backup giornaliero creato: {backup_db_name}")
+            self.logger.info(f"📦 Backup giornaliero creato: {backup_db_path.name}")
             
             # Pulizia backup vecchi
             self._cleanup_old_backups()
@@ -448,6 +1994,79 @@ class TigotaSQLiteManager:
         except Exception as e:
             self.logger.error(f"Errore backup giornaliero: {e}")
             return False
+        finally:
+            try:
+                if copy_path.exists():
+                    copy_path.unlink()
+            except Exception:
+                pass
+    
+    def _store_backup_file(self, source: Path, target: Path, compress: bool, report=None,
+                           keep_source: bool = False, chunk_size: int = 1024 * 1024):
+        """
+        Copia source in target (gzip in streaming se compress) tramite file .part + os.replace,
+        poi verifica che il contenuto di target corrisponda (SHA-256) a quello di source.
+        """
+        total = os.path.getsize(source)
+        part_path = target.with_name(target.name + '.part')
+        source_hash = hashlib.sha256()
+        done = 0
+        try:
+            with open(source, 'rb') as src, \
+                    (gzip.open(part_path, 'wb', compresslevel=6) if compress else open(part_path, 'wb')) as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    source_hash.update(chunk)
+                    dst.write(chunk)
+                    done += len(chunk)
+                    if report:
+                        report('compressione', done, total)
+            os.replace(part_path, target)
+        finally:
+            if part_path.exists():
+                part_path.unlink()
+        
+        # Verifica: rilegge il backup finale
+        target_hash = hashlib.sha256()
+        done = 0
+        with (gzip.open(target, 'rb') if compress else open(target, 'rb')) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                target_hash.update(chunk)
+                done += len(chunk)
+                if report:
+                    report('verifica', done, total)
+        if target_hash.digest() != source_hash.digest():
+            target.unlink()
+            raise RuntimeError(f"Verifica backup fallita: {target.name}")
+        if not keep_source:
+            source.unlink()
+    
+    def start_daily_backup(self, progress=None, on_done=None) -> Optional[threading.Thread]:
+        """
+        Esegue create_daily_backup in un thread di background (non blocca il kiosk).
+        on_done(ok) viene chiamata al termine dal thread di backup.
+        Ritorna None se un backup è già in corso.
+        """
+        if getattr(self, '_backup_thread', None) and self._backup_thread.is_alive():
+            self.logger.warning("Backup già in corso")
+            return None
+        
+        def _run():
+            ok = self.create_daily_backup(progress=progress)
+            if on_done:
+                try:
+                    on_done(ok)
+                except Exception as e:
+                    self.logger.error(f"Errore callback backup: {e}")
+        
+        self._backup_thread = threading.Thread(target=_run, name='DailyBackup', daemon=True)
+        self._backup_thread.start()
+        return self._backup_thread
     
     def _cleanup_old_backups(self):
         """Rimuove backup più vecchi di N giorni"""
@@ -467,17 +2086,25 @@ class TigotaSQLiteManager:
         except Exception as e:
             self.logger.error(f"Errore pulizia backup: {e}")
     
-    def export_to_csv(self, start_date: datetime = None, end_date: datetime = None) -> Optional[str]:
+    def export_to_csv(self, start_date: datetime = None, end_date: datetime = None,
+                      compress: bool = False, row_callback=None, chunk_size: int = 1000) -> Optional[str]:
         """
         Esporta timbrature in formato CSV per HR systems
         
+        Le righe vengono lette dal cursore a blocchi (fetchmany) e scritte direttamente nel
+        CSV: la memoria resta costante qualunque sia la dimensione del range.
+        
         Args:
             start_date: Data inizio (default: 30 giorni fa)
             end_date: Data fine (default: oggi)
+            compress: True per scrivere un file .csv.gz
+            row_callback: callback opzionale row_callback(righe_scritte) chiamata dopo ogni riga
+            chunk_size: righe lette per fetchmany
             
         Returns:
             str: Path del file CSV creato o None se errore
         """
+        part_path = None
         try:
             # Date di default
             if not start_date:
@@ -485,19 +2112,15 @@ class TigotaSQLiteManager:
             if not end_date:
                 end_date = datetime.now()
             
-            # Ottieni dati
-            timbrature = self.get_timbrature_range(start_date, end_date)
-            
-            if not timbrature:
-                self.logger.warning("Nessuna timbratura da esportare")
-                return None
-            
             # Crea CSV
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            csv_filename = f"export_timbrature_{timestamp}.csv"
+            csv_filename = f"export_timbrature_{timestamp}.csv" + ('.gz' if compress else '')
             csv_path = EXPORT_DIR / csv_filename
+            part_path = EXPORT_DIR / (csv_filename + '.part')
             
-            with open(csv_path, 'w', encoding='utf-8', newline='') as csvfile:
+            count = 0
+            opener = gzip.open if compress else open
+            with opener(part_path, 'wt', encoding='utf-8', newline='') as csvfile:
                 writer = csv.writer(csvfile)
                 
                 # Header CSV
@@ -506,25 +2129,32 @@ class TigotaSQLiteManager:
                     'Tipo', 'Posizione', 'Tablet', 'Stato Sync'
                 ])
                 
-                # Dati
-                for t in timbrature:
-                    writer.writerow([
-                        t.get('id', ''),
-                        t.get('badge_id', ''),
-                        t.get('dipendente_nome', ''),
-                        t.get('dipendente_cognome', ''),
-                        t.get('timestamp', ''),
-                        t.get('tipo', ''),
-                        t.get('location', ''),
-                        t.get('tablet_id', ''),
-                        t.get('sync_status', '')
-                    ])
+                # Dati (streaming dal cursore)
+                for t in self._iter_timbrature_range(start_date, end_date, chunk_size=chunk_size):
+                    writer.writerow((
+                        t['id'], t['badge_id'], t['dipendente_nome'], t['dipendente_cognome'],
+                        t['timestamp'], t['tipo'], t['location'], t['tablet_id'], t['sync_status']
+                    ))
+                    count += 1
+                    if row_callback:
+                        row_callback(count)
+            
+            if count == 0:
+                os.remove(part_path)
+                self.logger.warning("Nessuna timbratura da esportare")
+                return None
+            os.replace(part_path, csv_path)
             
-            self.logger.info(f"📊 Export CSV creato: {csv_filename} ({len(timbrature)} record)")
+            self.logger.info(f"📊 Export CSV creato: {csv_filename} ({count} record)")
             return str(csv_path)
             
         except Exception as e:
             self.logger.error(f"Errore export CSV: {e}")
+            try:
+                if part_path and os.path.exists(part_path):
+                    os.remove(part_path)
+            except Exception:
+                pass
             return None
     
     def get_database_stats(self) -> Dict:
@@ -533,17 +2163,15 @@ class TigotaSQLiteManager:
             with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
-                # Statistiche generali
-                cursor.execute("SELECT COUNT(*) FROM timbrature")
-                total_timbrature = cursor.fetchone()[0]
-                
-                cursor.execute("SELECT COUNT(DISTINCT badge_id) FROM timbrature")
-                unique_badges = cursor.fetchone()[0]
+                # Statistiche generali (contatori mantenuti da trigger)
+                cursor.execute(self._STATS_QUERIES['stats_totals'])
+                totals = cursor.fetchone()
+                total_timbrature, unique_badges = (totals[0], totals[1]) if totals else (0, 0)
                 
                 # Timbrature oggi
-                today = datetime.now().date()
-                cursor.execute("SELECT COUNT(*) FROM timbrature WHERE DATE(timestamp) = ?", (today,))
-                timbrature_today = cursor.fetchone()[0]
+                cursor.execute(self._STATS_QUERIES['daily_stats'], (date.today().isoformat(),))
+                today_row = cursor.fetchone()
+                timbrature_today = today_row[0] if today_row else 0
                 
                 # Ultima timbratura
                 cursor.execute("SELECT timestamp FROM timbrature ORDER BY timestamp DESC LIMIT 1")
@@ -563,7 +2191,7 @@ class TigotaSQLiteManager:
                     'database_path': self.db_path
                 }
                 
-                self.logger.info(f"📈 Statistiche database: {stats}")
+                self.logger.debug(f"📈 Statistiche database: {stats}")
                 return stats
                 
         except Exception as e:
@@ -571,6 +2199,61 @@ class TigotaSQLiteManager:
             return {}
 
     # --- Gestione Dipendenti / Anagrafica ---
+    def _roster_db_version(self, conn) -> int:
+        """Legge il contatore di versione dell'anagrafica (0 se la tabella non esiste)"""
+        try:
+            row = conn.execute("SELECT version FROM roster_version WHERE id = 1").fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error:
+            return 0
+
+    def _reload_roster(self):
+        """Ricarica l'intero indice anagrafica dal database"""
+        try:
+            with self._get_db_connection() as conn:
+                version = self._roster_db_version(conn)
+                rows = conn.execute("SELECT * FROM dipendenti").fetchall()
+            self._roster.load(rows, version)
+            self._roster.last_check = time.monotonic()
+            self.logger.info(f"👥 Indice anagrafica caricato: {len(self._roster)} dipendenti (versione {version})")
+        except Exception as e:
+            self.logger.error(f"Errore caricamento indice anagrafica: {e}")
+
+    def _refresh_roster(self):
+        """Ricarica l'indice se l'anagrafica è cambiata (controllo al massimo ogni roster_refresh_interval s)"""
+        now = time.monotonic()
+        if now - self._roster.last_check < self._roster_refresh_interval:
+            return
+        self._roster.last_check = now
+        with self._get_db_connection() as conn:
+            version = self._roster_db_version(conn)
+        if version != self._roster.version:
+            self._reload_roster()
+
+    def _begin_roster_write(self, conn) -> int:
+        """Apre una transazione di scrittura sull'anagrafica e ritorna la versione di partenza"""
+        conn.execute("BEGIN IMMEDIATE")
+        return self._roster_db_version(conn)
+
+    def _commit_roster_write(self, conn, version_before: int, codici: List[str]):
+        """
+        Conclude la transazione e aggiorna l'indice in place per i codici modificati.
+        Se nel frattempo l'anagrafica era cambiata altrove, ricarica l'indice completo.
+        """
+        rows = [
+            row for row in (
+                conn.execute("SELECT * FROM dipendenti WHERE codice = ?", (c,)).fetchone() for c in codici
+            ) if row is not None
+        ]
+        version_after = self._roster_db_version(conn)
+        conn.commit()
+        if version_before != self._roster.version:
+            self._reload_roster()
+            return
+        for row in rows:
+            self._roster.put(row)
+        self._roster.version = version_after
+
     def upsert_dipendente(self, codice: str, nome: str, cognome: str = None) -> bool:
         """Crea o aggiorna un dipendente per codice (senza badge)."""
         if not codice or not nome:
@@ -582,6 +2265,7 @@ class TigotaSQLiteManager:
             return False
         with self._get_db_connection() as conn:
             try:
+                version_before = self._begin_roster_write(conn)
                 cursor = conn.cursor()
                 cursor.execute(
                     """
@@ -594,7 +2278,7 @@ class TigotaSQLiteManager:
                     """,
                     (norm_cod, nome.strip(), (cognome or '').strip() or None)
                 )
-                conn.commit()
+                self._commit_roster_write(conn, version_before, [norm_cod])
                 return True
             except Exception as e:
                 self.logger.error(f"Errore upsert dipendente {codice}: {e}")
@@ -611,6 +2295,7 @@ class TigotaSQLiteManager:
             return False
         with self._get_db_connection() as conn:
             try:
+                version_before = self._begin_roster_write(conn)
                 cursor = conn.cursor()
                 # Rimuovi eventuali altri dipendenti che già hanno questo badge per garantire unicità
                 cursor.execute("UPDATE dipendenti SET badge_id=NULL WHERE badge_id = ?", (badge_id.strip(),))
@@ -623,42 +2308,41 @@ class TigotaSQLiteManager:
                     """,
                     (badge_id.strip(), norm_cod)
                 )
-                conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                self._commit_roster_write(conn, version_before, [norm_cod])
+                return updated
             except Exception as e:
                 self.logger.error(f"Errore abbinamento badge {badge_id} a {codice}: {e}")
                 return False
 
     def get_dipendente_by_codice(self, codice: str) -> Optional[Dict]:
-        with self._get_db_connection() as conn:
-            try:
-                cursor = conn.cursor()
-                norm_cod = self._normalize_codice(codice)
-                if not norm_cod:
-                    return None
-                cursor.execute("SELECT * FROM dipendenti WHERE codice = ?", (norm_cod,))
-                row = cursor.fetchone()
-                return dict(row) if row else None
-            except Exception as e:
-                self.logger.error(f"Errore get_dipendente_by_codice {codice}: {e}")
+        try:
+            norm_cod = self._normalize_codice(codice)
+            if not norm_cod:
                 return None
+            self._refresh_roster()
+            return self._roster.by_codice(norm_cod)
+        except Exception as e:
+            self.logger.error(f"Errore get_dipendente_by_codice {codice}: {e}")
+            return None
 
     def get_dipendente_by_badge(self, badge_id: str) -> Optional[Dict]:
-        with self._get_db_connection() as conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM dipendenti WHERE badge_id = ?", (badge_id.strip(),))
-                row = cursor.fetchone()
-                return dict(row) if row else None
-            except Exception as e:
-                self.logger.error(f"Errore get_dipendente_by_badge {badge_id}: {e}")
-                return None
+        try:
+            self._refresh_roster()
+            return self._roster.by_badge(badge_id)
+        except Exception as e:
+            self.logger.error(f"Errore get_dipendente_by_badge {badge_id}: {e}")
+            return None
     
     def close(self):
         """Chiude database manager con cleanup finale"""
         try:
-            # Backup finale
-            self._create_json_backup()
+            # Svuota la coda write-behind; niente dump completo in chiusura:
+            # le timbrature non ancora nello snapshot restano nel journal
+            self._writer.stop()
+            self._compactor_stop.set()
+            self._journal.close()
+            self._pool.close_all()
             self.logger.info("🔒 Database SQLite chiuso correttamente")
             
         except Exception as e:
@@ -670,6 +2354,7 @@ class TigotaSQLiteManager:
         Svuota le tabelle del database per un test pulito.
         - keep_anagrafica=True: cancella solo timbrature e azzera badge su dipendenti (mantiene anagrafica senza badge)
         - keep_anagrafica=False: cancella timbrature e dipendenti
+        In entrambi i casi vengono eliminate anche le partizioni di archivio mensili.
         """
         with self._db_lock:
             try:
@@ -677,6 +2362,9 @@ class TigotaSQLiteManager:
                     cur = conn.cursor()
                     # Svuota timbrature
                     cur.execute("DELETE FROM timbrature")
+                    cur.execute("DELETE FROM transfer_watermark")
+                    # Batch aperti: riferiscono id non più esistenti (riprenderli riesporterebbe il vuoto)
+                    cur.execute("DELETE FROM transfer_batches")
                     if keep_anagrafica:
                         # Mantieni anagrafica ma rimuovi associazioni badge
                         try:
@@ -691,6 +2379,14 @@ class TigotaSQLiteManager:
                         cur.execute("VACUUM")
                     except Exception:
                         pass
+                # Partizioni di archivio: altrimenti le letture per range le ricollegherebbero
+                for path in self._archive_files():
+                    os.remove(path)
+                # Contatori, journal e snapshot JSON ripartono vuoti
+                self.rebuild_stats()
+                self._journal.reset()
+                self._create_json_backup()
+                self._reload_roster()
                 self.logger.info(f"🧹 Reset database completato (keep_anagrafica={keep_anagrafica})")
                 return True
             except Exception as e:
@@ -764,6 +2460,11 @@ if __name__ == "__main__":
         if csv_file:
             print(f"   File: {csv_file}")
         
+        # Piani di esecuzione (la verifica automatica è in tests/test_explain_plans.py)
+        plans = db.explain_range_queries()
+        for name, info in plans.items():
+            print(f"{'✅' if not info['full_scan'] else '❌'} Query plan {name}: {'; '.join(info['plan'])}")
+        
         # Test verifica integrità
         integrity_ok = db._verify_database_integrity()
         print(f"✅ Integrità database: {'OK' if integrity_ok else 'ERRORE'}")
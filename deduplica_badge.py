@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deduplicazione letture e timbrature per badge
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Due livelli, entrambi per singolo badge (un badge diverso passa sempre subito):
+- letture: le ripetizioni dello stesso badge entro finestra_s (tempo monotono, immune
+  ai cambi d'ora) sono soppresse; un badge tenuto appoggiato resta soppresso finché
+  continua a essere letto
+- timbrature: una nuova timbratura entro finestra_timbratura_s dall'ultima registrata
+  per lo stesso badge viene segnalata (non bloccata); è un quasi-duplicato solo se ha
+  lo stesso tipo (un'entrata seguita da un'uscita ravvicinata è una timbratura normale)
+
+Le ultime letture/timbrature stanno in mappe in memoria badge -> istante (O(1) per
+lettura), potate dalla testa: le voci sono in ordine di aggiornamento.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+
+class DeduplicatoreBadge:
+    """Soppressione delle letture ripetute e segnalazione delle timbrature ravvicinate, per badge"""
+
+    def __init__(self, finestra_s: float = 2.0, finestra_timbratura_s: float = 60.0):
+        self.finestra_s = finestra_s
+        self.finestra_timbratura_s = finestra_timbratura_s
+        self._lock = threading.Lock()
+        self._letture: 'OrderedDict[str, float]' = OrderedDict()  # badge -> monotonic ultima lettura
+        self._timbrature: 'OrderedDict[str, tuple]' = OrderedDict()  # badge -> (monotonic, datetime, tipo)
+        self.ammesse = 0
+        self.soppresse = 0
+        self.ravvicinate = 0       # qualsiasi timbratura entro la finestra
+        self.quasi_duplicati = 0   # di queste, quelle con lo stesso tipo della precedente
+
+    # --- Letture ---
+    def ammetti(self, badge_id: str, adesso: Optional[float] = None) -> bool:
+        """True se la lettura va consegnata; False se ripete lo stesso badge entro finestra_s"""
+        adesso = time.monotonic() if adesso is None else adesso
+        with self._lock:
+            precedente = self._letture.pop(badge_id, None)
+            self._letture[badge_id] = adesso  # in coda: la testa resta la più vecchia
+            self._pota(self._letture, adesso - self.finestra_s, lambda v: v)
+            if precedente is not None and adesso - precedente < self.finestra_s:
+                self.soppresse += 1
+                return False
+            self.ammesse += 1
+            return True
+
+    # --- Timbrature ---
+    def verifica_timbratura(self, badge_id: str, tipo: str, adesso: Optional[float] = None) -> Optional[Dict]:
+        """
+        Confronta con l'ultima timbratura registrata per il badge.
+
+        Returns:
+            None se la precedente è fuori dalla finestra, altrimenti un dict con 'timestamp'
+            e 'tipo' della precedente, 'secondi' trascorsi e 'stesso_tipo' (quasi-duplicato)
+        """
+        adesso = time.monotonic() if adesso is None else adesso
+        with self._lock:
+            ultima = self._timbrature.get(badge_id)
+            if ultima is None:
+                return None
+            t_mono, timestamp, tipo_prec = ultima
+            secondi = adesso - t_mono
+            if secondi >= self.finestra_timbratura_s:
+                return None
+            self.ravvicinate += 1
+            if tipo_prec == tipo:
+                self.quasi_duplicati += 1
+        return {'timestamp': timestamp, 'tipo': tipo_prec, 'secondi': secondi, 'stesso_tipo': tipo_prec == tipo}
+
+    def registra_timbratura(self, badge_id: str, tipo: str, timestamp: Optional[datetime] = None,
+                            adesso: Optional[float] = None):
+        """Aggiorna l'ultima timbratura del badge (da chiamare quando la timbratura viene salvata)"""
+        adesso = time.monotonic() if adesso is None else adesso
+        with self._lock:
+            self._timbrature.pop(badge_id, None)
+            self._timbrature[badge_id] = (adesso, timestamp or datetime.now(), tipo)
+            self._pota(self._timbrature, adesso - self.finestra_timbratura_s, lambda v: v[0])
+
+    def carica_ultime_timbrature(self, db) -> int:
+        """Ricarica dal database le timbrature ancora dentro la finestra (dopo un riavvio)"""
+        ora, adesso = datetime.now(), time.monotonic()
+        righe = db.get_ultime_timbrature_per_badge(ora - timedelta(seconds=self.finestra_timbratura_s))
+        righe.sort(key=lambda r: r['timestamp'])
+        for riga in righe:
+            timestamp = riga['timestamp']
+            if not isinstance(timestamp, datetime):
+                timestamp = datetime.fromisoformat(str(timestamp))
+            trascorsi = max(0.0, (ora - timestamp).total_seconds())
+            self.registra_timbratura(riga['badge_id'], riga['tipo'], timestamp, adesso - trascorsi)
+        return len(righe)
+
+    @staticmethod
+    def _pota(mappa: OrderedDict, limite: float, istante):
+        while mappa:
+            badge, valore = next(iter(mappa.items()))
+            if istante(valore) >= limite:
+                break
+            del mappa[badge]
+
+    def stato(self) -> Dict:
+        with self._lock:
+            return {
+                'finestra_s': self.finestra_s,
+                'finestra_timbratura_s': self.finestra_timbratura_s,
+                'ammesse': self.ammesse,
+                'soppresse': self.soppresse,
+                'ravvicinate': self.ravvicinate,
+                'quasi_duplicati': self.quasi_duplicati,
+                'badge_letture': len(self._letture),
+                'badge_timbrature': len(self._timbrature),
+            }
+
+
+# Istanza di processo (come get_database_manager)
+_deduplicatore: Optional[DeduplicatoreBadge] = None
+_lock_istanza = threading.Lock()
+
+
+def get_deduplicatore() -> DeduplicatoreBadge:
+    """Deduplicatore condiviso, con le finestre di NFC_CONFIG"""
+    global _deduplicatore
+    with _lock_istanza:
+        if _deduplicatore is None:
+            from config_tablet import NFC_CONFIG
+            _deduplicatore = DeduplicatoreBadge(NFC_CONFIG.get('duplicate_window_s', 2.0),
+                                                NFC_CONFIG.get('near_duplicate_window_s', 60.0))
+        return _deduplicatore
+
+
+if __name__ == "__main__":
+    # Verifiche funzionali in tests/test_deduplica_badge.py; qui solo il costo per lettura
+    print("⏱️ Benchmark deduplicazione badge")
+    print("=" * 40)
+    dedup = DeduplicatoreBadge(finestra_s=2.0, finestra_timbratura_s=60.0)
+    n = 200_000
+    t0 = time.perf_counter()
+    for i in range(n):
+        dedup.ammetti(f"BADGE{i % 500:04d}", 100.0 + i * 0.001)
+    durata = time.perf_counter() - t0
+    print(f"   ✅ {n} letture su 500 badge: {durata / n * 1e6:.2f} µs/lettura, "
+          f"{dedup.stato()['badge_letture']} badge in memoria")
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ingestione in sede centrale dei file ORE*.TXT prodotti dai negozi
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Ogni negozio deposita ORE{codice_negozio}{YYYYMMDDHHMMSS}.TXT nella propria cartella di
+trasferimento. IngestioneSede scansiona l'albero delle cartelle (centinaia di negozi),
+analizza i nuovi file in parallelo con un pool di processi (parser derivato dal tracciato
+'ORE' di tracciati_payroll) e carica le timbrature in un database SQLite centrale
+partizionato per negozio e mese:
+
+    {db_dir}/catalogo.db                          file importati + righe per partizione
+    {db_dir}/{negozio}/timbrature_YYYY_MM.db      timbrature del negozio nel mese
+
+Le timbrature sono deduplicate per (negozio, badge, minuto): chiave primaria della
+partizione + INSERT OR IGNORE, quindi reimportare un file (anche dopo un crash tra il
+caricamento e la registrazione nel catalogo) non crea duplicati.
+Il caricamento resta su un solo processo (un writer per file SQLite), il parsing scala
+sui core disponibili: con più processi il collo di bottiglia è il caricamento, che
+importa() misura a parte (secondi_analisi / secondi_caricamento).
+
+Le date del tracciato sono GGMMAA: il secolo viene dall'anno del file (timestamp nel
+nome, altrimenti mtime) e le righe con data o ora inesistenti vengono scartate.
+
+Uso: python ingestione_sede.py RADICE DB_DIR [--workers N] [--intervallo S] [--una-volta]
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from tracciati_payroll import compila_parser
+
+# File ORE{negozio}{YYYYMMDDHHMMSS}.TXT (.part esclusi: ancora in scrittura)
+RE_FILE_ORE = re.compile(r'^ORE(?P<negozio>.*?)(?P<ts>\d{14})\.TXT$', re.IGNORECASE)
+# Età minima (s) di un file prima dell'import: evita file ancora in copia sulle share di rete
+ETA_MINIMA_FILE = 2.0
+# Connessioni di partizione tenute aperte (LRU)
+MAX_PARTIZIONI_APERTE = 32
+
+SCHEMA_CATALOGO = """
+CREATE TABLE IF NOT EXISTS file_importati (
+    path TEXT PRIMARY KEY,
+    negozio TEXT NOT NULL,
+    dimensione INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    righe INTEGER NOT NULL,          -- Record validi nel file
+    nuove INTEGER NOT NULL,          -- Timbrature inserite (al netto dei duplicati)
+    scartate INTEGER NOT NULL,       -- Righe non conformi al tracciato
+    importato_il DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS partizioni (
+    negozio TEXT NOT NULL,
+    mese TEXT NOT NULL,              -- 'YYYY-MM'
+    path TEXT NOT NULL,
+    righe INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (negozio, mese)
+) WITHOUT ROWID;
+"""
+
+SCHEMA_PARTIZIONE = """
+CREATE TABLE IF NOT EXISTS timbrature (
+    negozio TEXT NOT NULL,
+    badge TEXT NOT NULL,
+    minuto TEXT NOT NULL,            -- 'YYYY-MM-DD HH:MM'
+    tipo TEXT NOT NULL CHECK (tipo IN ('entrata', 'uscita')),
+    sede TEXT,
+    PRIMARY KEY (negozio, badge, minuto)
+) WITHOUT ROWID;
+"""
+
+_parser_ore = None
+
+
+def anno_completo(aa: int, anno_file: int) -> int:
+    """
+    Anno a 4 cifre di una data GGMMAA: l'unico nella finestra di 100 anni che termina
+    all'anno successivo a quello del file (es. '99' in un file del 2100 -> 2099,
+    '00' in un file del 2099 -> 2100).
+    """
+    anno = anno_file - anno_file % 100 + aa
+    if anno > anno_file + 1:
+        anno -= 100
+    elif anno < anno_file - 98:
+        anno += 100
+    return anno
+
+
+def analizza_file(path: str) -> Dict:
+    """
+    Analizza un file ORE (eseguito nei processi del pool).
+    Ritorna negozio, righe deduplicate nel file [(badge, minuto, tipo, sede)], conteggi, sha256
+    e secondi di analisi.
+    """
+    t0 = time.perf_counter()
+    global _parser_ore
+    if _parser_ore is None:
+        _parser_ore = compila_parser('ORE')
+    analizza = _parser_ore
+
+    nome = os.path.basename(path)
+    m = RE_FILE_ORE.match(nome)
+    negozio = (m.group('negozio') if m else '') or os.path.basename(os.path.dirname(path))
+    with open(path, 'rb') as f:
+        contenuto = f.read()
+    stat = os.stat(path)
+    try:
+        anno_file = datetime.strptime(m.group('ts'), '%Y%m%d%H%M%S').year
+    except (AttributeError, ValueError):
+        anno_file = datetime.fromtimestamp(stat.st_mtime).year
+
+    righe = {}
+    scartate = 0
+    validi = 0
+    for riga in contenuto.decode('utf-8', errors='replace').splitlines():
+        if not riga.strip():
+            continue
+        campi = analizza(riga)
+        if campi is None:
+            scartate += 1
+            continue
+        data, ora, badge = campi['data'], campi['ora'], campi['badge']
+        if not (data.isdigit() and ora.isdigit() and badge.isdigit()):
+            scartate += 1
+            continue
+        # GGMMAA + HHMM -> 'YYYY-MM-DD HH:MM' (secolo dall'anno del file; data e ora devono esistere)
+        anno = anno_completo(int(data[4:6]), anno_file)
+        try:
+            datetime(anno, int(data[2:4]), int(data[0:2]), int(ora[0:2]), int(ora[2:4]))
+        except ValueError:
+            scartate += 1
+            continue
+        minuto = f"{anno}-{data[2:4]}-{data[0:2]} {ora[0:2]}:{ora[2:4]}"
+        validi += 1
+        # Stesso negozio/badge/minuto nel file: vale la prima occorrenza
+        chiave = (badge, minuto)
+        if chiave not in righe:
+            righe[chiave] = ('entrata' if campi['tipo'] == '1' else 'uscita', campi['sede'])
+    return {
+        'path': path,
+        'negozio': negozio,
+        'righe': [(badge, minuto, tipo, sede) for (badge, minuto), (tipo, sede) in righe.items()],
+        'validi': validi,
+        'scartate': scartate,
+        'dimensione': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': hashlib.sha256(contenuto).hexdigest(),
+        'secondi': time.perf_counter() - t0,
+    }
+
+
+class IngestioneSede:
+    """Scansione dell'albero negozi, parsing parallelo e caricamento nel database centrale"""
+
+    def __init__(self, radice: str, db_dir: str, workers: Optional[int] = None, intervallo: float = 30.0):
+        self.radice = radice
+        self.db_dir = db_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.intervallo = intervallo
+        self.logger = logging.getLogger('IngestioneSede')
+        os.makedirs(db_dir, exist_ok=True)
+
+        self._catalogo = self._connetti(os.path.join(db_dir, 'catalogo.db'))
+        self._catalogo.executescript(SCHEMA_CATALOGO)
+        # path -> (dimensione, mtime) dei file già importati
+        self._importati = {
+            path: (dim, mtime)
+            for path, dim, mtime in self._catalogo.execute("SELECT path, dimensione, mtime FROM file_importati")
+        }
+        self._partizioni: "OrderedDict[Tuple[str, str], sqlite3.Connection]" = OrderedDict()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _connetti(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _path_partizione(self, negozio: str, mese: str) -> str:
+        nome_dir = re.sub(r'[^0-9A-Za-z_-]', '_', negozio) or '_senza_codice'
+        return os.path.join(self.db_dir, nome_dir, f"timbrature_{mese.replace('-', '_')}.db")
+
+    def _partizione(self, negozio: str, mese: str) -> sqlite3.Connection:
+        chiave = (negozio, mese)
+        conn = self._partizioni.get(chiave)
+        if conn is not None:
+            self._partizioni.move_to_end(chiave)
+            return conn
+        path = self._path_partizione(negozio, mese)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._connetti(path)
+        conn.executescript(SCHEMA_PARTIZIONE)
+        self._catalogo.execute(
+            "INSERT OR IGNORE INTO partizioni (negozio, mese, path) VALUES (?, ?, ?)", (negozio, mese, path)
+        )
+        self._partizioni[chiave] = conn
+        if len(self._partizioni) > MAX_PARTIZIONI_APERTE:
+            _, vecchia = self._partizioni.popitem(last=False)
+            vecchia.close()
+        return conn
+
+    # --- Scansione ---
+    def scansiona(self) -> List[str]:
+        """File ORE nuovi o modificati nell'albero (ordinati per nome: timestamp crescente per negozio)"""
+        nuovi = []
+        limite = time.time() - ETA_MINIMA_FILE
+        for cartella, _, files in os.walk(self.radice):
+            for nome in files:
+                if not RE_FILE_ORE.match(nome):
+                    continue
+                path = os.path.join(cartella, nome)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime > limite:
+                    continue
+                if self._importati.get(path) == (stat.st_size, stat.st_mtime):
+                    continue
+                nuovi.append(path)
+        return sorted(nuovi)
+
+    # --- Caricamento ---
+    def _carica(self, risultato: Dict) -> int:
+        """Carica le righe di un file nelle partizioni e lo registra nel catalogo; ritorna le nuove"""
+        negozio = risultato['negozio']
+        per_mese: Dict[str, List[Tuple]] = {}
+        for badge, minuto, tipo, sede in risultato['righe']:
+            per_mese.setdefault(minuto[:7], []).append((negozio, badge, minuto, tipo, sede))
+        nuove = 0
+        for mese, righe in per_mese.items():
+            conn = self._partizione(negozio, mese)
+            prima = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO timbrature (negozio, badge, minuto, tipo, sede) VALUES (?, ?, ?, ?, ?)", righe
+            )
+            conn.commit()
+            inserite = conn.total_changes - prima
+            nuove += inserite
+            self._catalogo.execute(
+                "UPDATE partizioni SET righe = righe + ? WHERE negozio = ? AND mese = ?", (inserite, negozio, mese)
+            )
+        # Registrazione dopo il commit delle partizioni: un crash nel mezzo porta solo a un reimport idempotente
+        self._catalogo.execute("""
+            INSERT OR REPLACE INTO file_importati (path, negozio, dimensione, mtime, sha256, righe, nuove, scartate)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (risultato['path'], negozio, risultato['dimensione'], risultato['mtime'], risultato['sha256'],
+              risultato['validi'], nuove, risultato['scartate']))
+        self._catalogo.commit()
+        self._importati[risultato['path']] = (risultato['dimensione'], risultato['mtime'])
+        return nuove
+
+    def importa(self, files: List[str]) -> Dict:
+        """
+        Analizza i file con il pool di processi (workers=1: nel processo corrente) e li carica
+        man mano che i risultati arrivano.
+
+        Returns:
+            Dict: file, record validi, nuove timbrature, duplicati, scartate, errori, secondi
+                  (totali), secondi_analisi (parsing, sommati su tutti i processi) e
+                  secondi_caricamento (SQLite, un solo writer)
+        """
+        stats = {'file': 0, 'record': 0, 'nuove': 0, 'duplicati': 0, 'scartate': 0, 'errori': 0,
+                 'secondi': 0.0, 'secondi_analisi': 0.0, 'secondi_caricamento': 0.0}
+        if not files:
+            return stats
+        t0 = time.perf_counter()
+
+        def _registra(risultato):
+            t_carica = time.perf_counter()
+            nuove = self._carica(risultato)
+            stats['secondi_caricamento'] += time.perf_counter() - t_carica
+            stats['secondi_analisi'] += risultato['secondi']
+            stats['file'] += 1
+            stats['record'] += risultato['validi']
+            stats['nuove'] += nuove
+            stats['duplicati'] += risultato['validi'] - nuove
+            stats['scartate'] += risultato['scartate']
+
+        if self.workers <= 1:
+            for path in files:
+                try:
+                    _registra(analizza_file(path))
+                except Exception as e:
+                    stats['errori'] += 1
+                    self.logger.error(f"Errore import {path}: {e}")
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(analizza_file, path): path for path in files}
+                for future in as_completed(futures):
+                    try:
+                        _registra(future.result())
+                    except Exception as e:
+                        stats['errori'] += 1
+                        self.logger.error(f"Errore import {futures[future]}: {e}")
+        stats['secondi'] = time.perf_counter() - t0
+        self.logger.info(
+            f"📥 Importati {stats['file']} file: {stats['nuove']} timbrature nuove, "
+            f"{stats['duplicati']} duplicati, {stats['scartate']} righe scartate in {stats['secondi']:.1f}s"
+        )
+        return stats
+
+    def esegui_ciclo(self) -> Dict:
+        """Una scansione + import dei file nuovi"""
+        return self.importa(self.scansiona())
+
+    # --- Servizio ---
+    def start(self):
+        """Avvia il ciclo periodico di scansione in un thread daemon"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def _loop():
+            while not self._stop.is_set():
+                try:
+                    self.esegui_ciclo()
+                except Exception as e:
+                    self.logger.error(f"Errore ciclo ingestione: {e}")
+                self._stop.wait(self.intervallo)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=_loop, name='IngestioneSede', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def conta(self, negozio: Optional[str] = None, mese: Optional[str] = None) -> int:
+        """Timbrature caricate (dal catalogo partizioni), filtrabili per negozio e/o mese 'YYYY-MM'"""
+        sql = "SELECT COALESCE(SUM(righe), 0) FROM partizioni WHERE 1 = 1"
+        params = []
+        if negozio is not None:
+            sql += " AND negozio = ?"
+            params.append(negozio)
+        if mese is not None:
+            sql += " AND mese = ?"
+            params.append(mese)
+        return self._catalogo.execute(sql, params).fetchone()[0]
+
+    def close(self):
+        self.stop()
+        for conn in self._partizioni.values():
+            conn.close()
+        self._partizioni.clear()
+        self._catalogo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestione file ORE dei negozi nel database centrale")
+    parser.add_argument("radice", help="Cartella radice con le cartelle di trasferimento dei negozi")
+    parser.add_argument("db_dir", help="Cartella del database centrale (catalogo + partizioni)")
+    parser.add_argument("--workers", type=int, default=None, help="Processi di parsing (default: core disponibili)")
+    parser.add_argument("--intervallo", type=float, default=30.0, help="Secondi tra due scansioni")
+    parser.add_argument("--una-volta", action="store_true", help="Esegue una sola scansione ed esce")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ingestione = IngestioneSede(args.radice, args.db_dir, workers=args.workers, intervallo=args.intervallo)
+    try:
+        if args.una_volta:
+            ingestione.esegui_ciclo()
+            return
+        print(f"📡 Ingestione attiva su {args.radice} (ogni {args.intervallo:.0f}s, Ctrl+C per uscire)")
+        ingestione.start()
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingestione.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lettore badge PC/SC (lettori NFC/contactless standard, es. ACR122U) per il bus eventi badge
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Guidato dagli eventi di presenza carta, non da polling: il thread resta bloccato in
+SCardGetStatusChange finché una carta viene appoggiata o tolta (o un lettore collegato),
+legge l'UID con l'APDU GET DATA (FF CA 00 00 00) e pubblica subito sul bus badge, quindi
+la latenza appoggio -> callback è quella dell'hardware.
+
+Il lettore parla con un "servizio carte" intercambiabile:
+- ServizioCartePCSC: PC/SC reale tramite pyscard (smartcard.scard), opzionale
+- ServizioCarteSimulato: carte e lettori in memoria, per provare senza hardware
+
+Un servizio carte espone apri(), attendi_eventi(timeout_s) -> [(tipo, lettore)] con tipo
+'inserita'/'rimossa', trasmetti(lettore, apdu) -> risposta con SW1 SW2 in coda,
+annulla() per sbloccare l'attesa e chiudi().
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from smartcard import scard
+    PYSCARD_AVAILABLE = True
+except ImportError:
+    scard = None
+    PYSCARD_AVAILABLE = False
+
+from badge_bus import get_badge_bus
+
+APDU_GET_DATA_UID = [0xFF, 0xCA, 0x00, 0x00, 0x00]
+SW_OK = (0x90, 0x00)
+FORMATI_UID = ('hex', 'hex_inverso', 'decimale', 'decimale_inverso')
+LETTORE_PNP = '\\\\?PnP?\\Notification'  # pseudo-lettore PC/SC: notifica collegamento lettori
+# Attesa massima di un evento carta: l'attesa è bloccante, il limite serve solo a ricontrollare lo stop
+ATTESA_EVENTI_S = 60.0
+
+
+class ErrorePCSC(Exception):
+    """Errore del servizio carte o risposta APDU non valida"""
+
+
+def formatta_uid(uid: bytes, formato: str = 'hex') -> str:
+    """UID come testo del badge: esadecimale maiuscolo o decimale, nell'ordine dei byte o invertito"""
+    if formato not in FORMATI_UID:
+        raise ValueError(f"formato UID '{formato}' non valido: usare {', '.join(FORMATI_UID)}")
+    if formato.endswith('_inverso'):
+        uid = uid[::-1]
+    if formato.startswith('decimale'):
+        return str(int.from_bytes(uid, 'big'))
+    return uid.hex().upper()
+
+
+class ServizioCartePCSC:
+    """Servizio carte PC/SC reale (pyscard, API smartcard.scard)"""
+
+    def __init__(self, attesa_max_s: float = ATTESA_EVENTI_S):
+        # Senza notifiche PnP la lista lettori viene riletta almeno ogni attesa_max_s
+        self.attesa_max_s = attesa_max_s
+        self._contesto = None
+        self._stati: Dict[str, int] = {}
+        self._stato_pnp = 0
+        self._pnp = True
+        # Sblocca anche l'attesa senza lettori e senza PnP, dove SCardCancel non ha effetto
+        self._annullato = threading.Event()
+
+    def _verifica(self, hresult, operazione: str):
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise ErrorePCSC(f"{operazione}: {scard.SCardGetErrorMessage(hresult)}")
+
+    def apri(self):
+        if not PYSCARD_AVAILABLE:
+            raise ErrorePCSC("pyscard non installato: lettore PC/SC non disponibile")
+        hresult, self._contesto = scard.SCardEstablishContext(scard.SCARD_SCOPE_USER)
+        self._verifica(hresult, "SCardEstablishContext")
+        self._annullato.clear()
+        self._stati = {}
+        self._aggiorna_lettori()
+
+    def lettori(self) -> List[str]:
+        return list(self._stati)
+
+    def _aggiorna_lettori(self):
+        hresult, lettori = scard.SCardListReaders(self._contesto, [])
+        if hresult == scard.SCARD_E_NO_READERS_AVAILABLE:
+            lettori = []
+        else:
+            self._verifica(hresult, "SCardListReaders")
+        self._stati = {lettore: self._stati.get(lettore, scard.SCARD_STATE_UNAWARE) for lettore in lettori}
+
+    def attendi_eventi(self, timeout_s: Optional[float] = None) -> List[Tuple[str, str]]:
+        attesa = self.attesa_max_s if timeout_s is None else min(timeout_s, self.attesa_max_s)
+        stati = list(self._stati.items())
+        if self._pnp:
+            stati.append((LETTORE_PNP, self._stato_pnp))
+        if not stati:
+            # Nessun lettore e niente PnP: solo qui si ricontrolla a intervalli
+            if self._annullato.wait(attesa):
+                self._annullato.clear()
+                return []
+            self._aggiorna_lettori()
+            return []
+        hresult, nuovi = scard.SCardGetStatusChange(self._contesto, int(attesa * 1000), stati)
+        if hresult in (scard.SCARD_E_TIMEOUT, scard.SCARD_E_CANCELLED):
+            if not self._pnp:
+                self._aggiorna_lettori()
+            return []
+        if hresult != scard.SCARD_S_SUCCESS and self._pnp:
+            self._pnp = False  # PnP non supportato da questo driver: si rilegge la lista a timeout
+            return []
+        self._verifica(hresult, "SCardGetStatusChange")
+
+        eventi = []
+        cambiati_lettori = False
+        for lettore, stato, _atr in nuovi:
+            stato_noto = stato & ~scard.SCARD_STATE_CHANGED
+            if lettore == LETTORE_PNP:
+                cambiati_lettori = bool(stato & scard.SCARD_STATE_CHANGED)
+                self._stato_pnp = stato_noto
+                continue
+            presente = bool(stato & scard.SCARD_STATE_PRESENT)
+            era_presente = bool(self._stati.get(lettore, 0) & scard.SCARD_STATE_PRESENT)
+            if presente and not era_presente:
+                eventi.append(('inserita', lettore))
+            elif era_presente and not presente:
+                eventi.append(('rimossa', lettore))
+            self._stati[lettore] = stato_noto
+        if cambiati_lettori:
+            self._aggiorna_lettori()
+        return eventi
+
+    def trasmetti(self, lettore: str, apdu: List[int]) -> List[int]:
+        hresult, carta, protocollo = scard.SCardConnect(
+            self._contesto, lettore, scard.SCARD_SHARE_SHARED, scard.SCARD_PROTOCOL_T0 | scard.SCARD_PROTOCOL_T1)
+        self._verifica(hresult, "SCardConnect")
+        try:
+            hresult, risposta = scard.SCardTransmit(carta, protocollo, apdu)
+            self._verifica(hresult, "SCardTransmit")
+            return list(risposta)
+        finally:
+            scard.SCardDisconnect(carta, scard.SCARD_LEAVE_CARD)
+
+    def annulla(self):
+        self._annullato.set()
+        if self._contesto is not None:
+            scard.SCardCancel(self._contesto)
+
+    def chiudi(self):
+        contesto, self._contesto = self._contesto, None
+        if contesto is not None:
+            try:
+                scard.SCardReleaseContext(contesto)
+            except Exception:
+                pass
+
+
+class ServizioCarteSimulato:
+    """Servizio carte in memoria: appoggia()/togli() generano gli stessi eventi del PC/SC reale"""
+
+    def __init__(self, lettori=('Lettore simulato 0',), latenza_apdu_s: float = 0.0):
+        self._lettori = list(lettori)
+        self.latenza_apdu_s = latenza_apdu_s
+        self._carte: Dict[str, bytes] = {}
+        self._eventi = deque()
+        self._cond = threading.Condition()
+        self._generazione = 0
+        self.apdu_trasmesse = 0
+
+    def apri(self):
+        pass
+
+    def lettori(self) -> List[str]:
+        return list(self._lettori)
+
+    def appoggia(self, uid, lettore: Optional[str] = None):
+        """Appoggia una carta (uid in bytes o esadecimale) sul lettore"""
+        lettore = lettore or self._lettori[0]
+        uid = bytes.fromhex(uid) if isinstance(uid, str) else bytes(uid)
+        with self._cond:
+            if lettore in self._carte:
+                self._eventi.append(('rimossa', lettore))
+            self._carte[lettore] = uid
+            self._eventi.append(('inserita', lettore))
+            self._cond.notify_all()
+
+    def togli(self, lettore: Optional[str] = None):
+        lettore = lettore or self._lettori[0]
+        with self._cond:
+            if self._carte.pop(lettore, None) is not None:
+                self._eventi.append(('rimossa', lettore))
+                self._cond.notify_all()
+
+    def attendi_eventi(self, timeout_s: Optional[float] = None) -> List[Tuple[str, str]]:
+        with self._cond:
+            if not self._eventi:
+                generazione = self._generazione
+                self._cond.wait_for(lambda: self._eventi or self._generazione != generazione, timeout_s)
+            eventi = list(self._eventi)
+            self._eventi.clear()
+            return eventi
+
+    def trasmetti(self, lettore: str, apdu: List[int]) -> List[int]:
+        if self.latenza_apdu_s:
+            time.sleep(self.latenza_apdu_s)
+        with self._cond:
+            self.apdu_trasmesse += 1
+            uid = self._carte.get(lettore)
+        if uid is None:
+            raise ErrorePCSC("SCardConnect: carta rimossa")
+        if list(apdu) == APDU_GET_DATA_UID:
+            return list(uid) + list(SW_OK)
+        return [0x6A, 0x81]  # funzione non supportata
+
+    def annulla(self):
+        with self._cond:
+            self._generazione += 1
+            self._cond.notify_all()
+
+    def chiudi(self):
+        self.annulla()
+
+
+class LettorePCSC:
+    """
+    Sorgente badge PC/SC da registrare con ServizioLettoreBadge.aggiungi_sorgente
+    (start/stop/salute). Pubblica l'UID di ogni carta appoggiata con sorgente 'pcsc'.
+    """
+
+    def __init__(self, servizio_carte=None, bus=None, formato_uid: str = 'hex',
+                 riconnessione_min_s: float = 1.0, riconnessione_max_s: float = 30.0):
+        if formato_uid not in FORMATI_UID:
+            raise ValueError(f"formato UID '{formato_uid}' non valido: usare {', '.join(FORMATI_UID)}")
+        self.servizio_carte = servizio_carte if servizio_carte is not None else ServizioCartePCSC()
+        self.bus = bus if bus is not None else get_badge_bus()
+        self.formato_uid = formato_uid
+        self.riconnessione_min_s = riconnessione_min_s
+        self.riconnessione_max_s = riconnessione_max_s
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._connesso = False
+        self._errori_consecutivi = 0
+        self._ultimo_errore: Optional[str] = None
+        self._letture = 0
+        self._errori_lettura = 0
+        self._carte_presenti = 0
+        self._ultima_lettura: Optional[datetime] = None
+        self._latenza_ultima_ms: Optional[float] = None
+        self._latenza_max_ms = 0.0
+        self._latenza_totale_ms = 0.0
+
+    # --- Ciclo di vita ---
+    def start(self):
+        if isinstance(self.servizio_carte, ServizioCartePCSC) and not PYSCARD_AVAILABLE:
+            self._ultimo_errore = "pyscard non installato: lettore PC/SC non disponibile"
+            raise RuntimeError(self._ultimo_errore)
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='badge-pcsc', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0):
+        self._stop.set()
+        try:
+            self.servizio_carte.annulla()  # sblocca l'attesa degli eventi
+        except Exception:
+            pass
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def salute(self) -> Dict:
+        with self._lock:
+            return {
+                'attiva': self.is_running(),
+                'connesso': self._connesso,
+                'lettori': self.servizio_carte.lettori() if self._connesso else [],
+                'carte_presenti': self._carte_presenti,
+                'errore': None if self._connesso else self._ultimo_errore,
+                'letture': self._letture,
+                'errori_lettura': self._errori_lettura,
+                'ultima_lettura': self._ultima_lettura,
+                'latenza_ultima_ms': self._latenza_ultima_ms,
+                'latenza_media_ms': self._latenza_totale_ms / self._letture if self._letture else None,
+                'latenza_max_ms': self._latenza_max_ms,
+            }
+
+    # --- Lettura ---
+    def leggi_uid(self, lettore: str) -> str:
+        """UID della carta sul lettore tramite GET DATA; ErrorePCSC se la carta non risponde 90 00"""
+        risposta = self.servizio_carte.trasmetti(lettore, APDU_GET_DATA_UID)
+        if len(risposta) < 2 or tuple(risposta[-2:]) != SW_OK:
+            sw = ''.join(f"{b:02X}" for b in risposta[-2:])
+            raise ErrorePCSC(f"GET DATA UID rifiutato (SW {sw})")
+        if len(risposta) == 2:
+            raise ErrorePCSC("GET DATA UID: risposta senza UID")
+        return formatta_uid(bytes(risposta[:-2]), self.formato_uid)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.servizio_carte.apri()
+            except Exception as e:
+                self._errore(e)
+                continue
+            with self._lock:
+                self._connesso = True
+                self._errori_consecutivi = 0
+            print(f"[NFC] Lettore PC/SC attivo: {', '.join(self.servizio_carte.lettori()) or 'nessun lettore collegato'}")
+            try:
+                while not self._stop.is_set():
+                    for tipo, lettore in self.servizio_carte.attendi_eventi(ATTESA_EVENTI_S):
+                        self._gestisci(tipo, lettore)
+            except Exception as e:
+                if not self._stop.is_set():
+                    self._errore(e)
+            finally:
+                with self._lock:
+                    self._connesso = False
+                    self._carte_presenti = 0
+                try:
+                    self.servizio_carte.chiudi()
+                except Exception:
+                    pass
+
+    def _gestisci(self, tipo: str, lettore: str):
+        if tipo == 'rimossa':
+            with self._lock:
+                self._carte_presenti = max(0, self._carte_presenti - 1)
+            return
+        t0 = time.perf_counter()
+        with self._lock:
+            self._carte_presenti += 1
+        try:
+            badge_id = self.leggi_uid(lettore)
+        except ErrorePCSC as e:
+            # Carta tolta troppo presto o non ISO 14443: la prossima appoggiata riprova
+            with self._lock:
+                self._errori_lettura += 1
+                self._ultimo_errore = f"{datetime.now().strftime('%H:%M:%S')} {lettore}: {e}"
+            print(f"[NFC] Lettura PC/SC non riuscita su {lettore}: {e}")
+            return
+        if self.bus.pubblica(badge_id, 'pcsc'):
+            latenza_ms = (time.perf_counter() - t0) * 1000
+            with self._lock:
+                self._letture += 1
+                self._ultima_lettura = datetime.now()
+                self._latenza_ultima_ms = latenza_ms
+                self._latenza_max_ms = max(self._latenza_max_ms, latenza_ms)
+                self._latenza_totale_ms += latenza_ms
+
+    def _errore(self, e: Exception):
+        """Servizio PC/SC assente o lettore scollegato: riprova con backoff esponenziale e jitter"""
+        with self._lock:
+            self._errori_consecutivi += 1
+            self._ultimo_errore = f"{datetime.now().strftime('%H:%M:%S')} {e}"
+            esponente = min(self._errori_consecutivi - 1, 16)
+            attesa = min(self.riconnessione_max_s, self.riconnessione_min_s * (2 ** esponente))
+            attesa *= random.uniform(0.8, 1.0)
+            primo = self._errori_consecutivi == 1
+        if primo:
+            print(f"[NFC] Lettore PC/SC non disponibile ({e}): riprovo in background")
+        self._stop.wait(attesa)
+
+
+if __name__ == "__main__":
+    from badge_bus import BusBadge
+
+    print("🧪 Test lettore PC/SC con servizio carte simulato")
+    print("=" * 40)
+    carte = ServizioCarteSimulato(lettori=('ACR122U 0', 'ACR122U 1'))
+    bus = BusBadge()
+    lettore = LettorePCSC(carte, bus=bus)
+    lettore.start()
+    time.sleep(0.1)
+
+    latenze = []
+    for i in range(200):
+        uid = f"04A1B2{i:04X}80"
+        carte.appoggia(uid, 'ACR122U 0' if i % 2 else 'ACR122U 1')
+        evento = bus.get(timeout=2.0)
+        assert evento and evento.badge_id == uid, (evento, uid)
+        latenze.append(evento.eta() * 1000)
+        carte.togli('ACR122U 0' if i % 2 else 'ACR122U 1')
+    stato = lettore.salute()
+    print(f"   ✅ 200 appoggi su 2 lettori, latenza appoggio -> callback "
+          f"media {stato['latenza_media_ms']:.3f} ms, max {stato['latenza_max_ms']:.3f} ms")
+
+    print(f"   formati UID: {formatta_uid(bytes.fromhex('04A1B2C3'), 'hex')} / "
+          f"{formatta_uid(bytes.fromhex('04A1B2C3'), 'decimale_inverso')}")
+
+    cpu0 = time.process_time()
+    time.sleep(1.0)
+    print(f"   ✅ CPU in attesa di carte per 1 s: {(time.process_time() - cpu0) * 1000:.1f} ms")
+
+    lettore.stop()
+    print(f"   ✅ fermato: attivo={lettore.is_running()}, APDU trasmesse {carte.apdu_trasmesse}")
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lettore badge su porta seriale (USB-seriale, RS232) per il bus eventi badge
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+La porta resta aperta per tutta la vita del lettore: letture con timeout breve in un
+parser di trame, pubblicazione sul bus badge appena una trama è completa, riapertura
+automatica con backoff se il lettore viene scollegato.
+
+Trame riconosciute (ParserTrame):
+- STX <dati> ETX        (0x02 ... 0x03), es. lettori 125 kHz tipo RDM6300
+- <dati> CR e/o LF      lettori che emulano una riga di testo
+Checksum 'xor': gli ultimi due caratteri esadecimali sono lo XOR dei byte esadecimali
+precedenti e vengono tolti; trama scartata se non torna. 'auto' lo applica solo alle
+trame STX/ETX nel formato RDM6300 (12 caratteri esadecimali, scartate anche qui se il
+checksum non torna), 'nessuno' mai.
+
+Si prova senza hardware su Linux con uno pseudo-terminale (tests/test_lettore_seriale.py).
+"""
+
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+try:
+    import serial
+    SERIAL_AVAILABLE = True
+except ImportError:
+    serial = None
+    SERIAL_AVAILABLE = False
+
+from badge_bus import get_badge_bus, normalizza_badge
+
+STX = 0x02
+ETX = 0x03
+FINE_RIGA = (0x0D, 0x0A)
+MODI_CHECKSUM = ('auto', 'xor', 'nessuno')
+
+
+def _xor_esadecimale(testo: str) -> Optional[int]:
+    """XOR dei byte espressi in esadecimale (coppie di caratteri); None se non è esadecimale"""
+    if len(testo) % 2:
+        return None
+    try:
+        valori = bytes.fromhex(testo)
+    except ValueError:
+        return None
+    risultato = 0
+    for valore in valori:
+        risultato ^= valore
+    return risultato
+
+
+class ParserTrame:
+    """Ricompone le trame dai byte ricevuti a pezzi; restituisce gli id badge completi"""
+
+    def __init__(self, checksum: str = 'auto', lunghezza_massima: int = 64):
+        if checksum not in MODI_CHECKSUM:
+            raise ValueError(f"checksum '{checksum}' non valido: usare {', '.join(MODI_CHECKSUM)}")
+        self.checksum = checksum
+        self.lunghezza_massima = lunghezza_massima
+        self._buffer = bytearray()
+        self._in_stx = False
+        self.trame = 0
+        self.errori_checksum = 0
+        self.errori_trama = 0
+
+    @property
+    def in_corso(self) -> bool:
+        """True se c'è una trama iniziata e non ancora chiusa"""
+        return self._in_stx or bool(self._buffer)
+
+    def reset(self):
+        self._buffer.clear()
+        self._in_stx = False
+
+    def alimenta(self, dati: bytes) -> List[str]:
+        badge = []
+        for byte in dati:
+            if byte == STX:
+                if self._buffer:
+                    self.errori_trama += 1  # trama precedente mai chiusa
+                self._buffer.clear()
+                self._in_stx = True
+            elif byte == ETX and self._in_stx:
+                self._chiudi(badge, stx=True)
+            elif byte in FINE_RIGA:
+                if self._in_stx:
+                    continue  # alcuni lettori mandano CR/LF anche dentro STX/ETX
+                if self._buffer:
+                    self._chiudi(badge, stx=False)
+            elif len(self._buffer) >= self.lunghezza_massima:
+                self.errori_trama += 1
+                self.reset()
+            else:
+                self._buffer.append(byte)
+        return badge
+
+    def _chiudi(self, badge: List[str], stx: bool):
+        testo = self._buffer.decode('ascii', errors='ignore')
+        self.reset()
+        testo = ''.join(c for c in testo if c.isprintable()).strip()
+        testo = self._verifica_checksum(testo, stx)
+        if testo is None:
+            return
+        badge_id = normalizza_badge(testo)
+        if badge_id is None:
+            self.errori_trama += 1
+            return
+        self.trame += 1
+        badge.append(badge_id)
+
+    def _verifica_checksum(self, testo: str, stx: bool) -> Optional[str]:
+        if self.checksum == 'nessuno':
+            return testo
+        if self.checksum == 'auto' and not (stx and len(testo) == 12 and _xor_esadecimale(testo) is not None):
+            return testo
+        dati, atteso = testo[:-2], testo[-2:]
+        calcolato = _xor_esadecimale(dati)
+        if calcolato is not None and _xor_esadecimale(atteso) == calcolato:
+            return dati
+        return self._checksum_errato(testo)
+
+    def _checksum_errato(self, testo: str) -> None:
+        self.errori_checksum += 1
+        print(f"[NFC] Trama seriale scartata, checksum errato: {testo!r}")
+        return None
+
+
+class LettoreSeriale:
+    """
+    Sorgente badge su porta seriale persistente, da registrare con
+    ServizioLettoreBadge.aggiungi_sorgente (start/stop/salute).
+    """
+
+    def __init__(self, porta: str, baudrate: int = 9600, bus=None, checksum: str = 'auto',
+                 timeout_lettura_s: float = 0.05, riconnessione_min_s: float = 0.5,
+                 riconnessione_max_s: float = 10.0):
+        self.porta = porta
+        self.baudrate = baudrate
+        self.bus = bus if bus is not None else get_badge_bus()
+        self.parser = ParserTrame(checksum)
+        self.timeout_lettura_s = timeout_lettura_s
+        self.riconnessione_min_s = riconnessione_min_s
+        self.riconnessione_max_s = riconnessione_max_s
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._seriale = None
+
+        self._connesso = False
+        self._connesso_il: Optional[datetime] = None
+        self._riconnessioni = 0
+        self._errori_consecutivi = 0
+        self._ultimo_errore: Optional[str] = None
+        self._letture = 0
+        self._ultima_lettura: Optional[datetime] = None
+        self._latenza_ultima_ms: Optional[float] = None
+        self._latenza_max_ms = 0.0
+        self._latenza_totale_ms = 0.0
+
+    # --- Ciclo di vita ---
+    def start(self):
+        if not SERIAL_AVAILABLE:
+            self._ultimo_errore = "pyserial non installato: lettore seriale non disponibile"
+            raise RuntimeError(self._ultimo_errore)
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"badge-seriale-{self.porta}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0):
+        self._stop.set()
+        self._chiudi_porta()  # sblocca una read() in corso
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def salute(self) -> Dict:
+        with self._lock:
+            return {
+                'attiva': self.is_running(),
+                'porta': self.porta,
+                'connesso': self._connesso,
+                'connesso_il': self._connesso_il,
+                'riconnessioni': self._riconnessioni,
+                'errore': None if self._connesso else self._ultimo_errore,
+                'letture': self._letture,
+                'ultima_lettura': self._ultima_lettura,
+                'latenza_ultima_ms': self._latenza_ultima_ms,
+                'latenza_media_ms': self._latenza_totale_ms / self._letture if self._letture else None,
+                'latenza_max_ms': self._latenza_max_ms,
+                'trame': self.parser.trame,
+                'errori_checksum': self.parser.errori_checksum,
+                'errori_trama': self.parser.errori_trama,
+            }
+
+    # --- Porta ---
+    def _apri_porta(self):
+        # serial_for_url accetta anche 'loop://', 'socket://host:port' e percorsi pty
+        porta = serial.serial_for_url(self.porta, baudrate=self.baudrate, timeout=self.timeout_lettura_s,
+                                      do_not_open=True)
+        porta.open()
+        porta.reset_input_buffer()
+        return porta
+
+    def _chiudi_porta(self):
+        with self._lock:
+            porta, self._seriale = self._seriale, None
+            self._connesso = False
+        if porta is not None:
+            try:
+                porta.close()
+            except Exception:
+                pass
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                porta = self._apri_porta()
+            except Exception as e:
+                self._errore(e)
+                continue
+            with self._lock:
+                if self._connesso_il is not None:
+                    self._riconnessioni += 1
+                self._seriale = porta
+                self._connesso = True
+                self._connesso_il = datetime.now()
+                self._errori_consecutivi = 0
+            print(f"[NFC] Lettore seriale connesso su {self.porta} ({self.baudrate} baud)")
+            self.parser.reset()
+            try:
+                self._leggi(porta)
+            except Exception as e:
+                if not self._stop.is_set():
+                    self._chiudi_porta()
+                    self._errore(e)
+        self._chiudi_porta()
+
+    def _leggi(self, porta):
+        t_inizio_trama = None
+        while not self._stop.is_set():
+            # Blocca al massimo timeout_lettura_s; poi legge tutto ciò che è già arrivato
+            dati = porta.read(max(1, porta.in_waiting))
+            if not dati:
+                continue
+            t_arrivo = time.perf_counter()
+            if t_inizio_trama is None:
+                t_inizio_trama = t_arrivo
+            for badge_id in self.parser.alimenta(dati):
+                if self.bus.pubblica(badge_id, 'seriale'):
+                    self._registra_lettura(time.perf_counter() - t_inizio_trama)
+                t_inizio_trama = t_arrivo
+            if not self.parser.in_corso:
+                t_inizio_trama = None
+
+    def _registra_lettura(self, latenza_s: float):
+        latenza_ms = latenza_s * 1000
+        with self._lock:
+            self._letture += 1
+            self._ultima_lettura = datetime.now()
+            self._latenza_ultima_ms = latenza_ms
+            self._latenza_max_ms = max(self._latenza_max_ms, latenza_ms)
+            self._latenza_totale_ms += latenza_ms
+
+    def _errore(self, e: Exception):
+        """Porta assente o scollegata: attende con backoff esponenziale e jitter prima di riaprire"""
+        with self._lock:
+            self._errori_consecutivi += 1
+            self._ultimo_errore = f"{datetime.now().strftime('%H:%M:%S')} {e}"
+            esponente = min(self._errori_consecutivi - 1, 16)
+            attesa = min(self.riconnessione_max_s, self.riconnessione_min_s * (2 ** esponente))
+            attesa *= random.uniform(0.8, 1.0)
+            primo = self._errori_consecutivi == 1
+        if primo:
+            print(f"[NFC] Lettore seriale {self.porta} non disponibile ({e}): riprovo in background")
+        self._stop.wait(attesa)
+
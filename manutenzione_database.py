@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Utility di manutenzione del database di SmartTIM/TIGOTÀ.
+Comandi:
+- ricostruisci-statistiche: ricalcola i contatori statistiche (dopo import o reset).
+- archivia [--giorni N] [--destinazioni a,b]: sposta le timbrature sincronizzate più vecchie di N giorni
+  negli archivi mensili (con --destinazioni conta solo l'export verso quelle destinazioni).
+- importa-json FILE [--pending]: importa un timbrature.json legacy (ripetibile, salta i duplicati).
+"""
+import argparse
+from database_sqlite import get_database_manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenzione database")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("ricostruisci-statistiche", help="Ricalcola daily_stats/badge_stats dalle timbrature")
+    p_arch = sub.add_parser("archivia", help="Archivia le timbrature sincronizzate in file mensili")
+    p_arch.add_argument("--giorni", type=int, default=None, help="Età minima in giorni (default da configurazione)")
+    p_arch.add_argument("--destinazioni", default=None,
+                        help="Destinazioni configurate, separate da virgola (default: tutti i watermark)")
+    p_imp = sub.add_parser("importa-json", help="Importa un timbrature.json legacy")
+    p_imp.add_argument("file", help="Percorso del file JSON")
+    p_imp.add_argument("--pending", action="store_true", help="Marca le timbrature importate da esportare (default: già sincronizzate)")
+    args = parser.parse_args()
+
+    db = get_database_manager()
+    if args.comando == "ricostruisci-statistiche":
+        ok = db.rebuild_stats()
+        if ok:
+            stats = db.get_database_stats()
+            print(f"✅ Statistiche ricostruite: {stats.get('total_timbrature', 0)} timbrature, "
+                  f"{stats.get('unique_badges', 0)} badge unici")
+        else:
+            print("❌ Errore durante la ricostruzione delle statistiche")
+    elif args.comando == "archivia":
+        destinazioni = None
+        if args.destinazioni is not None:
+            destinazioni = [d.strip() for d in args.destinazioni.split(',') if d.strip()]
+        moved = db.archive_synced_timbrature(args.giorni, destinazioni)
+        if moved >= 0:
+            print(f"✅ Archiviate {moved} timbrature in {db.archive_dir}")
+        else:
+            print("❌ Errore durante l'archiviazione")
+    elif args.comando == "importa-json":
+        imported = db.import_legacy_json(args.file, sync_status='pending' if args.pending else 'synced')
+        if imported >= 0:
+            print(f"✅ Importate {imported} timbrature da {args.file}")
+        else:
+            print("❌ Errore durante l'import")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scheduler unico dei job periodici (export, backup, pulizia, integrità, manutenzione)
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Un solo thread daemon tiene i job in un heap ordinato per prossima esecuzione e dorme
+con threading.Event.wait() esattamente fino alla scadenza più vicina: nessun polling.
+Aggiunte, ripianificazioni e stop svegliano il thread tramite lo stesso Event.
+
+Specifiche stile cron a 5 campi "minuto ora giorno mese giorno_settimana" con *, liste,
+intervalli e passi (es. "30 1 * * *", "*/15 8-20 * * 1-6"), più @hourly, @daily,
+@weekly, @monthly. Giorno della settimana 0-6 con 0 = domenica (7 accettato come domenica).
+
+L'ultima esecuzione pianificata e lo storico di ogni job sono salvati in un file JSON:
+al riavvio, i job con recupero=True eseguono una sola volta le esecuzioni perse
+durante lo spegnimento.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+# Esecuzioni conservate per job (memoria e file di stato)
+MAX_STORICO = 50
+
+# Attesa massima di un singolo wait(): oltre threading.TIMEOUT_MAX (~49,7 giorni su Windows)
+# wait() solleva OverflowError (es. '0 0 29 2 *'); il thread si risveglia e ricalcola
+ATTESA_MAX_S = 3600
+
+_ALIAS = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+
+class SpecificaCron:
+    """Specifica cron a 5 campi; prossima(dopo) ritorna la prima scadenza successiva"""
+
+    _LIMITI = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, spec: str):
+        self.spec = spec.strip()
+        campi = _ALIAS.get(self.spec.lower(), self.spec).split()
+        if len(campi) != 5:
+            raise ValueError(f"Specifica cron non valida (servono 5 campi): '{spec}'")
+        valori = [self._espandi(c, lo, hi) for c, (lo, hi) in zip(campi, self._LIMITI)]
+        self.minuti, self.ore, self.giorni, self.mesi, dow = valori
+        self.giorni_settimana = {0 if d == 7 else d for d in dow}
+        # Semantica cron: se giorno e giorno_settimana sono entrambi ristretti basta uno dei due
+        self._giorno_libero = campi[2] == '*'
+        self._dow_libero = campi[4] == '*'
+        self._minuti_ord = sorted(self.minuti)
+        self._ore_ord = sorted(self.ore)
+
+    @staticmethod
+    def _espandi(campo: str, lo: int, hi: int) -> set:
+        valori = set()
+        for parte in campo.split(','):
+            passo = 1
+            if '/' in parte:
+                parte, p = parte.split('/', 1)
+                passo = int(p)
+                if passo <= 0:
+                    raise ValueError(f"Passo cron non valido: '{campo}'")
+            if parte in ('*', ''):
+                a, b = lo, hi
+            elif '-' in parte:
+                a, b = (int(x) for x in parte.split('-', 1))
+            else:
+                a = int(parte)
+                b = hi if passo > 1 else a
+            if a < lo or b > hi or a > b:
+                raise ValueError(f"Valore cron fuori intervallo {lo}-{hi}: '{campo}'")
+            valori.update(range(a, b + 1, passo))
+        return valori
+
+    def _giorno_valido(self, giorno: datetime) -> bool:
+        if giorno.month not in self.mesi:
+            return False
+        nel_mese = giorno.day in self.giorni
+        # isoweekday: lun=1..dom=7 -> cron: dom=0
+        nella_settimana = (giorno.isoweekday() % 7) in self.giorni_settimana
+        if self._giorno_libero and self._dow_libero:
+            return True
+        if self._giorno_libero:
+            return nella_settimana
+        if self._dow_libero:
+            return nel_mese
+        return nel_mese or nella_settimana
+
+    def prossima(self, dopo: datetime) -> datetime:
+        """Prima scadenza strettamente successiva a 'dopo' (al minuto)"""
+        inizio = dopo.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        giorno = inizio.replace(hour=0, minute=0)
+        # 5 anni coprono qualunque combinazione valida (es. 29 febbraio)
+        for _ in range(366 * 5):
+            if self._giorno_valido(giorno):
+                stesso_giorno = giorno.date() == inizio.date()
+                for ora in self._ore_ord:
+                    if stesso_giorno and ora < inizio.hour:
+                        continue
+                    for minuto in self._minuti_ord:
+                        if stesso_giorno and ora == inizio.hour and minuto < inizio.minute:
+                            continue
+                        return giorno.replace(hour=ora, minute=minuto)
+            giorno += timedelta(days=1)
+        raise ValueError(f"Nessuna scadenza possibile per '{self.spec}'")
+
+    def __repr__(self):
+        return f"SpecificaCron({self.spec!r})"
+
+
+def spec_giornaliera(ora: str, default: str = '02:00') -> str:
+    """
+    Converte un orario tollerante ("HH:MM", "HH.MM", "HHMM", "H") in specifica cron giornaliera.
+    Valori non interpretabili usano default; ore e minuti vengono riportati nei limiti.
+    """
+    for testo in (ora, default):
+        s = (testo or '').strip().replace('.', ':').replace(' ', '')
+        try:
+            if ':' in s:
+                hh, mm = s.split(':')[:2]
+                hh, mm = int(hh), int(mm[:2])
+            elif len(s) in (3, 4) and s.isdigit():
+                # Es. 930 -> 09:30, 1430 -> 14:30
+                hh, mm = int(s[:-2]), int(s[-2:])
+            elif len(s) in (1, 2) and s.isdigit():
+                hh, mm = int(s), 0
+            else:
+                continue
+        except ValueError:
+            continue
+        return f"{max(0, min(59, mm))} {max(0, min(23, hh))} * * *"
+    return '0 2 * * *'
+
+
+class Job:
+    """Job pianificato: funzione senza argomenti, specifica cron, storico esecuzioni"""
+
+    def __init__(self, nome: str, spec: str, funzione: Callable, recupero: bool = True):
+        self.nome = nome
+        self.cron = SpecificaCron(spec)
+        self.funzione = funzione
+        self.recupero = recupero
+        self.prossima: Optional[datetime] = None
+        self.ultima_pianificata: Optional[datetime] = None
+        self.storico = deque(maxlen=MAX_STORICO)
+        self.in_esecuzione = False
+
+
+class SchedulerManutenzione:
+    """
+    Scheduler a thread singolo basato su heap + threading.Event.
+    I job vengono eseguiti uno alla volta sul thread dello scheduler: un job lungo
+    (es. backup) ritarda i successivi, che partono appena termina.
+    """
+
+    def __init__(self, stato_path: Optional[str] = None, nome: str = 'SchedulerManutenzione'):
+        self.stato_path = stato_path
+        self.nome = nome
+        self._jobs: Dict[str, Job] = {}
+        self._heap: List = []
+        self._seq = 0
+        self._lock = threading.RLock()
+        self._sveglia = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stato = self._carica_stato()
+
+    # --- Stato persistente ---
+    def _carica_stato(self) -> Dict:
+        if not self.stato_path or not os.path.exists(self.stato_path):
+            return {}
+        try:
+            with open(self.stato_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            print(f"[SCHEDULER] Stato non leggibile ({e}), ripartenza senza storico")
+            return {}
+
+    def _salva_stato(self):
+        if not self.stato_path:
+            return
+        with self._lock:
+            data = {
+                nome: {
+                    'ultima_pianificata': job.ultima_pianificata.isoformat() if job.ultima_pianificata else None,
+                    'storico': list(job.storico),
+                }
+                for nome, job in self._jobs.items()
+            }
+        tmp = self.stato_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.stato_path)), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.stato_path)
+        except Exception as e:
+            print(f"[SCHEDULER] Errore salvataggio stato: {e}")
+
+    # --- Gestione job ---
+    def _accoda(self, job: Job):
+        self._seq += 1
+        heapq.heappush(self._heap, (job.prossima, self._seq, job.nome))
+
+    def aggiungi(self, nome: str, spec: str, funzione: Callable, recupero: bool = True) -> Job:
+        """
+        Registra (o sostituisce) un job. Con recupero=True, se dall'ultima esecuzione
+        pianificata salvata è passata almeno una scadenza, il job parte subito una volta.
+
+        Raises:
+            ValueError: specifica cron non valida
+        """
+        job = Job(nome, spec, funzione, recupero)
+        now = datetime.now()
+        with self._lock:
+            precedente = self._jobs.get(nome)
+            salvato = self._stato.pop(nome, None) or {}
+            if precedente:
+                job.ultima_pianificata = precedente.ultima_pianificata
+                job.storico = precedente.storico
+            else:
+                job.storico.extend(salvato.get('storico', [])[-MAX_STORICO:])
+                if salvato.get('ultima_pianificata'):
+                    try:
+                        job.ultima_pianificata = datetime.fromisoformat(salvato['ultima_pianificata'])
+                    except ValueError:
+                        job.ultima_pianificata = None
+            job.prossima = job.cron.prossima(now)
+            if recupero and job.ultima_pianificata:
+                persa = job.cron.prossima(job.ultima_pianificata)
+                if persa <= now:
+                    # Esecuzioni perse accorpate in un solo recupero immediato
+                    job.prossima = now
+                    print(f"[SCHEDULER] {nome}: recupero esecuzione persa del {persa.strftime('%Y-%m-%d %H:%M')}")
+            self._jobs[nome] = job
+            self._accoda(job)
+        self._sveglia.set()
+        return job
+
+    def ripianifica(self, nome: str, spec: str) -> bool:
+        """Cambia la specifica di un job esistente (senza recupero delle scadenze passate)"""
+        with self._lock:
+            job = self._jobs.get(nome)
+            if not job:
+                return False
+            job.cron = SpecificaCron(spec)
+            job.prossima = job.cron.prossima(datetime.now())
+            self._accoda(job)
+        self._sveglia.set()
+        return True
+
+    def rimuovi(self, nome: str) -> bool:
+        with self._lock:
+            trovato = self._jobs.pop(nome, None) is not None
+        self._sveglia.set()
+        return trovato
+
+    def esegui_ora(self, nome: str) -> bool:
+        """Anticipa l'esecuzione del job al prossimo giro dello scheduler"""
+        with self._lock:
+            job = self._jobs.get(nome)
+            if not job:
+                return False
+            job.prossima = datetime.now()
+            self._accoda(job)
+        self._sveglia.set()
+        return True
+
+    def storico(self, nome: str) -> List[Dict]:
+        """Esecuzioni recenti del job (più vecchie per prime)"""
+        with self._lock:
+            job = self._jobs.get(nome)
+            return list(job.storico) if job else []
+
+    def stato(self) -> List[Dict]:
+        """Riepilogo dei job: prossima esecuzione ed esito dell'ultima"""
+        with self._lock:
+            return [
+                {
+                    'nome': job.nome,
+                    'spec': job.cron.spec,
+                    'prossima': job.prossima,
+                    'in_esecuzione': job.in_esecuzione,
+                    'ultima': job.storico[-1] if job.storico else None,
+                }
+                for job in sorted(self._jobs.values(), key=lambda j: j.prossima or datetime.max)
+            ]
+
+    # --- Thread ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.nome, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Ferma lo scheduler (un job in corso viene atteso fino a timeout)"""
+        self._stop.set()
+        self._sveglia.set()
+        t = self._thread
+        if t and t.is_alive() and t is not threading.current_thread():
+            t.join(timeout=timeout)
+        self._salva_stato()
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _prossimo_dovuto(self) -> Optional[float]:
+        """
+        Scarta le voci obsolete dell'heap; ritorna i secondi di attesa per la prossima
+        scadenza (0 se dovuta, None se non ci sono job).
+        """
+        with self._lock:
+            while self._heap:
+                quando, _, nome = self._heap[0]
+                job = self._jobs.get(nome)
+                if job is None or job.prossima != quando:
+                    heapq.heappop(self._heap)
+                    continue
+                return max(0.0, (quando - datetime.now()).total_seconds())
+            return None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            attesa = self._prossimo_dovuto()
+            if attesa is None or attesa > 0:
+                # Sveglia alla scadenza o a ogni modifica dei job / stop
+                self._sveglia.wait(attesa if attesa is None else min(attesa, ATTESA_MAX_S))
+                self._sveglia.clear()
+                continue
+            with self._lock:
+                quando, _, nome = heapq.heappop(self._heap)
+                job = self._jobs[nome]
+            self._esegui(job, quando)
+
+    def _esegui(self, job: Job, pianificata: datetime):
+        inizio = datetime.now()
+        t0 = time.monotonic()
+        esito, errore = 'ok', None
+        job.in_esecuzione = True
+        print(f"[SCHEDULER] Avvio job {job.nome} ({inizio.strftime('%Y-%m-%d %H:%M:%S')})")
+        try:
+            risultato = job.funzione()
+            if risultato is False:
+                esito = 'fallito'
+        except Exception as e:
+            esito, errore = 'errore', str(e)
+            print(f"[SCHEDULER] Errore job {job.nome}: {e}")
+            print(f"[SCHEDULER] Traceback: {traceback.format_exc()}")
+        finally:
+            job.in_esecuzione = False
+        durata = time.monotonic() - t0
+        with self._lock:
+            job.storico.append({
+                'pianificata': pianificata.isoformat(timespec='seconds'),
+                'inizio': inizio.isoformat(timespec='seconds'),
+                'durata_s': round(durata, 3),
+                'esito': esito,
+                'errore': errore,
+            })
+            job.ultima_pianificata = max(pianificata, job.ultima_pianificata or pianificata)
+            if self._jobs.get(job.nome) is job:
+                # Scadenza successiva calcolata dal termine: niente raffiche dopo job lunghi
+                job.prossima = job.cron.prossima(max(datetime.now(), pianificata))
+                self._accoda(job)
+        print(f"[SCHEDULER] Job {job.nome}: {esito} in {durata:.1f}s, prossimo {job.prossima.strftime('%Y-%m-%d %H:%M')}")
+        self._salva_stato()
+
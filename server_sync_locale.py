@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server HTTP locale che simula l'endpoint cloud della sincronizzazione timbrature
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Serve per provare e fare load-test di sync_cloud.SincronizzatoreCloud senza rete:
+
+    POST /v1/timbrature   corpo JSON (anche gzip), header Idempotency-Key obbligatorio
+                          200 {"batch_id", "accettate", "duplicate"}; stessa chiave -> stessa risposta
+                          413 batch oltre max_righe, 401 token errato, 429/503 errori simulati
+    GET  /v1/stato        contatori del server
+
+Le timbrature sono deduplicate anche per (negozio, id): un batch ripetuto con una chiave
+diversa non crea doppioni.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Set, Tuple
+
+
+class ServerSyncLocale:
+    """Endpoint di sincronizzazione in memoria, con latenza ed errori simulati"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, token: Optional[str] = None,
+                 latenza_s: float = 0.0, ms_per_riga: float = 0.0, tasso_errori: float = 0.0,
+                 max_righe: int = 0, seed: Optional[int] = None):
+        self.token = token
+        self.latenza_s = latenza_s
+        self.ms_per_riga = ms_per_riga
+        self.tasso_errori = tasso_errori
+        self.max_righe = max_righe
+        self._random = random.Random(seed)
+
+        self._lock = threading.Lock()
+        self._risposte: Dict[str, Dict] = {}          # Idempotency-Key -> risposta già data
+        self._timbrature: Set[Tuple[str, int]] = set()  # (negozio, id)
+        self.contatori = {'richieste': 0, 'batch': 0, 'replay': 0, 'accettate': 0, 'duplicate': 0,
+                          'errori_simulati': 0, 'rifiutate_413': 0, 'byte_ricevuti': 0, 'connessioni': 0}
+
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/timbrature"
+
+    def start(self) -> 'ServerSyncLocale':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='server-sync-locale', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stato(self) -> Dict:
+        with self._lock:
+            return dict(self.contatori, timbrature=len(self._timbrature))
+
+    # --- Logica endpoint ---
+    def _ricevi(self, chiave: str, payload: Dict) -> Tuple[int, Dict]:
+        righe = payload.get('timbrature') or []
+        with self._lock:
+            if chiave in self._risposte:
+                self.contatori['replay'] += 1
+                return 200, dict(self._risposte[chiave], replay=True)
+            if self.max_righe and len(righe) > self.max_righe:
+                self.contatori['rifiutate_413'] += 1
+                return 413, {'errore': f"massimo {self.max_righe} timbrature per batch"}
+            negozio = str(payload.get('negozio', ''))
+            accettate = duplicate = 0
+            for riga in righe:
+                chiave_riga = (negozio, int(riga['id']))
+                if chiave_riga in self._timbrature:
+                    duplicate += 1
+                else:
+                    self._timbrature.add(chiave_riga)
+                    accettate += 1
+            risposta = {'batch_id': chiave, 'accettate': accettate, 'duplicate': duplicate}
+            self._risposte[chiave] = risposta
+            self.contatori['batch'] += 1
+            self.contatori['accettate'] += accettate
+            self.contatori['duplicate'] += duplicate
+            return 200, risposta
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.contatori['connessioni'] += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _rispondi(self, codice: int, corpo: Dict, headers: Optional[Dict] = None):
+                dati = json.dumps(corpo).encode('utf-8')
+                self.send_response(codice)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(dati)))
+                for nome, valore in (headers or {}).items():
+                    self.send_header(nome, valore)
+                self.end_headers()
+                try:
+                    self.wfile.write(dati)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client andato in timeout: ripeterà con la stessa Idempotency-Key
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/v1/stato':
+                    self._rispondi(200, server.stato())
+                else:
+                    self._rispondi(404, {'errore': 'not found'})
+
+            def do_POST(self):
+                lunghezza = int(self.headers.get('Content-Length') or 0)
+                corpo = self.rfile.read(lunghezza)
+                with server._lock:
+                    server.contatori['richieste'] += 1
+                    server.contatori['byte_ricevuti'] += lunghezza
+                if self.path.rstrip('/') != '/v1/timbrature':
+                    return self._rispondi(404, {'errore': 'not found'})
+                if server.token and self.headers.get('Authorization') != f"Bearer {server.token}":
+                    return self._rispondi(401, {'errore': 'token non valido'})
+                chiave = self.headers.get('Idempotency-Key')
+                if not chiave:
+                    return self._rispondi(400, {'errore': 'Idempotency-Key mancante'})
+                with server._lock:
+                    errore = server.tasso_errori and server._random.random() < server.tasso_errori
+                    if errore:
+                        server.contatori['errori_simulati'] += 1
+                if errore:
+                    return self._rispondi(503, {'errore': 'servizio non disponibile (simulato)'}, {'Retry-After': '1'})
+                try:
+                    if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+                        corpo = gzip.decompress(corpo)
+                    payload = json.loads(corpo.decode('utf-8'))
+                except (OSError, ValueError) as e:
+                    return self._rispondi(400, {'errore': f"corpo non valido: {e}"})
+                righe = len(payload.get('timbrature') or [])
+                if server.latenza_s or server.ms_per_riga:
+                    time.sleep(server.latenza_s + righe * server.ms_per_riga / 1000.0)
+                codice, risposta = server._ricevi(chiave, payload)
+                self._rispondi(codice, risposta)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server locale di prova per la sincronizzazione cloud")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token", help="Bearer token richiesto ai client")
+    parser.add_argument("--latenza", type=float, default=0.0, help="Latenza fissa per richiesta (s)")
+    parser.add_argument("--ms-per-riga", type=float, default=0.0, help="Costo simulato per timbratura (ms)")
+    parser.add_argument("--errori", type=float, default=0.0, help="Frazione di richieste con 503 simulato")
+    parser.add_argument("--max-righe", type=int, default=0, help="Timbrature massime per batch (413 oltre)")
+    args = parser.parse_args()
+
+    server = ServerSyncLocale(args.host, args.port, args.token, args.latenza, args.ms_per_riga,
+                              args.errori, args.max_righe).start()
+    print(f"🌐 Server sync locale in ascolto su {server.url} (Ctrl+C per uscire)")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"   {server.stato()}")
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
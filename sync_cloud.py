@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sincronizzazione cloud delle timbrature via HTTP (cloud_sync_enabled / sync_interval)
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Le timbrature oltre il watermark della destinazione 'cloud' partono a batch:
+- ogni batch è registrato in transfer_batches prima dell'invio; il suo batch_id è
+  l'Idempotency-Key della POST, quindi un batch ripetuto (timeout, crash prima della
+  conferma) non crea doppioni lato server
+- corpo JSON compresso gzip, su una sessione HTTP persistente (keep-alive)
+- dimensione adattiva: cresce finché la risposta resta sotto obiettivo_s, si dimezza
+  oltre l'obiettivo, su timeout e su 413 (il batch rifiutato viene annullato e rifatto più piccolo)
+- errori di rete, 429 e 5xx: backoff esponenziale con jitter, Retry-After rispettato
+
+Per provarlo senza rete: server_sync_locale.ServerSyncLocale.
+"""
+
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEST_CLOUD = 'cloud'
+
+
+class ErroreSync(Exception):
+    """Invio non riuscito; retry_after (s) se il server lo indica"""
+
+    def __init__(self, messaggio: str, retry_after: Optional[float] = None):
+        super().__init__(messaggio)
+        self.retry_after = retry_after
+
+
+class SincronizzatoreCloud:
+    """Invio a batch delle timbrature a un endpoint HTTP, in un thread con intervallo e backoff"""
+
+    def __init__(self, db, url: str, contesto: Dict, token: Optional[str] = None,
+                 destinazione: str = DEST_CLOUD, intervallo_s: float = 900,
+                 batch_iniziale: int = 500, batch_min: int = 50, batch_max: int = 5000,
+                 obiettivo_s: float = 2.0, timeout_s: float = 30,
+                 retry_min_s: float = 5, retry_max_s: float = 900):
+        self.db = db
+        self.url = url
+        self.contesto = dict(contesto)
+        self.destinazione = destinazione
+        self.intervallo_s = intervallo_s
+        self.batch_min = max(1, batch_min)
+        self.batch_max = max(self.batch_min, batch_max)
+        self.dimensione_batch = min(self.batch_max, max(self.batch_min, batch_iniziale))
+        self.obiettivo_s = obiettivo_s
+        self.timeout_s = timeout_s
+        self.retry_min_s = retry_min_s
+        self.retry_max_s = retry_max_s
+
+        # Sessione persistente: una connessione keep-alive riusata da tutti i batch
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': 'SmartTIM-Sync/1.0',
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            'Accept-Encoding': 'gzip',
+        })
+        if token:
+            self.session.headers['Authorization'] = f"Bearer {token}"
+
+        self._lock_invio = threading.Lock()  # un solo giro di sync alla volta
+        self._lock = threading.Lock()
+        self._sveglia = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._errori_consecutivi = 0
+        self._prossimo_tentativo: Optional[float] = None  # time.monotonic()
+        self._ultimo_successo: Optional[datetime] = None
+        self._ultimo_errore: Optional[str] = None
+        self._inviate = 0
+        self._batch_inviati = 0
+        self._byte_inviati = 0
+
+    # --- Ciclo di vita ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.db.set_transfer_destinations('cloud', [self.destinazione])
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='sync-cloud', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        self._sveglia.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.session.close()
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def sveglia(self):
+        """Sincronizza subito (azzera l'attesa di backoff)"""
+        with self._lock:
+            self._prossimo_tentativo = None
+        self._sveglia.set()
+
+    def stato(self) -> Dict:
+        with self._lock:
+            attesa = None
+            if self._prossimo_tentativo is not None:
+                attesa = max(0.0, self._prossimo_tentativo - time.monotonic())
+            stato = {
+                'url': self.url,
+                'inviate': self._inviate,
+                'batch_inviati': self._batch_inviati,
+                'byte_inviati': self._byte_inviati,
+                'dimensione_batch': self.dimensione_batch,
+                'ultimo_successo': self._ultimo_successo,
+                'ultimo_errore': self._ultimo_errore,
+                'errori_consecutivi': self._errori_consecutivi,
+                'prossimo_tentativo_s': attesa,
+            }
+        stato['in_attesa'] = self.db.count_timbrature_to_transfer(self.destinazione)
+        return stato
+
+    # --- Sincronizzazione ---
+    def sincronizza(self) -> int:
+        """
+        Riprende il batch rimasto aperto, poi invia a batch tutte le timbrature oltre il watermark.
+
+        Returns:
+            int: timbrature accettate dal server in questo giro
+
+        Raises:
+            ErroreSync / requests.RequestException: invio non riuscito (il batch resta aperto)
+        """
+        with self._lock_invio:
+            totale = 0
+            for batch in self.db.get_open_transfer_batches(self.destinazione):
+                totale += self._invia(batch) or 0
+            while not self._stop.is_set():
+                nome = f"{self.destinazione}-{datetime.now():%Y%m%d%H%M%S%f}"
+                batch = self.db.begin_transfer_batch(self.destinazione, nome, limite=self.dimensione_batch)
+                if batch is None:
+                    break
+                inviate = self._invia(batch)
+                if inviate is None:
+                    continue  # batch annullato (413): rifatto più piccolo
+                totale += inviate
+            return totale
+
+    def _payload(self, batch: Dict) -> List[Dict]:
+        return [{'id': r['id'], 'badge_id': r['badge_id'], 'codice': r['codice'], 'nome': r['nome'],
+                 'cognome': r['cognome'], 'tipo': r['tipo'], 'timestamp': str(r['timestamp'])}
+                for r in self.db.iter_timbrature_pending_export(batch['from_id'], batch['to_id'])]
+
+    def _invia(self, batch: Dict) -> Optional[int]:
+        batch_id = batch['batch_id']
+        fase = batch['fase']
+        timbrature = self._payload(batch)
+        try:
+            if timbrature and fase != 'pubblicato':
+                corpo = gzip.compress(json.dumps({
+                    'sede': self.contesto.get('sede'), 'negozio': self.contesto.get('negozio'),
+                    'batch_id': batch_id, 'from_id': batch['from_id'], 'to_id': batch['to_id'],
+                    'timbrature': timbrature,
+                }, separators=(',', ':'), ensure_ascii=False).encode('utf-8'), compresslevel=6)
+                self.db.update_transfer_batch(batch_id, 'preparato', righe=len(timbrature),
+                                              sha256=hashlib.sha256(corpo).hexdigest())
+                t0 = time.perf_counter()
+                try:
+                    risposta = self.session.post(self.url, data=corpo, headers={'Idempotency-Key': batch_id},
+                                                 timeout=self.timeout_s)
+                except requests.Timeout:
+                    self._adatta(None)
+                    raise
+                durata = time.perf_counter() - t0
+                if risposta.status_code == 413 and len(timbrature) > self.batch_min:
+                    # Rifiutato senza essere elaborato: si può annullare e rifare con un range più piccolo;
+                    # da qui la crescita adattiva si ferma alla metà della dimensione rifiutata
+                    self.batch_max = self.dimensione_batch = max(self.batch_min, len(timbrature) // 2)
+                    self.db.update_transfer_batch(batch_id, 'annullato', errore='413: batch troppo grande')
+                    print(f"[SYNC] Batch di {len(timbrature)} timbrature troppo grande: riprovo con {self.dimensione_batch}")
+                    return None
+                if risposta.status_code == 429 or risposta.status_code >= 500:
+                    raise ErroreSync(f"HTTP {risposta.status_code}", self._retry_after(risposta))
+                if risposta.status_code >= 300:
+                    raise ErroreSync(f"HTTP {risposta.status_code}: {risposta.text[:200]}")
+                self._adatta(durata)
+                with self._lock:
+                    self._batch_inviati += 1
+                    self._byte_inviati += len(corpo)
+            self.db.update_transfer_batch(batch_id, 'pubblicato', righe=len(timbrature))
+            fase = 'pubblicato'
+            if not self.db.confirm_transfer_batch(batch_id):
+                raise ErroreSync(f"conferma watermark del batch {batch_id} non riuscita")
+            with self._lock:
+                self._inviate += len(timbrature)
+                self._ultimo_successo = datetime.now()
+            return len(timbrature)
+        except Exception as e:
+            self.db.update_transfer_batch(batch_id, fase, errore=str(e)[:500])
+            raise
+
+    def _adatta(self, durata: Optional[float]):
+        """Dimensione del prossimo batch: +50% se veloce, metà se lento o in timeout"""
+        if durata is not None and durata < self.obiettivo_s / 2:
+            self.dimensione_batch = min(self.batch_max, int(self.dimensione_batch * 1.5) + 1)
+        elif durata is None or durata > self.obiettivo_s:
+            self.dimensione_batch = max(self.batch_min, self.dimensione_batch // 2)
+
+    @staticmethod
+    def _retry_after(risposta) -> Optional[float]:
+        try:
+            return float(risposta.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                prossimo = self._prossimo_tentativo
+            if prossimo is not None and time.monotonic() < prossimo:
+                self._sveglia.wait(prossimo - time.monotonic())
+                self._sveglia.clear()
+                continue
+            try:
+                inviate = self.sincronizza()
+                if inviate:
+                    print(f"[SYNC] Inviate {inviate} timbrature a {self.url}")
+                with self._lock:
+                    self._errori_consecutivi = 0
+                    self._ultimo_errore = None
+                    self._prossimo_tentativo = None
+                self._sveglia.wait(self.intervallo_s)
+                self._sveglia.clear()
+            except Exception as e:
+                with self._lock:
+                    self._errori_consecutivi += 1
+                    self._ultimo_errore = f"{datetime.now().strftime('%H:%M:%S')} {e}"
+                    esponente = min(self._errori_consecutivi - 1, 16)
+                    attesa = min(self.retry_max_s, self.retry_min_s * (2 ** esponente)) * random.uniform(0.8, 1.0)
+                    if getattr(e, 'retry_after', None):
+                        attesa = max(attesa, e.retry_after)
+                    self._prossimo_tentativo = time.monotonic() + attesa
+                print(f"[SYNC] Sincronizzazione fallita ({e}): nuovo tentativo tra {attesa:.0f}s")
+
+
+if __name__ == "__main__":
+    import tempfile
+    from database_sqlite import TigotaSQLiteManager
+    from server_sync_locale import ServerSyncLocale
+
+    print("🌐 Test sincronizzazione cloud contro il server locale")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = TigotaSQLiteManager(db_path=f"{tmp}/sync.db", json_backup_path=f"{tmp}/sync.json")
+        db.get_transfer_watermark(DEST_CLOUD)  # destinazione configurata prima delle timbrature
+        db.save_timbrature_bulk([{'badge_id': f"B{i % 40:03d}", 'tipo': 'entrata' if i % 2 else 'uscita',
+                                  'timestamp': f"2025-01-{1 + i // 400:02d} {6 + i % 12:02d}:{i % 60:02d}:00"}
+                                 for i in range(5000)])
+        server = ServerSyncLocale(max_righe=800, tasso_errori=0.1, seed=1).start()
+        sync = SincronizzatoreCloud(db, server.url, {'sede': '12', 'negozio': '345'},
+                                    batch_iniziale=200, retry_min_s=0.05, retry_max_s=0.2)
+        for _ in range(50):
+            try:
+                sync.sincronizza()
+                break
+            except ErroreSync as e:
+                print(f"   ⚠️ {e}, riprovo")
+        print(f"   ✅ inviate {sync.stato()['inviate']}, server {server.stato()}")
+        print(f"   batch attuale {sync.dimensione_batch}, in attesa {sync.stato()['in_attesa']}")
+        sync.stop()
+        server.stop()
+        db._writer.stop()
+        db._pool.close_all()
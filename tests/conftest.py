@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Configurazione comune dei test SmartTIM.
+
+I moduli stanno nella radice del repository: la radice va aggiunta a sys.path.
+Su sistemi non Windows le directory di produzione (C:/ProgramData/...) diventano
+percorsi relativi: i test girano quindi nella cartella temporanea del test.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db_manager(tmp_path, monkeypatch):
+    """TigotaSQLiteManager su un database temporaneo (file dati accanto al database)"""
+    monkeypatch.chdir(tmp_path)
+    from database_sqlite import TigotaSQLiteManager
+    db = TigotaSQLiteManager(db_path=str(tmp_path / 'timbrature.db'),
+                             json_backup_path=str(tmp_path / 'timbrature.json'))
+    yield db
+    db.close()
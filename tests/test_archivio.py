@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Archiviazione mensile: i contatori statistiche non cambiano spostando le timbrature"""
+
+from datetime import datetime, timedelta
+
+
+def _totali(db):
+    stats = db.get_database_stats()
+    return stats['total_timbrature'], stats['unique_badges'], db.get_unique_badge_count()
+
+
+def test_contatori_invariati_dopo_archiviazione(db_manager):
+    vecchie = datetime.now() - timedelta(days=200)
+    db_manager.save_timbrature_bulk(
+        ({'badge_id': f"BADGE{i % 7:03d}", 'tipo': 'entrata', 'timestamp': vecchie + timedelta(hours=i)}
+         for i in range(100)),
+        sync_status='synced',
+    )
+    for i in range(3):
+        db_manager.save_timbratura(f"OGGI{i:03d}", "entrata")
+    prima = _totali(db_manager)
+    assert prima == (103, 10, 10)
+
+    assert db_manager.archive_synced_timbrature(older_than_days=90) == 100
+    assert db_manager._archive_files()
+    with db_manager._get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM timbrature").fetchone()[0] == 3
+        assert conn.execute("SELECT COUNT(*) FROM stats_sospese").fetchone()[0] == 0
+    assert _totali(db_manager) == prima
+
+    # La ricostruzione conta anche le partizioni di archivio
+    assert db_manager.rebuild_stats()
+    assert _totali(db_manager) == prima
+
+    # Le cancellazioni ordinarie continuano ad aggiornare i contatori
+    with db_manager._get_db_connection() as conn:
+        conn.execute("DELETE FROM timbrature WHERE badge_id = 'OGGI000'")
+        conn.commit()
+    assert _totali(db_manager) == (102, 9, 9)
+
+
+def test_reset_elimina_partizioni_di_archivio(db_manager):
+    vecchie = datetime.now() - timedelta(days=200)
+    db_manager.save_timbrature_bulk(
+        ({'badge_id': 'BADGE001', 'tipo': 'entrata', 'timestamp': vecchie + timedelta(days=i)} for i in range(40)),
+        sync_status='synced',
+    )
+    assert db_manager.archive_synced_timbrature(older_than_days=90) == 40
+    assert db_manager._archive_files()
+
+    assert db_manager.reset_database()
+    assert db_manager._archive_files() == []
+    assert db_manager.get_timbrature_range(vecchie, datetime.now()) == []
+    assert _totali(db_manager) == (0, 0, 0)
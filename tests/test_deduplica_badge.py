@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Deduplicazione per badge: letture ripetute soppresse, timbrature ravvicinate segnalate"""
+
+from deduplica_badge import DeduplicatoreBadge
+
+
+def test_letture_ripetute_soppresse():
+    dedup = DeduplicatoreBadge(finestra_s=2.0, finestra_timbratura_s=60.0)
+    assert dedup.ammetti('A', 0.0)
+    assert not dedup.ammetti('A', 0.5)
+    assert dedup.ammetti('B', 0.6)              # un altro badge passa subito
+    assert not dedup.ammetti('A', 2.4)          # tenuto appoggiato: soppresso finché viene letto
+    assert dedup.ammetti('A', 5.0)
+    stato = dedup.stato()
+    assert stato['ammesse'] == 3
+    assert stato['soppresse'] == 2
+
+
+def test_timbratura_dello_stesso_tipo_e_quasi_duplicato():
+    dedup = DeduplicatoreBadge(finestra_s=2.0, finestra_timbratura_s=60.0)
+    dedup.registra_timbratura('A', 'entrata', adesso=10.0)
+    assert dedup.verifica_timbratura('B', 'entrata', 11.0) is None
+    quasi = dedup.verifica_timbratura('A', 'entrata', 40.0)
+    assert quasi['stesso_tipo']
+    assert quasi['tipo'] == 'entrata'
+    assert quasi['secondi'] == 30.0
+    assert dedup.verifica_timbratura('A', 'uscita', 71.0) is None  # fuori finestra
+    assert dedup.stato()['quasi_duplicati'] == 1
+
+
+def test_entrata_e_uscita_ravvicinate_non_sono_quasi_duplicati():
+    dedup = DeduplicatoreBadge(finestra_s=2.0, finestra_timbratura_s=60.0)
+    dedup.registra_timbratura('A', 'entrata', adesso=10.0)
+    ravvicinata = dedup.verifica_timbratura('A', 'uscita', 20.0)
+    assert ravvicinata is not None and not ravvicinata['stesso_tipo']
+    stato = dedup.stato()
+    assert stato['ravvicinate'] == 1
+    assert stato['quasi_duplicati'] == 0
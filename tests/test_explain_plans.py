@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Piani di esecuzione: nessuna query giorno/range, statistiche o trasferimenti scansiona timbrature"""
+
+from datetime import datetime, timedelta
+
+
+def test_nessuna_scansione_completa_di_timbrature(db_manager):
+    base = datetime.now() - timedelta(days=3)
+    db_manager.save_timbrature_bulk(
+        {'badge_id': f"BADGE{i % 50:03d}", 'tipo': 'entrata' if i % 2 else 'uscita',
+         'timestamp': base + timedelta(minutes=i)}
+        for i in range(2000)
+    )
+    with db_manager._get_db_connection() as conn:
+        conn.execute("ANALYZE")
+
+    plans = db_manager.explain_range_queries()
+
+    assert {'timbrature_range', 'stats_totals', 'daily_stats', 'transfer_watermark',
+            'transfer_count', 'transfer_pending', 'transfer_export'} <= set(plans)
+    for name, info in plans.items():
+        scans = [d for d in info['plan'] if d.startswith('SCAN timbrature') or d.startswith('SCAN t')]
+        assert not scans, f"{name}: {info['plan']}"
+        assert not info['full_scan'], f"{name}: {info['plan']}"
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Ingestione in sede: secolo delle date GGMMAA e righe con data/ora inesistenti"""
+
+from datetime import datetime
+
+from ingestione_sede import analizza_file, anno_completo
+from tracciati_payroll import compila_tracciato
+
+
+def test_anno_completo_dal_secolo_del_file():
+    assert anno_completo(25, 2025) == 2025
+    assert anno_completo(26, 2025) == 2026      # anno successivo al file
+    assert anno_completo(99, 2100) == 2099      # cambio di secolo all'indietro
+    assert anno_completo(0, 2099) == 2100       # ... e in avanti
+
+
+def test_analizza_file_secolo_e_validazione(tmp_path):
+    tracciato = compila_tracciato('ORE', {'sede': '12', 'negozio': '345'})
+    path = str(tmp_path / tracciato.nome_file(datetime(2100, 1, 1, 0, 5)))
+    tracciato.scrivi(path, [
+        {'codice': '123456', 'badge_id': '', 'tipo': 'entrata', 'timestamp': '2099-12-31 23:59:00'},
+        {'codice': '123456', 'badge_id': '', 'tipo': 'uscita', 'timestamp': '2099-12-30 18:00:00'},
+    ])
+    with open(path, encoding='utf-8') as f:
+        righe = f.read().splitlines()
+    righe.append(righe[1].replace('301299', '310299'))   # 31 febbraio
+    righe.append(righe[1].replace('1800', '2460'))       # ora inesistente
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(righe) + '\n')
+
+    risultato = analizza_file(path)
+
+    assert sorted(minuto for _, minuto, _, _ in risultato['righe']) == ['2099-12-30 18:00', '2099-12-31 23:59']
+    assert risultato['validi'] == 2
+    assert risultato['scartate'] == 2
+    assert risultato['secondi'] >= 0
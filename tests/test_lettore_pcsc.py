@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Lettore PC/SC con servizio carte simulato (nessun hardware né pyscard richiesti)"""
+
+import threading
+import time
+
+import pytest
+
+from badge_bus import BusBadge
+from lettore_pcsc import (ATTESA_EVENTI_S, ErrorePCSC, LettorePCSC, ServizioCartePCSC,
+                          ServizioCarteSimulato, formatta_uid)
+
+
+def _attendi(condizione, timeout_s: float = 2.0) -> bool:
+    scadenza = time.monotonic() + timeout_s
+    while not condizione():
+        if time.monotonic() > scadenza:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def avvia():
+    lettori = []
+
+    def _avvia(carte, **kwargs):
+        bus = BusBadge()
+        lettore = LettorePCSC(carte, bus=bus, **kwargs)
+        lettore.start()
+        lettori.append(lettore)
+        assert _attendi(lambda: lettore.salute()['connesso'])
+        return lettore, bus
+
+    yield _avvia
+    for lettore in lettori:
+        lettore.stop()
+
+
+class CarteRispostaErrata(ServizioCarteSimulato):
+    """La carta risponde a GET DATA con una status word diversa da 90 00"""
+
+    def trasmetti(self, lettore, apdu):
+        super().trasmetti(lettore, apdu)
+        return [0x6A, 0x81]
+
+
+def test_appoggio_pubblica_uid_sul_bus(avvia):
+    carte = ServizioCarteSimulato(lettori=('ACR122U 0', 'ACR122U 1'))
+    lettore, bus = avvia(carte)
+
+    carte.appoggia('04A1B2C3D4E5F6', 'ACR122U 1')
+    evento = bus.get(timeout=2.0)
+
+    assert evento is not None
+    assert evento.badge_id == '04A1B2C3D4E5F6'
+    assert evento.sorgente == 'pcsc'
+    assert _attendi(lambda: lettore.salute()['letture'] == 1)
+    carte.togli('ACR122U 1')
+    assert _attendi(lambda: lettore.salute()['carte_presenti'] == 0)
+
+
+def test_status_word_diversa_da_9000_conta_come_errore(avvia):
+    carte = CarteRispostaErrata()
+    lettore, bus = avvia(carte)
+
+    carte.appoggia('04A1B2C3')
+
+    assert _attendi(lambda: lettore.salute()['errori_lettura'] == 1)
+    assert bus.get(timeout=0.1) is None
+    assert lettore.salute()['letture'] == 0
+    with pytest.raises(ErrorePCSC, match='6A81'):
+        lettore.leggi_uid('Lettore simulato 0')
+
+
+def test_carta_tolta_prima_della_apdu(avvia):
+    carte = ServizioCarteSimulato(latenza_apdu_s=0.2)
+    lettore, bus = avvia(carte)
+
+    carte.appoggia('04A1B2C3')
+    carte.togli()  # tolta mentre la GET DATA è ancora in volo
+
+    assert _attendi(lambda: lettore.salute()['errori_lettura'] == 1)
+    assert bus.get(timeout=0.1) is None
+    assert lettore.is_running() and lettore.salute()['connesso']
+
+
+@pytest.mark.parametrize('formato, atteso', [
+    ('hex', '04A1B2C3'),
+    ('hex_inverso', 'C3B2A104'),
+    ('decimale', str(0x04A1B2C3)),
+    ('decimale_inverso', str(0xC3B2A104)),
+])
+def test_formatta_uid(formato, atteso):
+    assert formatta_uid(bytes.fromhex('04A1B2C3'), formato) == atteso
+
+
+def test_formato_uid_non_valido():
+    with pytest.raises(ValueError):
+        formatta_uid(b'\x04', 'base64')
+    with pytest.raises(ValueError):
+        LettorePCSC(ServizioCarteSimulato(), bus=BusBadge(), formato_uid='base64')
+
+
+def test_stop_sblocca_attendi_eventi(avvia):
+    carte = ServizioCarteSimulato()
+    lettore, _ = avvia(carte)
+
+    t0 = time.monotonic()
+    lettore.stop(timeout=2.0)
+
+    assert not lettore.is_running()
+    assert time.monotonic() - t0 < min(1.0, ATTESA_EVENTI_S)
+
+
+def test_annulla_sblocca_attesa_del_servizio():
+    carte = ServizioCarteSimulato()
+    esito = []
+    attesa = threading.Thread(target=lambda: esito.append(carte.attendi_eventi(ATTESA_EVENTI_S)))
+    attesa.start()
+    time.sleep(0.05)
+    carte.annulla()
+    attesa.join(1.0)
+    assert not attesa.is_alive() and esito == [[]]
+
+
+def test_annulla_sblocca_servizio_pcsc_senza_lettori():
+    # Nessun lettore e niente PnP: l'attesa non passa da SCardGetStatusChange (pyscard non serve)
+    servizio = ServizioCartePCSC(attesa_max_s=30)
+    servizio._pnp = False
+    esito = []
+    attesa = threading.Thread(target=lambda: esito.append(servizio.attendi_eventi()))
+    attesa.start()
+    time.sleep(0.05)
+    servizio.annulla()
+    attesa.join(1.0)
+    assert not attesa.is_alive() and esito == [[]]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Lettore seriale: parser di trame e checksum; porta persistente su pseudo-terminale (solo Linux)"""
+
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+from badge_bus import BusBadge
+from lettore_seriale import SERIAL_AVAILABLE, LettoreSeriale, ParserTrame
+
+
+def test_trama_stx_etx_spezzata():
+    parser = ParserTrame('auto')
+    # RDM6300: STX + 10 hex dati + 2 hex checksum + ETX, in più letture
+    assert parser.alimenta(b'\x020F00') == []
+    assert parser.alimenta(b'1A2B3C02\x03') == ['0F001A2B3C']
+    assert parser.trame == 1
+
+
+def test_riga_cr_lf():
+    parser = ParserTrame('auto')
+    assert parser.alimenta(b'12345678\r\n') == ['12345678']
+    assert parser.alimenta(b'\x02BADGE0001\x03') == ['BADGE0001']  # STX/ETX non RDM6300: nessun checksum
+
+
+def test_checksum_xor_errato_scartato():
+    parser = ParserTrame('xor')
+    assert parser.alimenta(b'\x020F001A2B3CFF\x03') == []
+    assert parser.errori_checksum == 1
+
+
+def test_checksum_auto_errato_scartato():
+    parser = ParserTrame('auto')
+    assert parser.alimenta(b'\x020F001A2B3CFF\x03') == []
+    assert parser.errori_checksum == 1
+    # La stessa trama a 12 caratteri su riga di testo non è RDM6300: passa così com'è
+    assert parser.alimenta(b'0F001A2B3CFF\r\n') == ['0F001A2B3CFF']
+
+
+def test_checksum_nessuno():
+    assert ParserTrame('nessuno').alimenta(b'\x020F001A2B3CFF\x03') == ['0F001A2B3CFF']
+
+
+def test_modo_checksum_non_valido():
+    with pytest.raises(ValueError):
+        ParserTrame('crc')
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="pseudo-terminale solo su Linux")
+@pytest.mark.skipif(not SERIAL_AVAILABLE, reason="pyserial non installato")
+def test_porta_persistente_su_pty_con_ricollegamento():
+    import pty
+
+    with tempfile.TemporaryDirectory() as tmp:
+        collegamento = os.path.join(tmp, 'ttyBADGE')
+
+        def collega():
+            master, slave = pty.openpty()
+            if os.path.lexists(collegamento):
+                os.remove(collegamento)
+            os.symlink(os.ttyname(slave), collegamento)
+            return master, slave
+
+        master, slave = collega()
+        bus = BusBadge()
+        lettore = LettoreSeriale(collegamento, bus=bus, riconnessione_min_s=0.05, riconnessione_max_s=0.2)
+        lettore.start()
+        try:
+            scadenza = time.monotonic() + 5
+            while not lettore.salute()['connesso'] and time.monotonic() < scadenza:
+                time.sleep(0.02)
+            for i in range(20):
+                os.write(master, f"\x02BADGE{i:04d}\x03".encode('ascii'))
+                evento = bus.get(timeout=2.0)
+                assert evento is not None and evento.badge_id == f"BADGE{i:04d}"
+            stato = lettore.salute()
+            assert stato['letture'] == 20 and stato['latenza_max_ms'] >= 0
+
+            # Scollegamento: il pty sparisce, poi ne compare uno nuovo allo stesso percorso
+            os.close(master)
+            os.close(slave)
+            scadenza = time.monotonic() + 5
+            while lettore.salute()['connesso'] and time.monotonic() < scadenza:
+                time.sleep(0.02)
+            master, slave = collega()
+            while not lettore.salute()['connesso'] and time.monotonic() < scadenza:
+                time.sleep(0.02)
+            os.write(master, b'RICOLLEGATO\r\n')
+            evento = bus.get(timeout=2.0)
+            assert evento is not None and evento.badge_id == 'RICOLLEGATO'
+            assert lettore.salute()['riconnessioni'] >= 1
+        finally:
+            lettore.stop()
+            os.close(master)
+            os.close(slave)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Scheduler manutenzione: specifiche cron, esecuzione immediata, recupero delle esecuzioni perse"""
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import scheduler_manutenzione
+from scheduler_manutenzione import SchedulerManutenzione, SpecificaCron, spec_giornaliera
+
+BASE = datetime(2025, 3, 7, 10, 17, 30)
+
+
+@pytest.mark.parametrize('spec, attesa', [
+    ('30 1 * * *', datetime(2025, 3, 8, 1, 30)),
+    ('*/15 * * * *', datetime(2025, 3, 7, 10, 30)),
+    ('0 3 * * 0', datetime(2025, 3, 9, 3, 0)),
+    ('0 4 1 * *', datetime(2025, 4, 1, 4, 0)),
+    ('0 0 29 2 *', datetime(2028, 2, 29, 0, 0)),
+    ('@hourly', datetime(2025, 3, 7, 11, 0)),
+    (spec_giornaliera('9.05'), datetime(2025, 3, 8, 9, 5)),
+])
+def test_prossima_scadenza(spec, attesa):
+    assert SpecificaCron(spec).prossima(BASE) == attesa
+
+
+def _attendi(condizione, timeout=2.0):
+    limite = time.monotonic() + timeout
+    while not condizione() and time.monotonic() < limite:
+        time.sleep(0.01)
+    return condizione()
+
+
+def test_esecuzione_immediata_e_storico():
+    eseguiti = []
+    scheduler = SchedulerManutenzione()
+    scheduler.start()
+    try:
+        scheduler.aggiungi('test', '* * * * *', lambda: eseguiti.append(time.monotonic()))
+        scheduler.esegui_ora('test')
+        assert _attendi(lambda: scheduler.storico('test'))
+    finally:
+        scheduler.stop()
+    assert len(eseguiti) == 1
+    assert scheduler.storico('test')[-1]['esito'] == 'ok'
+
+
+def _stato_salvato(path, ultima: datetime):
+    path.write_text(json.dumps({'test': {'ultima_pianificata': ultima.isoformat(), 'storico': []}}),
+                    encoding='utf-8')
+
+
+def test_recupero_esecuzioni_perse(tmp_path):
+    stato = tmp_path / 'scheduler_stato.json'
+    _stato_salvato(stato, datetime.now() - timedelta(days=3))  # tre scadenze giornaliere perse
+    eseguiti = []
+    scheduler = SchedulerManutenzione(stato_path=str(stato))
+    job = scheduler.aggiungi('test', '30 1 * * *', lambda: eseguiti.append(1))
+    assert job.prossima <= datetime.now()
+    scheduler.start()
+    try:
+        assert _attendi(lambda: scheduler.storico('test'))
+        time.sleep(0.1)
+    finally:
+        scheduler.stop()
+    # Le esecuzioni perse sono accorpate in un solo recupero, poi si torna alla specifica
+    assert eseguiti == [1]
+    assert job.prossima > datetime.now()
+    salvato = json.loads(stato.read_text(encoding='utf-8'))['test']
+    assert salvato['storico'][-1]['esito'] == 'ok'
+
+
+def test_nessun_recupero_se_disattivato_o_non_perso(tmp_path):
+    stato = tmp_path / 'scheduler_stato.json'
+    _stato_salvato(stato, datetime.now() - timedelta(days=3))
+    scheduler = SchedulerManutenzione(stato_path=str(stato))
+    assert scheduler.aggiungi('test', '30 1 * * *', lambda: None, recupero=False).prossima > datetime.now()
+
+    _stato_salvato(stato, datetime.now())
+    scheduler = SchedulerManutenzione(stato_path=str(stato))
+    assert scheduler.aggiungi('test', '0 0 1 1 *', lambda: None).prossima > datetime.now()
+
+
+class _SvegliaRegistrata(threading.Event):
+    """Event che annota i timeout passati a wait()"""
+
+    def __init__(self):
+        super().__init__()
+        self.attese = []
+
+    def wait(self, timeout=None):
+        self.attese.append(timeout)
+        return super().wait(timeout)
+
+
+def test_attesa_limitata_per_scadenze_lontane():
+    # '0 0 29 2 *' può distare anni: un solo wait() supererebbe TIMEOUT_MAX su Windows
+    scheduler = SchedulerManutenzione()
+    scheduler._sveglia = _SvegliaRegistrata()
+    scheduler.aggiungi('bisestile', '0 0 29 2 *', lambda: None)
+    scheduler.start()
+    try:
+        assert _attendi(lambda: scheduler._sveglia.attese)
+    finally:
+        scheduler.stop()
+    attese = [a for a in scheduler._sveglia.attese if a is not None]
+    assert attese and max(attese) <= scheduler_manutenzione.ATTESA_MAX_S
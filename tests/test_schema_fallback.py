@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Schema di riserva di database_sqlite (config_tablet non importabile): deve coincidere con quello ufficiale"""
+
+import importlib.util
+import sys
+
+import config_tablet
+import database_sqlite
+
+
+def _carica_senza_config(monkeypatch):
+    """Copia separata di database_sqlite caricata con config_tablet non importabile"""
+    monkeypatch.setitem(sys.modules, 'config_tablet', None)  # import -> ImportError
+    spec = importlib.util.spec_from_file_location('database_sqlite_fallback', database_sqlite.__file__)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def test_schema_di_riserva_uguale_a_config_tablet(monkeypatch):
+    modulo = _carica_senza_config(monkeypatch)
+    riserva = modulo.DATABASE_SCHEMA.replace('\n    ', '\n').strip()
+    assert riserva == config_tablet.DATABASE_SCHEMA.strip()
+
+
+def test_statistiche_con_schema_di_riserva(tmp_path, monkeypatch):
+    modulo = _carica_senza_config(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    db = modulo.TigotaSQLiteManager(db_path=str(tmp_path / 'timbrature.db'),
+                                    json_backup_path=str(tmp_path / 'timbrature.json'))
+    try:
+        assert db.save_timbratura('BADGE001', 'entrata', 'Mario', 'Rossi')
+        assert db.save_timbratura('BADGE002', 'entrata', 'Anna', 'Bianchi')
+        stats = db.get_database_stats()
+        assert stats['total_timbrature'] == 2
+        assert stats['unique_badges'] == 2
+    finally:
+        db.close()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Sincronizzazione cloud contro server_sync_locale su porta effimera"""
+
+import pytest
+
+pytest.importorskip('requests')
+
+from server_sync_locale import ServerSyncLocale  # noqa: E402
+from sync_cloud import DEST_CLOUD, ErroreSync, SincronizzatoreCloud  # noqa: E402
+
+RIGHE = 300
+
+
+@pytest.fixture
+def server():
+    server = ServerSyncLocale(port=0, seed=1).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def sync(db_manager, server):
+    db_manager.get_transfer_watermark(DEST_CLOUD)  # destinazione configurata prima delle timbrature
+    db_manager.save_timbrature_bulk(
+        {'badge_id': f"B{i % 20:03d}", 'tipo': 'entrata' if i % 2 else 'uscita',
+         'timestamp': f"2025-01-{1 + i // 100:02d} {6 + i % 12:02d}:{i % 60:02d}:00"}
+        for i in range(RIGHE)
+    )
+    sync = SincronizzatoreCloud(db_manager, server.url, {'sede': '12', 'negozio': '345'},
+                                batch_iniziale=100, batch_max=100, retry_min_s=0.01, retry_max_s=0.05)
+    yield sync
+    sync.stop()
+
+
+def test_invio_completo(sync, server):
+    assert sync.sincronizza() == RIGHE
+    stato = server.stato()
+    assert stato['timbrature'] == RIGHE
+    assert stato['batch'] == RIGHE // 100
+    assert stato['duplicate'] == 0
+    assert sync.stato()['in_attesa'] == 0
+    assert sync.sincronizza() == 0
+
+
+def test_errore_5xx_lascia_il_batch_aperto_e_si_riprende(sync, server, db_manager):
+    server.tasso_errori = 1.0
+    with pytest.raises(ErroreSync) as errore:
+        sync.sincronizza()
+    assert errore.value.retry_after == 1.0
+    aperti = db_manager.get_open_transfer_batches(DEST_CLOUD)
+    assert len(aperti) == 1 and aperti[0]['errore'] == 'HTTP 503'
+
+    server.tasso_errori = 0.0
+    assert sync.sincronizza() == RIGHE
+    assert db_manager.get_open_transfer_batches(DEST_CLOUD) == []
+    assert server.stato()['timbrature'] == RIGHE
+    assert server.stato()['duplicate'] == 0
+
+
+def test_batch_ripetuto_con_la_stessa_chiave_e_idempotente(sync, server, db_manager, monkeypatch):
+    # Risposta del server ricevuta ma persa prima di registrare la pubblicazione (crash simulato)
+    originale = db_manager.update_transfer_batch
+    persa = {'fatto': False}
+
+    def update_con_crash(batch_id, fase, *args, **kwargs):
+        if fase == 'pubblicato' and not persa['fatto']:
+            persa['fatto'] = True
+            raise RuntimeError("crash dopo la POST")
+        return originale(batch_id, fase, *args, **kwargs)
+
+    monkeypatch.setattr(db_manager, 'update_transfer_batch', update_con_crash)
+    with pytest.raises(RuntimeError):
+        sync.sincronizza()
+    assert server.stato()['batch'] == 1
+
+    assert sync.sincronizza() == RIGHE
+    stato = server.stato()
+    assert stato['replay'] == 1          # stesso batch_id come Idempotency-Key: risposta già data
+    assert stato['timbrature'] == RIGHE
+    assert stato['duplicate'] == 0
+    assert stato['accettate'] == RIGHE
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Export journaled (ripresa dopo un crash in ogni fase) e consegna del corriere su una cartella bloccata"""
+
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from database_sqlite import DEFAULT_TRANSFER_DEST
+from trasferimenti import CorriereTrasferimenti, EsportatoreTrasferimenti, TimeoutCartella
+
+CONTESTO = {'sede': '12', 'negozio': '345'}
+
+
+def _popola(db, n=25):
+    inizio = datetime.now() - timedelta(days=1)
+    db.save_timbrature_bulk(
+        ({'badge_id': f"BADGE{i % 5:03d}", 'tipo': 'entrata' if i % 2 == 0 else 'uscita',
+          'timestamp': inizio + timedelta(minutes=10 * i)} for i in range(n)),
+        sync_status='pending',
+    )
+
+
+def _conta_avanzamenti_watermark(db):
+    """Registra ogni avanzamento del watermark (anche da connessioni diverse del pool)"""
+    with db._get_db_connection() as conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS test_avanzamenti (last_id INTEGER);
+            CREATE TRIGGER IF NOT EXISTS trg_test_avanzamenti AFTER UPDATE OF last_id ON transfer_watermark
+            WHEN NEW.last_id != OLD.last_id
+            BEGIN
+                INSERT INTO test_avanzamenti (last_id) VALUES (NEW.last_id);
+            END;
+        """)
+
+    def avanzamenti():
+        with db._get_db_connection() as conn:
+            return [r[0] for r in conn.execute("SELECT last_id FROM test_avanzamenti")]
+    return avanzamenti
+
+
+def _batch_interrotto(db, cartella, fase):
+    """Simula un crash: batch aperto lasciato nella fase indicata, con i file che quella fase lascia su disco"""
+    esportatore = EsportatoreTrasferimenti(db, cartella, CONTESTO)
+    os.makedirs(cartella, exist_ok=True)
+    batch = db.begin_transfer_batch(DEFAULT_TRANSFER_DEST, esportatore._nome_file_libero())
+    path = os.path.join(cartella, batch['file_name'])
+    if fase in ('scritto', 'rinominato'):
+        righe, sha256 = esportatore.tracciato.scrivi_parziale(
+            path + '.part', db.iter_timbrature_pending_export(batch['from_id'], batch['to_id']))
+        db.update_transfer_batch(batch['batch_id'], 'scritto', righe=righe, sha256=sha256)
+        if fase == 'rinominato':
+            # Crash tra il rename e la registrazione di 'pubblicato'
+            os.replace(path + '.part', path)
+    return batch
+
+
+@pytest.mark.parametrize('fase', ['preparato', 'scritto', 'rinominato'])
+def test_ripresa_batch_interrotto(db_manager, tmp_path, fase):
+    _popola(db_manager)
+    partenza = db_manager.get_transfer_watermark(DEFAULT_TRANSFER_DEST)
+    avanzamenti = _conta_avanzamenti_watermark(db_manager)
+    cartella = str(tmp_path / 'outbox')
+    batch = _batch_interrotto(db_manager, cartella, fase)
+
+    # Riavvio: nuovo esportatore, ripresa del batch aperto
+    esportatore = EsportatoreTrasferimenti(db_manager, cartella, CONTESTO)
+    assert esportatore.riprendi() == 25
+    assert esportatore.esporta() == 0  # niente di nuovo: nessun secondo file
+
+    assert os.listdir(cartella) == [batch['file_name']]
+    with open(os.path.join(cartella, batch['file_name']), encoding='utf-8') as f:
+        assert len(f.readlines()) == 25
+    assert db_manager.get_transfer_watermark(DEFAULT_TRANSFER_DEST) == batch['to_id']
+    assert avanzamenti() == [batch['to_id']]
+    assert partenza == batch['from_id']
+    assert db_manager.get_transfer_file_phase(DEFAULT_TRANSFER_DEST, batch['file_name']) == 'confermato'
+    assert db_manager.get_open_transfer_batches(DEFAULT_TRANSFER_DEST) == []
+
+
+def test_corriere_cartella_bloccata(tmp_path):
+    outbox, cartella = tmp_path / 'outbox', tmp_path / 'share'
+    outbox.mkdir()
+    (outbox / 'ORE_TEST.TXT').write_text('riga\n', encoding='utf-8')
+    corriere = CorriereTrasferimenti(str(outbox), str(cartella), timeout_s=0.2)
+
+    sblocca = threading.Event()
+    consegna_vera = corriere._consegna_file
+
+    def consegna_appesa(nome, destinazione):
+        sblocca.wait(10)  # share che non risponde
+        consegna_vera(nome, destinazione)
+    corriere._consegna_file = consegna_appesa
+
+    with pytest.raises(TimeoutCartella):
+        corriere.consegna()
+    assert corriere.stato()['bloccata']
+    # Finché l'operazione bloccata non ritorna non se ne avvia un'altra e il file resta in coda
+    with pytest.raises(TimeoutCartella):
+        corriere.consegna()
+    assert corriere.in_coda() == ['ORE_TEST.TXT']
+    assert not (cartella / 'ORE_TEST.TXT').exists()
+
+    sblocca.set()
+    corriere._bloccata.join(5)
+    stato = corriere.stato()
+    assert not stato['bloccata']
+    assert stato['consegnati'] == 1
+    assert corriere.in_coda() == []
+    assert (cartella / 'ORE_TEST.TXT').read_text(encoding='utf-8') == 'riga\n'
+    assert corriere.consegna() == 0
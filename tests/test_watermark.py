@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Watermark dei trasferimenti: punto iniziale delle destinazioni nuove e vincolo sull'archivio"""
+
+from datetime import datetime, timedelta
+
+import database_sqlite
+
+
+def _popola(db, n=20, giorni_fa=200):
+    inizio = datetime.now() - timedelta(days=giorni_fa)
+    db.save_timbrature_bulk(
+        ({'badge_id': f"BADGE{i % 5:03d}", 'tipo': 'entrata', 'timestamp': inizio + timedelta(hours=i)}
+         for i in range(n)),
+        sync_status='pending',
+    )
+
+
+def test_destinazione_nuova_parte_dall_ultimo_id(db_manager, monkeypatch):
+    monkeypatch.setitem(database_sqlite.DATA_CONFIG, 'transfer_watermark_iniziale',
+                        {'ore_txt': 'pending', 'storico': 0, 'errata': 'ieri'})
+    _popola(db_manager)
+    massimo = db_manager.get_max_timbratura_id()
+
+    assert db_manager.get_transfer_watermark('hr') == massimo
+    assert db_manager.count_timbrature_to_transfer('hr') == 0
+    assert db_manager.get_transfer_watermark('ore_txt') == 0          # migrazione: dalle pending
+    assert db_manager.get_transfer_watermark('storico') == 0          # id esplicito
+    assert db_manager.get_transfer_watermark('errata') == massimo     # valore non valido: 'ultimo'
+
+
+def test_archivio_ignora_destinazioni_non_configurate(db_manager):
+    _popola(db_manager)
+    massimo = db_manager.get_max_timbratura_id()
+    db_manager.get_transfer_watermark('ore_txt')
+    db_manager.commit_transfer_watermark('ore_txt', massimo)
+    with db_manager._get_db_connection() as conn:
+        conn.execute("INSERT INTO transfer_watermark (destinazione, last_id) VALUES ('vecchia', 0)")
+        conn.commit()
+
+    # Senza destinazioni dichiarate vale il watermark minimo: 'vecchia' blocca l'archivio
+    assert db_manager.archive_synced_timbrature(older_than_days=90) == 0
+
+    db_manager.set_transfer_destinations('trasferimenti', ['ore_txt'])
+    assert db_manager.archive_synced_timbrature(older_than_days=90) == 20
+
+
+def test_reset_svuota_watermark_e_batch_aperti(db_manager):
+    _popola(db_manager)
+    db_manager.get_transfer_watermark('ore_txt')
+    assert db_manager.begin_transfer_batch('ore_txt', 'ORE345TEST.TXT')
+    assert db_manager.get_open_transfer_batches('ore_txt')
+
+    assert db_manager.reset_database()
+    assert db_manager.get_open_transfer_batches() == []
+    with db_manager._get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM transfer_watermark").fetchone()[0] == 0
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Writer write-behind: un gruppo fallito resta nello spool e viene riaccodato a tempo"""
+
+import time
+
+
+def test_gruppo_fallito_riaccodato(db_manager, monkeypatch):
+    writer = db_manager._writer
+    writer.retry_s = 0.2
+    monkeypatch.setattr(time, 'sleep', lambda s: None)  # nessuna attesa tra i 3 tentativi
+    insert = db_manager._insert_timbrature
+    guasto = {'attivo': True}
+
+    def insert_guasto(records):
+        if guasto['attivo']:
+            raise RuntimeError("disco pieno")
+        return insert(records)
+
+    monkeypatch.setattr(db_manager, '_insert_timbrature', insert_guasto)
+    esiti = []
+    db_manager.save_timbratura_async("BADGE001", "entrata", callback=lambda ok, r: esiti.append(ok))
+
+    scadenza = time.monotonic() + 5
+    while not esiti and time.monotonic() < scadenza:
+        time.sleep(0.01)
+    assert esiti == [False]
+    assert writer.pending_count() == 1
+    with open(writer.spool_path, encoding='utf-8') as f:
+        assert 'BADGE001' in f.read()
+
+    guasto['attivo'] = False
+    while writer.pending_count() and time.monotonic() < scadenza:
+        time.sleep(0.01)
+    assert writer.pending_count() == 0
+    assert db_manager.get_last_timbratura_badge("BADGE001")['tipo'] == 'entrata'
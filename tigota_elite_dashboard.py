@@ -18,7 +18,8 @@ import subprocess  # Per attivazione tastiera virtuale
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     pass
-from nfc_manager import NFCReader  # Lettore NFC
+from nfc_manager import NFCReader, get_servizio_lettore  # Lettore NFC
+from deduplica_badge import get_deduplicatore
 try:
     import importlib
     pygame = importlib.import_module('pygame')  # type: ignore
@@ -58,9 +59,12 @@ class TigotaEliteDashboard:
         self._hid_entry = None
         self._badge_buffer = ''
         self._capture_active = False
-        # Scheduler trasferimento TXT
-        self._transfer_thread = None
-        self._transfer_stop = threading.Event()
+        # Scheduler unico: trasferimento TXT + job di manutenzione database
+        self._scheduler = None
+        # Destinazioni di trasferimento: export in parallelo, consegna in background dall'outbox locale
+        self._trasferimenti = None
+        # Sincronizzazione cloud HTTP (DATA_CONFIG cloud_sync_enabled)
+        self._sync_cloud = None
         # Feedback toast duration (ms), overridable via config [UI] feedback_toast_ms
         self.feedback_toast_ms = 2000
 
@@ -655,6 +659,12 @@ class TigotaEliteDashboard:
         # Barra NFC ancorata in basso (nuova row 4)
         self.create_nfc_indicator(outer)
 
+        # Servizio lettore badge unico: avviato qui, poi solo armato/disarmato dalle azioni
+        try:
+            self._start_badge_service()
+        except Exception as e:
+            print(f"[NFC] Avvio servizio lettore fallito: {e}")
+
         # Setup cattura tastiera per lettori USB in modalit? tastiera
         try:
             self._setup_keyboard_capture()
@@ -1392,8 +1402,7 @@ class TigotaEliteDashboard:
                         except Exception as e:
                             print(f"[DEBUG] Errore aggiornamento badge nel wizard: {e}")
                     
-                    # Avvia lettore con callback del wizard
-                    from nfc_manager import NFCReader
+                    # Arma il servizio lettore con la callback del wizard
                     self.nfc_reader = NFCReader(callback=on_wizard_badge_read)
                     self.nfc_reader.start_reading()
                     print("[DEBUG] Lettore NFC avviato per wizard")
@@ -3099,12 +3108,8 @@ class TigotaEliteDashboard:
                 if not dir_tx:
                     _show_message('warning', 'Cartella mancante', 'Seleziona la cartella di trasferimento.')
                     return
-                # Crea la cartella se non esiste
-                try:
-                    os.makedirs(dir_tx, exist_ok=True)
-                except Exception as e:
-                    _show_message('error', 'Errore cartella', f'Impossibile creare/accedere alla cartella:\n{dir_tx}\n{e}')
-                    return
+                # La cartella (anche di rete) viene creata/raggiunta dal corriere in background:
+                # una share lenta non blocca il salvataggio, l'esito compare nello stato consegna
 
                 if _save_codes(cod_sede, cod_negozio, ora_tx, dir_tx):
                     # Mostra conferma sopra alla finestra Impostazioni
@@ -3123,6 +3128,11 @@ class TigotaEliteDashboard:
                         self._restart_transfer_scheduler()
                     except Exception as e:
                         print(f"[TRANSFER] Riavvio scheduler fallito: {e}")
+                    if self._trasferimenti:
+                        try:
+                            self._transfer_manager()
+                        except Exception as e:
+                            print(f"[TRANSFER] Aggiornamento destinazioni fallito: {e}")
                 else:
                     _show_message('error', 'Errore', 'Impossibile salvare le impostazioni.')
 
@@ -3130,36 +3140,73 @@ class TigotaEliteDashboard:
             save_btn = tk.Button(btns, text='Salva', font=btn_font, command=on_save)
             save_btn.pack(side='left', ipadx=self.s(24), ipady=self.s(12))
 
-            # Pulsante Esporta ora (esegue export immediato delle timbrature pending)
+            # Pulsante Esporta ora: export nell'outbox in un thread, consegna affidata al corriere
             def on_export_now():
                 try:
                     _close_touch_keyboard()
                 except Exception:
                     pass
-                # Conta pending prima di esportare per feedback
                 try:
-                    from database_sqlite import get_database_manager
-                    db = get_database_manager()
-                    pending = db.get_timbrature_pending()
-                    count = len(pending)
+                    export_btn.configure(state='disabled')
                 except Exception:
-                    count = None
-                ok = False
-                try:
-                    ok = self.export_pending_timbrature_to_txt()
-                except Exception:
-                    ok = False
-                if ok:
-                    if count is not None:
-                        _show_message('info', 'Export completato', f'Esportate {count} timbrature pending in TXT.')
+                    pass
+                esito = {}
+
+                def _worker():
+                    # Conta pending prima di esportare per feedback
+                    try:
+                        from database_sqlite import get_database_manager
+                        esito['count'] = get_database_manager().count_timbrature_to_transfer()
+                    except Exception:
+                        esito['count'] = None
+                    try:
+                        esito['ok'] = self.export_pending_timbrature_to_txt()
+                    except Exception:
+                        esito['ok'] = False
+
+                worker = threading.Thread(target=_worker, name='export-ora', daemon=True)
+                worker.start()
+
+                def _attendi():
+                    if worker.is_alive():
+                        win.after(200, _attendi)
+                        return
+                    try:
+                        export_btn.configure(state='normal')
+                    except Exception:
+                        pass
+                    count = esito.get('count')
+                    if esito.get('ok'):
+                        if count is not None:
+                            _show_message('info', 'Export completato', f'Esportate {count} timbrature pending in TXT.\n'
+                                                                       'La consegna alla cartella prosegue in background.')
+                        else:
+                            _show_message('info', 'Export completato', 'File TXT in consegna alla cartella di trasferimento.')
                     else:
-                        _show_message('info', 'Export completato', 'File TXT generato nella cartella di trasferimento.')
-                else:
-                    _show_message('error', 'Errore export', 'Impossibile generare il file TXT. Verifica impostazioni e riprova.')
+                        _show_message('error', 'Errore export', 'Impossibile generare il file TXT. Verifica impostazioni e riprova.')
+
+                win.after(200, _attendi)
 
             export_btn = tk.Button(btns, text='Esporta ora', font=btn_font, command=on_export_now)
             export_btn.pack(side='left', padx=(self.s(12), 0), ipadx=self.s(18), ipady=self.s(12))
 
+            # Stato consegna (aggiornato ogni secondo finché la finestra è aperta)
+            transfer_status = tk.Label(container, text='', font=('Segoe UI', max(14, int(self.s(18)))),
+                                       bg='#FFFFFF', fg='#6B7280', justify='left', anchor='w')
+            transfer_status.pack(fill='x', anchor='w', pady=(self.s(16), 0))
+
+            def _refresh_transfer_status():
+                try:
+                    if not win.winfo_exists():
+                        return
+                    testo, colore = self._transfer_status_text()
+                    transfer_status.configure(text=testo, fg=colore)
+                    win.after(1000, _refresh_transfer_status)
+                except Exception:
+                    pass
+
+            _refresh_transfer_status()
+
 
             # Tastiera touch: usa logica del wizard + verifica visibilit? con fallback snello
             def _is_keyboard_visible():
@@ -3314,196 +3361,175 @@ class TigotaEliteDashboard:
                 pass
         return ora, export_dir, sede, negozio
 
-    def export_pending_timbrature_to_txt(self) -> bool:
-        """Esporta timbrature con sync_status='pending' in un TXT e le marca come sincronizzate.
-        Formato righe (senza header): CODSEDE;CODNEGOZIO;BADGE;TIPO;YYYYMMDD;HHMMSS
-        """
-        path_tmp = None
+    def _read_transfer_destinations(self):
+        """Destinazioni di trasferimento: cartella di [TRASFERIMENTO] + sezioni [DESTINAZIONE nome]."""
+        from database_sqlite import DEFAULT_TRANSFER_DEST
+        from trasferimenti import leggi_destinazioni
         try:
-            from database_sqlite import get_database_manager
-        except Exception as e:
-            print(f"[TRANSFER] DB non disponibile: {e}")
-            return False
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+        except Exception:
+            base_dir = '.'
+        cfg_path = os.path.join(base_dir, 'config_negozio.ini')
+        cfg = configparser.ConfigParser()
         try:
-            ora_str, out_dir, cod_sede, cod_negozio = self._read_transfer_settings()
-            # Crea cartella se manca
-            os.makedirs(out_dir, exist_ok=True)
-        except Exception as e:
-            print(f"[TRANSFER] Config/cartella trasferimento non valida: {e}")
-            return False
+            cfg.read(cfg_path, encoding='utf-8')
+        except Exception:
+            cfg.read(cfg_path)
+        destinazioni = leggi_destinazioni(cfg)
+        if not any(d['nome'] == DEFAULT_TRANSFER_DEST for d in destinazioni):
+            _, export_dir, _, _ = self._read_transfer_settings()
+            destinazioni.insert(0, {'nome': DEFAULT_TRANSFER_DEST, 'cartella': export_dir, 'tracciato': 'ORE'})
+        return destinazioni
+
+    def _transfer_manager(self):
+        """Gestore delle destinazioni (creato al primo uso, riconfigurato a ogni export)."""
+        from database_sqlite import get_database_manager, DATA_CONFIG
+        from trasferimenti import GestoreDestinazioni
+
+        _, _, cod_sede, cod_negozio = self._read_transfer_settings()
+        contesto = {'sede': cod_sede, 'negozio': cod_negozio}
+        destinazioni = self._read_transfer_destinations()
+        if self._trasferimenti is None:
+            self._trasferimenti = GestoreDestinazioni(
+                get_database_manager(), DATA_CONFIG.get('transfer_outbox_dir', 'outbox'), contesto, destinazioni,
+                workers=DATA_CONFIG.get('transfer_workers', 3),
+                timeout_s=DATA_CONFIG.get('transfer_timeout_s', 30),
+                retry_min_s=DATA_CONFIG.get('transfer_retry_min_s', 5),
+                retry_max_s=DATA_CONFIG.get('transfer_retry_max_s', 900),
+            )
+        else:
+            self._trasferimenti.configura(destinazioni, contesto)
+        return self._trasferimenti
 
+    def export_pending_timbrature_to_txt(self) -> bool:
+        """Esporta verso ogni destinazione le timbrature oltre il suo watermark (tracciato della destinazione,
+        'ORE' per la cartella principale: SEDE + BADGE(10) + TIPO + 0000 + GGMMAA + HHMM).
+        Ogni export è un batch journaled (trasferimenti.py): un export interrotto viene ripreso al giro successivo.
+        I file sono scritti nell'outbox locale; la consegna alle cartelle è dei corrieri in background.
+        Ritorna False se almeno una destinazione non è stata esportata (le altre procedono comunque).
+        """
         try:
-            db = get_database_manager()
-            rows = db.get_timbrature_pending()
-            if not rows:
-                print("[TRANSFER] Nessuna timbratura pending da esportare")
-                return True  # Non ? errore
-
-            # Prepara nome file: ORE{CODICE_NEGOZIO}{YYYYMMDDHHMMSS}.TXT
-            now = datetime.now()
-            ts = now.strftime('%Y%m%d%H%M%S')
-            codice_negozio = (cod_negozio or '').strip()
-            filename = f"ORE{codice_negozio}{ts}.TXT"
-            path_tmp = os.path.join(out_dir, filename + ".part")
-            path_final = os.path.join(out_dir, filename)
-
-            def _fmt_dt(ts_val):
-                s = str(ts_val)
-                # atteso 'YYYY-MM-DD HH:MM:SS[.fff]' -> split
-                try:
-                    date_part, time_part = s.split(' ')
-                except ValueError:
-                    # fallback: tutto in data
-                    date_part = s[:10]
-                    time_part = s[11:19]
-                ymd = date_part.replace('-', '')
-                hms = time_part.split('.')[0].replace(':', '')
-                return ymd, hms
-
-            # Scrivi file atomico
-            with open(path_tmp, 'w', encoding='utf-8', newline='') as f:
-                for r in rows:
-                    # Codice da esportare: codice dipendente associato al badge (wizard), numerico a 10 cifre (pad con zeri)
-                    raw_badge = (r.get('badge_id') or '').strip()
-                    emp_code_digits = ''
-                    try:
-                        dip = db.get_dipendente_by_badge(raw_badge)
-                        if dip and 'codice' in dip and dip['codice'] is not None:
-                            emp_code_digits = ''.join(ch for ch in str(dip['codice']) if ch.isdigit())
-                    except Exception:
-                        emp_code_digits = ''
-                    if not emp_code_digits:
-                        # Fallback: usa solo le cifre del badge_id
-                        emp_code_digits = ''.join(ch for ch in raw_badge if ch.isdigit()) or '0'
-                    badge10 = emp_code_digits[-10:].rjust(10, '0')
-                    # Tipo: 1=entrata, 0=uscita
-                    tipo_txt = (r.get('tipo') or '').strip().lower()
-                    tipo_flag = '1' if tipo_txt == 'entrata' else '0'
-                    # Data/ora: GGMMAA e HHMM
-                    ymd, hms = _fmt_dt(r.get('timestamp'))  # ymd=YYYYMMDD, hms=HHMMSS
-                    ddmmyy = ymd[6:8] + ymd[4:6] + ymd[2:4]
-                    hhmm = hms[0:2] + hms[2:4]
-                    # SEDE + BADGE(10) + TIPO + 0000 + GGMMAA + HHMM (senza separatori)
-                    sede_code = (cod_sede or '').strip()
-                    record = f"{sede_code}{badge10}{tipo_flag}0000{ddmmyy}{hhmm}\r\n"
-                    f.write(record)
-            os.replace(path_tmp, path_final)
-
-            # Marca come sincronizzate
-            ids = [r.get('id') for r in rows if r.get('id') is not None]
-            if ids:
-                db.mark_timbrature_synced(ids)
-            print(f"[TRANSFER] Esportate {len(rows)} timbrature in {path_final}")
-            return True
+            esiti = self._transfer_manager().esporta_tutte()
         except Exception as e:
-            try:
-                if path_tmp and os.path.exists(path_tmp):
-                    os.remove(path_tmp)
-            except Exception:
-                pass
             print(f"[TRANSFER] Errore export TXT: {e}")
             return False
+        for nome, esito in esiti.items():
+            if isinstance(esito, Exception):
+                continue
+            if not esito:
+                print(f"[TRANSFER] {nome}: nessuna timbratura pending da esportare")
+            else:
+                print(f"[TRANSFER] {nome}: esportate {esito} timbrature (outbox)")
+        return not any(isinstance(esito, Exception) for esito in esiti.values())
 
-    def _start_transfer_scheduler(self):
-        """Avvia un thread daemon che esegue l'export TXT ogni giorno all'ora configurata."""
-        if self._transfer_thread and self._transfer_thread.is_alive():
+    def _start_transfer_couriers(self):
+        """Avvia i corrieri: consegna a ogni cartella di destinazione con timeout e retry in background."""
+        self._transfer_manager().start()
+
+    def _start_cloud_sync(self):
+        """Avvia la sincronizzazione cloud a batch se abilitata e con un endpoint configurato."""
+        from database_sqlite import get_database_manager, DATA_CONFIG
+        if not DATA_CONFIG.get('cloud_sync_enabled') or not DATA_CONFIG.get('cloud_sync_url'):
             return
+        if self._sync_cloud and self._sync_cloud.is_running():
+            return
+        from sync_cloud import SincronizzatoreCloud
+
+        _, _, cod_sede, cod_negozio = self._read_transfer_settings()
+        self._sync_cloud = SincronizzatoreCloud(
+            get_database_manager(), DATA_CONFIG['cloud_sync_url'], {'sede': cod_sede, 'negozio': cod_negozio},
+            token=DATA_CONFIG.get('cloud_sync_token') or None,
+            intervallo_s=DATA_CONFIG.get('sync_interval', 900),
+            batch_max=DATA_CONFIG.get('cloud_sync_batch_max', 5000),
+            obiettivo_s=DATA_CONFIG.get('cloud_sync_target_s', 2.0),
+            timeout_s=DATA_CONFIG.get('transfer_timeout_s', 30),
+            retry_min_s=DATA_CONFIG.get('transfer_retry_min_s', 5),
+            retry_max_s=DATA_CONFIG.get('transfer_retry_max_s', 900),
+        )
+        self._sync_cloud.start()
+        print(f"[SYNC] Sincronizzazione cloud attiva verso {DATA_CONFIG['cloud_sync_url']}")
+
+    def _transfer_status_text(self):
+        """Testo e colore dello stato consegna per la finestra Impostazioni (una riga per destinazione)."""
+        if not self._trasferimenti:
+            return 'Consegna TXT: non attiva', '#6B7280'
+        righe, colore = [], '#15803D'
+        for nome, st in self._trasferimenti.stato().items():
+            consegna = st['consegna']
+            riga = f"{nome} ({st['tracciato']}): in attesa {consegna['in_coda']}"
+            if consegna['ultima_consegna']:
+                riga += f", ultima consegna {consegna['ultima_consegna'].strftime('%d/%m %H:%M:%S')}"
+            errore = consegna['ultimo_errore'] or (st['export'] or {}).get('errore')
+            if errore:
+                colore = '#B91C1C'
+                riga += f"\n    errore: {errore}"
+                if consegna['bloccata']:
+                    riga += ' (cartella non risponde)'
+                elif consegna['prossimo_tentativo_s'] is not None:
+                    riga += f" - nuovo tentativo tra {consegna['prossimo_tentativo_s']:.0f}s"
+            elif consegna['in_coda'] and colore != '#B91C1C':
+                colore = '#6B7280'
+            righe.append(riga)
+        return '\n'.join(righe) or 'Nessuna destinazione configurata', colore
+
+    def _transfer_cron_spec(self) -> str:
+        """Specifica cron giornaliera dall'ora di trasferimento (accetta "HH:MM", "HH.MM", "HHMM" o "H")."""
+        from scheduler_manutenzione import spec_giornaliera
+        ora_str, _, _, _ = self._read_transfer_settings()
+        return spec_giornaliera(ora_str)
 
-        def _loop():
-            while not self._transfer_stop.is_set():
-                try:
-                    ora_str, _, _, _ = self._read_transfer_settings()
-                    # Parse orario con tolleranza: accetta "HH:MM", "HH.MM", "HHMM" o solo "H/H H"
-                    hh, mm = 2, 0  # default 02:00
-                    try:
-                        s = (ora_str or '').strip()
-                        s = s.replace('.', ':')
-                        s = s.replace(' ', '')
-                        if ':' in s:
-                            parts = s.split(':')
-                            if len(parts) >= 2:
-                                hh = int(parts[0])
-                                mm = int(parts[1][:2])
-                        elif len(s) in (3, 4) and s.isdigit():
-                            # Es. 930 -> 09:30, 1430 -> 14:30
-                            hh = int(s[:-2])
-                            mm = int(s[-2:])
-                        elif len(s) in (1, 2) and s.isdigit():
-                            # Solo ora
-                            hh = int(s)
-                            mm = 0
-                        # Normalizza range
-                        hh = max(0, min(23, hh))
-                        mm = max(0, min(59, mm))
-                    except Exception:
-                        pass
-                    now = datetime.now()
-                    run_at = now.replace(hour=hh, minute=mm, second=0, microsecond=0)
-                    if run_at <= now:
-                        # Se l'orario odierno ? appena passato (entro 60s), esegui tra 5s; altrimenti programma domani
-                        from datetime import timedelta
-                        if (now - run_at).total_seconds() <= 60:
-                            run_at = now + timedelta(seconds=5)
-                        else:
-                            run_at = run_at + timedelta(days=1)
-                    wait_s = max(1, int((run_at - now).total_seconds()))
-                    
-                    # SICUREZZA: Limita attesa massima a 1 ora
-                    MAX_WAIT_SECONDS = 3600  # 1 ora
-                    if wait_s > MAX_WAIT_SECONDS:
-                        wait_s = MAX_WAIT_SECONDS
-                        print(f"[TRANSFER] Attesa limitata a {MAX_WAIT_SECONDS}s per sicurezza")
-                        
-                    print(f"[TRANSFER] Scheduler prossimo run alle {run_at.strftime('%Y-%m-%d %H:%M:%S')} (tra {wait_s}s)")
-                    
-                    # Attendi in porzioni per permettere stop rapido
-                    step = 10  # Aumentato da 5 a 10 per ridurre overhead
-                    waited = 0
-                    while waited < wait_s and not self._transfer_stop.is_set():
-                        chunk = min(step, wait_s - waited)
-                        time.sleep(chunk)
-                        waited += chunk
-                        
-                        # Log periodico per debugging (ogni 5 minuti)
-                        if waited % 300 == 0 and waited > 0:
-                            remaining = wait_s - waited
-                            print(f"[TRANSFER] Attesa in corso: {remaining}s rimanenti")
-                            
-                    if self._transfer_stop.is_set():
-                        print("[TRANSFER] Scheduler fermato manualmente")
-                        break
-                    # Esegui export
-                    print(f"[TRANSFER] Scheduler avvio export alle {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                    try:
-                        self.export_pending_timbrature_to_txt()
-                        print("[TRANSFER] Export completato con successo")
-                    except Exception as export_error:
-                        print(f"[TRANSFER] Errore durante export: {export_error}")
-                    # poi loop per il prossimo giorno
-                except Exception as e:
-                    print(f"[TRANSFER] Scheduler errore: {e}")
-                    import traceback
-                    print(f"[TRANSFER] Traceback: {traceback.format_exc()}")
-                    time.sleep(60)  # Attendi 1 minuto invece di 30s per ridurre spam di errori
+    def _start_transfer_scheduler(self):
+        """Avvia lo scheduler unico: export TXT giornaliero all'ora configurata e job di manutenzione del DB.
+        Il thread dorme fino alla prossima scadenza; gli export persi ad applicazione chiusa vengono recuperati."""
+        if self._scheduler and self._scheduler.is_running():
+            return
+        from scheduler_manutenzione import SchedulerManutenzione
+        from database_sqlite import get_database_manager, DATA_CONFIG
 
-        self._transfer_stop.clear()
-        t = threading.Thread(target=_loop, name='TransferScheduler', daemon=True)
-        t.start()
-        self._transfer_thread = t
+        self._scheduler = SchedulerManutenzione(DATA_CONFIG.get('scheduler_state_file'))
+        self._scheduler.aggiungi('export_ore', self._transfer_cron_spec(), self.export_pending_timbrature_to_txt)
+        try:
+            get_database_manager().register_maintenance_jobs(self._scheduler)
+        except Exception as e:
+            print(f"[SCHEDULER] Job di manutenzione database non pianificati: {e}")
+        self._scheduler.start()
+        try:
+            self._start_transfer_couriers()
+        except Exception as e:
+            print(f"[TRANSFER] Avvio consegna in background fallito: {e}")
+        try:
+            self._start_cloud_sync()
+        except Exception as e:
+            print(f"[SYNC] Avvio sincronizzazione cloud fallito: {e}")
+        for job in self._scheduler.stato():
+            print(f"[SCHEDULER] {job['nome']} ({job['spec']}): prossimo run {job['prossima'].strftime('%Y-%m-%d %H:%M')}")
 
     def _stop_transfer_scheduler(self):
         try:
-            self._transfer_stop.set()
-            t = self._transfer_thread
-            if t and t.is_alive():
-                t.join(timeout=1.5)
+            if self._scheduler:
+                self._scheduler.stop(timeout=1.5)
+        except Exception:
+            pass
+        try:
+            if self._trasferimenti:
+                self._trasferimenti.stop(timeout=1.0)
+        except Exception:
+            pass
+        try:
+            if self._sync_cloud:
+                self._sync_cloud.stop(timeout=1.0)
         except Exception:
             pass
 
     def _restart_transfer_scheduler(self):
-        self._stop_transfer_scheduler()
-        self._start_transfer_scheduler()
-    
+        """Applica la nuova ora di trasferimento senza fermare gli altri job."""
+        if self._scheduler and self._scheduler.is_running():
+            spec = self._transfer_cron_spec()
+            self._scheduler.ripianifica('export_ore', spec)
+            print(f"[TRANSFER] Export ripianificato ({spec})")
+        else:
+            self._start_transfer_scheduler()
+
 
     def create_large_clock(self, parent):
         """Crea orologio e data centralizzati con padding ottimizzato (meno bianco sotto)."""
@@ -3866,18 +3892,51 @@ class TigotaEliteDashboard:
                 self.root.after(1000, self.update_tigota_clock)
 
     # --- NFC integration ---
+    def _start_badge_service(self):
+        """Avvia il servizio lettore badge condiviso e il controllo periodico della sua salute."""
+        get_servizio_lettore().start()
+        try:
+            # Ultime timbrature ancora dentro la finestra dei quasi-duplicati (sopravvive al riavvio)
+            from database_sqlite import get_database_manager
+            caricate = get_deduplicatore().carica_ultime_timbrature(get_database_manager())
+            if caricate:
+                print(f"[NFC] Deduplicazione: {caricate} timbrature recenti caricate")
+        except Exception as e:
+            print(f"[NFC] Caricamento ultime timbrature fallito: {e}")
+        if getattr(self, 'root', None):
+            self.root.after(30000, self._check_badge_service)
+
+    def _check_badge_service(self):
+        """Ogni 30 s: se il thread del servizio è morto lo segnala e lo riavvia (fuori dal percorso di lettura)."""
+        try:
+            servizio = get_servizio_lettore()
+            salute = servizio.salute()
+            if salute['stato'] == 'errore':
+                print(f"[NFC] Servizio lettore in errore ({salute['ultimo_errore']}): riavvio")
+                servizio.start()
+            for nome, stato in salute['sorgenti'].items():
+                if stato.get('errore'):
+                    print(f"[NFC] Sorgente badge '{nome}': {stato['errore']}")
+        except Exception as e:
+            print(f"[NFC] Controllo servizio lettore fallito: {e}")
+        finally:
+            if getattr(self, 'root', None):
+                self.root.after(30000, self._check_badge_service)
+
+    def _stop_badge_service(self):
+        try:
+            get_servizio_lettore().stop(timeout=1.0)
+        except Exception:
+            pass
+
     def enable_nfc_reading(self):
-        """Avvia la lettura del badge NFC dopo la selezione dell'evento."""
+        """Arma il servizio lettore badge dopo la selezione dell'evento (nessun thread creato qui)."""
         try:
             print("[NFC] enable_nfc_reading: richiesta avvio")
-            # Ferma un'eventuale lettura precedente
-            if getattr(self, 'nfc_reader', None):
-                try:
-                    self.nfc_reader.stop_reading()
-                except Exception:
-                    pass
-            # Crea nuovo lettore con callback
-            self.nfc_reader = NFCReader(callback=self.on_badge_read)
+            # Il lettore della dashboard è uno solo; va ricreato (senza thread) solo se il wizard l'ha sostituito
+            reader = getattr(self, 'nfc_reader', None)
+            if reader is None or reader.callback != self.on_badge_read:
+                self.nfc_reader = NFCReader(callback=self.on_badge_read)
             self.nfc_reader.start_reading()
             print("[NFC] Lettura abilitata: avvicina il badge")
 
@@ -3926,12 +3985,22 @@ class TigotaEliteDashboard:
                                     pass
                             return
 
+                        # Stesso badge già timbrato entro la finestra: segnalato (la timbratura viene comunque salvata)
+                        dedup = get_deduplicatore()
+                        quasi = dedup.verifica_timbratura(badge_id, tipo_str)
+                        if quasi:
+                            print(f"[NFC] Possibile doppia timbratura badge {badge_id}: {quasi['tipo']} già registrata "
+                                  f"alle {quasi['timestamp']:%H:%M:%S} ({quasi['secondi']:.0f}s fa)")
+                        doppia = bool(quasi and quasi['stesso_tipo'])
+
                         if is_known:
                             azione = 'Ingresso' if self.selected_action == 'in' else ('Uscita' if self.selected_action == 'out' else '?')
                             nominativo = (dip_nome or '').strip()
                             if dip_cognome:
                                 nominativo = f"{nominativo} {dip_cognome.strip()}".strip()
                             msg = f"{('Ciao ' + nominativo + ' ? ') if nominativo else ''}Badge: {badge_id} ? {azione} registrata"
+                            if doppia:
+                                msg += f" (già registrata alle {quasi['timestamp']:%H:%M})"
                             self.selection_hint_var.set(msg)
                             if hasattr(self, 'selection_hint_label') and self.selection_hint_label is not None:
                                 self.selection_hint_label.config(fg='#20B2AA')  # Colore uniforme per entrambi
@@ -3943,15 +4012,21 @@ class TigotaEliteDashboard:
                                     winsound.MessageBeep()
                                 except Exception:
                                     pass
-                            # Salva timbratura nel DB (nota: sync_status default = 'pending')
+                            # Salva timbratura nel DB in write-behind (nota: sync_status default = 'pending')
                             try:
                                 if 'db' in locals():
-                                    db.save_timbratura(badge_id, tipo_str, dip_nome, dip_cognome)
+                                    record = db.save_timbratura_async(badge_id, tipo_str, dip_nome, dip_cognome,
+                                                                      callback=self._on_timbratura_saved)
+                                    dedup.registra_timbratura(badge_id, tipo_str, record['timestamp'])
                             except Exception as se:
                                 print(f"[DB] Errore salvataggio timbratura: {se}")
                             # Toast stile TIGOT? (success)
                             display_name = nominativo if nominativo else None
-                            self._show_tigota_toast('success', f"{azione} registrata", name=display_name)
+                            if doppia:
+                                self._show_tigota_toast('warning', f"{azione} già registrata alle {quasi['timestamp']:%H:%M}",
+                                                        name=display_name)
+                            else:
+                                self._show_tigota_toast('success', f"{azione} registrata", name=display_name)
                             # CANCELLA PARTICELLE DOPO TIMBRATURA RIUSCITA
                             if hasattr(self, 'btn_ingresso') and hasattr(self.btn_ingresso, 'clear_particles'):
                                 self.btn_ingresso['clear_particles']()
@@ -3973,14 +4048,16 @@ class TigotaEliteDashboard:
                             # Salva comunque la timbratura (senza nominativo), per tracciamento
                             try:
                                 if 'db' in locals() and tipo_str:
-                                    db.save_timbratura(badge_id, tipo_str, None, None)
+                                    record = db.save_timbratura_async(badge_id, tipo_str, None, None,
+                                                                      callback=self._on_timbratura_saved)
+                                    dedup.registra_timbratura(badge_id, tipo_str, record['timestamp'])
                             except Exception as se:
                                 print(f"[DB] Errore salvataggio timbratura (unknown badge): {se}")
                             # Toast stile TIGOT? (errore)
                             self._show_tigota_toast('error', "Badge non riconosciuto")
                 except Exception:
                     pass
-                # Ferma lettore dopo una lettura per evitare duplicati rapidi
+                # Una timbratura per selezione: i duplicati li sopprime il deduplicatore per badge
                 try:
                     if getattr(self, 'nfc_reader', None):
                         self.nfc_reader.stop_reading()
@@ -4004,6 +4081,20 @@ class TigotaEliteDashboard:
         except Exception as e:
             print(f"[NFC] Errore in callback badge: {e}")
 
+    def _on_timbratura_saved(self, ok: bool, record: dict):
+        """Esito del salvataggio write-behind (chiamato dal thread writer del database)."""
+        if ok:
+            return
+        print(f"[DB] Errore salvataggio timbratura: badge {record.get('badge_id')} ({record.get('tipo')})")
+
+        def _notify():
+            try:
+                self._show_tigota_toast('error', "Errore salvataggio timbratura")
+            except Exception:
+                pass
+        if hasattr(self, 'root') and self.root:
+            self.root.after(0, _notify)
+
     # --- Keyboard wedge capture (ID Card Reader) ---
     def _setup_keyboard_capture(self):
         """Crea un Entry nascosto per catturare input tastiera dai lettori USB "ID Card Reader"."""
@@ -4071,10 +4162,16 @@ class TigotaEliteDashboard:
         badge = (self._badge_buffer or '').strip()
         self._badge_buffer = ''
         if badge:
-            # Gestisci direttamente come lettura badge
             print(f"[NFC] Badge (ID Card Reader): {badge}")
             try:
-                self.on_badge_read(badge)
+                # Con il lettore attivo la lettura passa dal bus badge (stesso percorso dei lettori hardware);
+                # altrimenti viene gestita direttamente
+                reader = getattr(self, 'nfc_reader', None)
+                if reader and reader.is_reading:
+                    from badge_bus import get_badge_bus
+                    get_badge_bus().pubblica(badge, 'tastiera')
+                else:
+                    self.on_badge_read(badge)
             except Exception as e:
                 print(f"[NFC] Errore gestione badge tastiera: {e}")
 
@@ -4264,6 +4361,7 @@ if __name__ == "__main__":
             dashboard._stop_transfer_scheduler()
         except Exception:
             pass
+        dashboard._stop_badge_service()
         try:
             root.destroy()
         except Exception:
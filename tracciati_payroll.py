@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tracciati record per l'export delle timbrature verso il payroll
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Ogni formato (tracciato ORE a lunghezza fissa, varianti CSV, futuri formati HR) è
+dichiarato una sola volta in TRACCIATI come lista di campi. compila_tracciato() lo
+traduce in un formatter precompilato: le costanti e i valori di contesto (sede, negozio)
+vengono risolti una volta, data/ora diventano slice sul timestamp ISO e le conversioni
+per valore (cifre, padding) sono memorizzate in cache. Il file viene scritto a blocchi
+tramite un buffer grande e pubblicato in modo atomico (.part + os.replace).
+compila_parser() ricava dallo stesso tracciato a lunghezza fissa il parser inverso
+(slice precalcolate), usato dall'ingestione in sede centrale.
+
+Campo di un tracciato (dict):
+- nome:        identificativo del campo (intestazione CSV se manca 'etichetta')
+- costante:    testo fisso, oppure
+- contesto:    chiave del contesto di export (es. 'sede'), risolta in compilazione, oppure
+- colonna:     colonna della riga (id, badge_id, tipo, timestamp, codice, nome, cognome)
+- riserva:     colonna usata se il valore convertito di 'colonna' è vuoto
+- conversione: 'testo' (default), 'cifre', 'data', 'ora', 'mappa'
+- formato:     per data/ora, token GG MM AA AAAA / HH MM SS con separatori liberi
+- valori, default: per 'mappa' (es. {'entrata': '1'}, default '0')
+- larghezza, allinea ('destra'/'sinistra'), riempimento: campi a lunghezza fissa
+"""
+
+import hashlib
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Buffer di scrittura e righe accumulate per ogni write()
+BUFFER_SCRITTURA = 1 << 20
+RIGHE_PER_BLOCCO = 4096
+
+TRACCIATI = {
+    # SEDE + BADGE(10) + TIPO + 0000 + GGMMAA + HHMM (senza separatori)
+    'ORE': {
+        'tipo': 'fisso',
+        'nome_file': 'ORE{negozio}{ts}.TXT',
+        'fine_riga': '\r\n',
+        'campi': [
+            {'nome': 'sede', 'contesto': 'sede'},
+            # Codice dipendente (wizard) numerico a 10 cifre; in mancanza le cifre del badge
+            {'nome': 'badge', 'colonna': 'codice', 'riserva': 'badge_id', 'conversione': 'cifre',
+             'larghezza': 10, 'allinea': 'destra', 'riempimento': '0'},
+            {'nome': 'tipo', 'colonna': 'tipo', 'conversione': 'mappa',
+             'valori': {'entrata': '1'}, 'default': '0'},
+            {'nome': 'filler', 'costante': '0000'},
+            {'nome': 'data', 'colonna': 'timestamp', 'conversione': 'data', 'formato': 'GGMMAA'},
+            {'nome': 'ora', 'colonna': 'timestamp', 'conversione': 'ora', 'formato': 'HHMM'},
+        ],
+    },
+    'CSV': {
+        'tipo': 'delimitato',
+        'separatore': ';',
+        'intestazione': True,
+        'nome_file': 'TIMBRATURE{negozio}{ts}.csv',
+        'fine_riga': '\r\n',
+        'campi': [
+            {'nome': 'sede', 'contesto': 'sede'},
+            {'nome': 'negozio', 'contesto': 'negozio'},
+            {'nome': 'codice', 'colonna': 'codice', 'riserva': 'badge_id', 'conversione': 'cifre'},
+            {'nome': 'badge', 'colonna': 'badge_id'},
+            {'nome': 'tipo', 'colonna': 'tipo', 'conversione': 'mappa',
+             'valori': {'entrata': 'E', 'uscita': 'U'}, 'default': ''},
+            {'nome': 'data', 'colonna': 'timestamp', 'conversione': 'data', 'formato': 'AAAAMMGG'},
+            {'nome': 'ora', 'colonna': 'timestamp', 'conversione': 'ora', 'formato': 'HHMMSS'},
+        ],
+    },
+    'CSV_DETTAGLIO': {
+        'tipo': 'delimitato',
+        'separatore': ',',
+        'intestazione': True,
+        'nome_file': 'DETTAGLIO{negozio}{ts}.csv',
+        'fine_riga': '\n',
+        'campi': [
+            {'nome': 'codice', 'colonna': 'codice'},
+            {'nome': 'cognome', 'colonna': 'cognome'},
+            {'nome': 'nome', 'colonna': 'nome'},
+            {'nome': 'badge', 'colonna': 'badge_id'},
+            {'nome': 'tipo', 'colonna': 'tipo'},
+            {'nome': 'data', 'colonna': 'timestamp', 'conversione': 'data', 'formato': 'GG/MM/AAAA'},
+            {'nome': 'ora', 'colonna': 'timestamp', 'conversione': 'ora', 'formato': 'HH:MM:SS'},
+        ],
+    },
+}
+
+# Posizioni dei token nel timestamp ISO 'YYYY-MM-DD HH:MM:SS[.ffffff]'
+_TOKEN_DATA = {'AAAA': (0, 4), 'AA': (2, 4), 'MM': (5, 7), 'GG': (8, 10)}
+_TOKEN_ORA = {'HH': (11, 13), 'MM': (14, 16), 'SS': (17, 19)}
+_RE_TOKEN = {
+    'data': re.compile(r'AAAA|AA|MM|GG'),
+    'ora': re.compile(r'HH|MM|SS'),
+}
+
+
+def _solo_cifre(valore) -> str:
+    if valore is None:
+        return ''
+    return ''.join(ch for ch in str(valore) if ch.isdigit())
+
+
+def _testo(valore) -> str:
+    return '' if valore is None else str(valore).strip()
+
+
+def _adatta(valore: str, campo: Dict) -> str:
+    """Applica larghezza/allineamento: a destra tronca a sinistra (come badge[-10:]) e viceversa"""
+    larghezza = campo.get('larghezza')
+    if not larghezza:
+        return valore
+    riempimento = campo.get('riempimento', ' ')
+    if campo.get('allinea', 'sinistra') == 'destra':
+        return valore[-larghezza:].rjust(larghezza, riempimento)
+    return valore[:larghezza].ljust(larghezza, riempimento)
+
+
+def _quota_csv(valore: str, separatore: str) -> str:
+    if separatore in valore or '"' in valore or '\n' in valore or '\r' in valore:
+        return '"' + valore.replace('"', '""') + '"'
+    return valore
+
+
+class TracciatoCompilato:
+    """Formatter precompilato di un tracciato: formatta(riga) -> riga di testo con fine riga"""
+
+    def __init__(self, nome: str, layout: Dict, formatta: Callable, intestazione: str, contesto: Dict):
+        self.nome = nome
+        self.layout = layout
+        self.formatta = formatta
+        self.intestazione = intestazione
+        self.contesto = contesto
+
+    def nome_file(self, quando: Optional[datetime] = None) -> str:
+        """Nome del file di export dal modello del tracciato ({negozio}, {sede}, {ts})"""
+        ts = (quando or datetime.now()).strftime('%Y%m%d%H%M%S')
+        modello = self.layout.get('nome_file', self.nome + '{ts}.TXT')
+        return modello.format(ts=ts, **{k: _testo(v) for k, v in self.contesto.items()})
+
+    def scrivi_parziale(self, path_tmp: str, righe: Iterable, buffer_size: int = BUFFER_SCRITTURA) -> Tuple[int, str]:
+        """
+        Scrive le righe formattate in path_tmp a blocchi di RIGHE_PER_BLOCCO righe, calcolando
+        lo SHA-256 del contenuto; il file è su disco (fsync) al ritorno. Nessuna pubblicazione.
+
+        Returns:
+            Tuple[int, str]: record scritti, sha256 esadecimale del file
+        """
+        formatta = self.formatta
+        digest = hashlib.sha256()
+        count = 0
+        with open(path_tmp, 'wb', buffering=buffer_size) as f:
+            def _scrivi(testo):
+                dati = testo.encode('utf-8')
+                digest.update(dati)
+                f.write(dati)
+            if self.intestazione:
+                _scrivi(self.intestazione)
+            blocco = []
+            for riga in righe:
+                blocco.append(formatta(riga))
+                if len(blocco) >= RIGHE_PER_BLOCCO:
+                    _scrivi(''.join(blocco))
+                    count += len(blocco)
+                    blocco = []
+            if blocco:
+                _scrivi(''.join(blocco))
+                count += len(blocco)
+            f.flush()
+            os.fsync(f.fileno())
+        return count, digest.hexdigest()
+
+    def scrivi(self, path: str, righe: Iterable, buffer_size: int = BUFFER_SCRITTURA) -> int:
+        """
+        Scrive le righe formattate in path (via path.part + os.replace).
+        Senza righe non crea alcun file.
+
+        Returns:
+            int: numero di record scritti
+        """
+        path_tmp = path + '.part'
+        try:
+            count, _ = self.scrivi_parziale(path_tmp, righe, buffer_size)
+            if count:
+                os.replace(path_tmp, path)
+            else:
+                os.remove(path_tmp)
+            return count
+        except Exception:
+            if os.path.exists(path_tmp):
+                os.remove(path_tmp)
+            raise
+
+
+def _compila_campo(campo: Dict, contesto: Dict, ns: Dict, indice: int, separatore: Optional[str]) -> Tuple[bool, str]:
+    """
+    Traduce un campo in (costante, valore): se costante=True il valore è il testo già
+    risolto, altrimenti è l'espressione Python da inserire nel formatter.
+    """
+    nome = campo.get('nome', f'campo{indice}')
+    quota = (lambda v: _quota_csv(v, separatore)) if separatore else (lambda v: v)
+
+    if 'costante' in campo or 'contesto' in campo:
+        valore = campo['costante'] if 'costante' in campo else contesto.get(campo['contesto'], '')
+        return True, quota(_adatta(_testo(valore), campo))
+
+    if 'colonna' not in campo:
+        raise ValueError(f"Campo '{nome}': serve 'costante', 'contesto' o 'colonna'")
+    conversione = campo.get('conversione', 'testo')
+    colonna = f"r[{campo['colonna']!r}]"
+
+    if conversione in ('data', 'ora'):
+        # Slice sul timestamp ISO, separatori copiati come testo
+        tokens = _TOKEN_DATA if conversione == 'data' else _TOKEN_ORA
+        formato = campo.get('formato') or ('GGMMAA' if conversione == 'data' else 'HHMM')
+        parti, pos = [], 0
+        for m in _RE_TOKEN[conversione].finditer(formato):
+            if m.start() > pos:
+                parti.append(repr(formato[pos:m.start()]))
+            a, b = tokens[m.group()]
+            parti.append(f"ts[{a}:{b}]")
+            pos = m.end()
+        if pos < len(formato):
+            parti.append(repr(formato[pos:]))
+        espressione = ' + '.join(parti) or "''"
+        if campo.get('larghezza'):
+            ns[f'_c{indice}'] = campo
+            espressione = f"_adatta({espressione}, _c{indice})"
+        return False, espressione
+
+    if conversione == 'mappa':
+        valori = {str(k).lower(): quota(_adatta(_testo(v), campo)) for k, v in campo.get('valori', {}).items()}
+        default = quota(_adatta(_testo(campo.get('default', '')), campo))
+
+        @lru_cache(maxsize=1024)
+        def _mappa(v):
+            return valori.get(_testo(v).lower(), default)
+        ns[f'_f{indice}'] = _mappa
+        return False, f"_f{indice}({colonna})"
+
+    if conversione not in ('testo', 'cifre'):
+        raise ValueError(f"Campo '{nome}': conversione '{conversione}' non supportata")
+    converti = _solo_cifre if conversione == 'cifre' else _testo
+    riserva_default = '0' if conversione == 'cifre' else ''
+
+    # Pochi valori distinti (dipendenti/badge): conversione memorizzata per valore
+    if 'riserva' in campo:
+        @lru_cache(maxsize=65536)
+        def _valore(v, riserva):
+            return quota(_adatta(converti(v) or converti(riserva) or riserva_default, campo))
+        ns[f'_f{indice}'] = _valore
+        return False, f"_f{indice}({colonna}, r[{campo['riserva']!r}])"
+
+    @lru_cache(maxsize=65536)
+    def _valore(v):
+        return quota(_adatta(converti(v), campo))
+    ns[f'_f{indice}'] = _valore
+    return False, f"_f{indice}({colonna})"
+
+
+def compila_tracciato(nome: str, contesto: Optional[Dict] = None, layout: Optional[Dict] = None) -> TracciatoCompilato:
+    """
+    Compila il tracciato 'nome' (da TRACCIATI o passato in layout) per un contesto di export.
+    Le costanti adiacenti vengono fuse e il formatter è una singola f-string per riga.
+
+    Raises:
+        ValueError: tracciato sconosciuto o campo non valido
+    """
+    layout = layout or TRACCIATI.get(nome)
+    if not layout:
+        raise ValueError(f"Tracciato sconosciuto: {nome}")
+    contesto = dict(contesto or {})
+    separatore = layout.get('separatore', ';') if layout.get('tipo') == 'delimitato' else None
+    fine_riga = layout.get('fine_riga', '\r\n')
+
+    ns = {'_adatta': _adatta, '_testo': _testo}
+    pezzi: List[Tuple[bool, str]] = []
+    usa_timestamp = False
+    for i, campo in enumerate(layout['campi']):
+        if separatore and i:
+            pezzi.append((True, separatore))
+        costante, valore = _compila_campo(campo, contesto, ns, i, separatore)
+        usa_timestamp |= campo.get('conversione') in ('data', 'ora')
+        pezzi.append((costante, valore))
+    pezzi.append((True, fine_riga))
+
+    # Costanti adiacenti fuse in un'unica variabile del namespace
+    template, testo = [], ''
+    for costante, valore in pezzi:
+        if costante:
+            testo += valore
+            continue
+        if testo:
+            ns[f'_k{len(template)}'] = testo
+            template.append(f"{{_k{len(template)}}}")
+            testo = ''
+        template.append(f"{{{valore}}}")
+    if testo:
+        ns[f'_k{len(template)}'] = testo
+        template.append(f"{{_k{len(template)}}}")
+
+    # Il timestamp può arrivare come testo (SQLite) o datetime: str() produce lo stesso layout ISO
+    sorgente = "def _formatta(r):\n"
+    if usa_timestamp:
+        sorgente += "    ts = r['timestamp']\n    if ts.__class__ is not str:\n        ts = str(ts)\n"
+    sorgente += f"    return f\"{''.join(template)}\"\n"
+    exec(compile(sorgente, f"<tracciato {nome}>", 'exec'), ns)
+
+    intestazione = ''
+    if separatore and layout.get('intestazione'):
+        intestazione = separatore.join(
+            _quota_csv(c.get('etichetta', c.get('nome', '')), separatore) for c in layout['campi']
+        ) + fine_riga
+    return TracciatoCompilato(nome, layout, ns['_formatta'], intestazione, contesto)
+
+
+
+def _larghezza_campo(campo: Dict) -> Optional[int]:
+    """Larghezza fissa del campo in un tracciato 'fisso' (None se variabile, es. valori di contesto)"""
+    if campo.get('larghezza'):
+        return int(campo['larghezza'])
+    if 'costante' in campo:
+        return len(_testo(campo['costante']))
+    conversione = campo.get('conversione')
+    if conversione in ('data', 'ora'):
+        # I token (GG, MM, AA, AAAA, HH, SS) occupano tanti caratteri quanti ne producono
+        return len(campo.get('formato') or ('GGMMAA' if conversione == 'data' else 'HHMM'))
+    if conversione == 'mappa':
+        lunghezze = {len(_testo(v)) for v in campo.get('valori', {}).values()}
+        lunghezze.add(len(_testo(campo.get('default', ''))))
+        if len(lunghezze) == 1:
+            return lunghezze.pop()
+    return None
+
+
+def compila_parser(nome: str, layout: Optional[Dict] = None) -> Callable[[str], Optional[Dict]]:
+    """
+    Parser inverso di un tracciato a lunghezza fissa: riga -> {nome_campo: testo grezzo}.
+    È ammesso un solo campo a larghezza variabile (es. 'sede' da contesto): i campi che lo
+    precedono sono letti da sinistra, quelli che lo seguono da destra.
+    Righe di lunghezza non compatibile producono None.
+
+    Raises:
+        ValueError: tracciato sconosciuto, non a lunghezza fissa o con più campi variabili
+    """
+    layout = layout or TRACCIATI.get(nome)
+    if not layout or layout.get('tipo') != 'fisso':
+        raise ValueError(f"Tracciato a lunghezza fissa sconosciuto: {nome}")
+    campi = [(c.get('nome', f'campo{i}'), _larghezza_campo(c)) for i, c in enumerate(layout['campi'])]
+    variabili = [i for i, (_, larghezza) in enumerate(campi) if larghezza is None]
+    if len(variabili) > 1:
+        raise ValueError(f"Tracciato {nome}: più campi a larghezza variabile")
+    fissa = sum(larghezza for _, larghezza in campi if larghezza is not None)
+
+    # Slice precalcolate: indici positivi prima del campo variabile, negativi dopo
+    fette = []
+    pos = 0
+    limite = variabili[0] if variabili else len(campi)
+    for nome_campo, larghezza in campi[:limite]:
+        fette.append((nome_campo, slice(pos, pos + larghezza)))
+        pos += larghezza
+    if variabili:
+        coda = 0
+        dopo = []
+        for nome_campo, larghezza in reversed(campi[limite + 1:]):
+            dopo.append((nome_campo, slice(-(coda + larghezza), -coda or None)))
+            coda += larghezza
+        fette.append((campi[limite][0], slice(pos, -coda or None)))
+        fette.extend(reversed(dopo))
+
+    def _analizza(riga: str) -> Optional[Dict]:
+        riga = riga.rstrip('\r\n')
+        if len(riga) < fissa or (not variabili and len(riga) != fissa):
+            return None
+        return {nome_campo: riga[fetta] for nome_campo, fetta in fette}
+
+    return _analizza
+
+
+if __name__ == "__main__":
+    print("🧪 Test tracciati payroll")
+    righe = [
+        {'id': 1, 'badge_id': 'AB12345', 'tipo': 'entrata', 'timestamp': '2025-03-07 08:05:09.123456',
+         'codice': '000042', 'nome': 'Mario', 'cognome': 'Rossi'},
+        {'id': 2, 'badge_id': 'XY9', 'tipo': 'uscita', 'timestamp': datetime(2025, 3, 7, 17, 30),
+         'codice': None, 'nome': None, 'cognome': 'D"Amico, Jr'},
+    ]
+    contesto = {'sede': '12', 'negozio': '345'}
+    ore = compila_tracciato('ORE', contesto)
+    attese = ["120000000042100000703250805\r\n", "120000000009000000703251730\r\n"]
+    for riga, attesa in zip(righe, attese):
+        risultato = ore.formatta(riga)
+        print(f"   {'✅' if risultato == attesa else '❌'} ORE {risultato!r}")
+    analizza = compila_parser('ORE')
+    campi = analizza(attese[0])
+    ok = campi == {'sede': '12', 'badge': '0000000042', 'tipo': '1', 'filler': '0000', 'data': '070325', 'ora': '0805'}
+    print(f"   {'✅' if ok else '❌'} parser ORE {campi}")
+    for nome in ('CSV', 'CSV_DETTAGLIO'):
+        tracciato = compila_tracciato(nome, contesto)
+        print(f"   ✅ {nome} {tracciato.nome_file()}")
+        print('      ' + (tracciato.intestazione + ''.join(tracciato.formatta(r) for r in righe)).replace('\n', '\n      '))
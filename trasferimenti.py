@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export delle timbrature verso il payroll con journal dei batch (exactly-once)
+SmartTIM - Sistema di Timbratura TIGOTÀ
+
+Ogni export è un batch registrato in transfer_batches prima e dopo ogni passo:
+
+    preparato   range (watermark, id massimo] e nome file registrati, .part in scrittura
+    scritto     .part completo e su disco, righe e sha256 registrati
+    pubblicato  .part rinominato nel file definitivo
+    confermato  watermark avanzato a to_id (stessa transazione del cambio di fase)
+
+Dopo un crash il batch aperto viene ripreso dalla fase registrata, senza rileggere
+il backlog oltre il suo range:
+- preparato: il .part può essere incompleto, viene riscritto dal solo range del batch
+- scritto:   pubblicato se il .part (o il file finale) ha lo sha256 registrato, altrimenti riscritto
+- pubblicato: il file è già consegnato, resta solo la conferma del watermark
+Un batch pubblicato non viene mai riscritto con un altro nome: ogni timbratura finisce
+in un solo file per destinazione.
+
+La cartella del batch è un'outbox locale: CorriereTrasferimenti consegna poi i file
+pubblicati alla cartella di trasferimento (spesso una share di rete) in background,
+con timeout e retry, così una share lenta o giù non blocca né l'export né la UI.
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from database_sqlite import DEFAULT_TRANSFER_DEST
+from tracciati_payroll import TRACCIATI, compila_tracciato
+
+# Un solo export alla volta per destinazione (scheduler, "Esporta ora", ripresa)
+_lock_destinazioni: Dict[str, threading.Lock] = {}
+_lock_registro = threading.Lock()
+
+
+def _lock_destinazione(destinazione: str) -> threading.Lock:
+    with _lock_registro:
+        return _lock_destinazioni.setdefault(destinazione, threading.Lock())
+
+
+def _sha256_file(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for blocco in iter(lambda: f.read(1 << 20), b''):
+            digest.update(blocco)
+    return digest.hexdigest()
+
+
+def _fsync_dir(cartella: str):
+    """Rende durevole il rename nella cartella (non supportato su Windows: ignorato)"""
+    try:
+        fd = os.open(cartella, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class EsportatoreTrasferimenti:
+    """Export journaled di una destinazione: tracciato + cartella + contesto (sede, negozio)"""
+
+    def __init__(self, db, cartella: str, contesto: Dict, destinazione: str = DEFAULT_TRANSFER_DEST,
+                 tracciato: str = 'ORE'):
+        self.db = db
+        self.cartella = cartella
+        self.destinazione = destinazione
+        self.tracciato = compila_tracciato(tracciato, contesto)
+        self.ultimo_file: Optional[str] = None
+
+    def esporta(self) -> int:
+        """
+        Riprende eventuali batch interrotti, poi esporta le timbrature oltre il watermark.
+
+        Returns:
+            int: timbrature consegnate (batch ripresi + nuovo batch)
+
+        Raises:
+            Exception: errore di scrittura/pubblicazione (il batch resta aperto e verrà ripreso)
+        """
+        with _lock_destinazione(self.destinazione):
+            os.makedirs(self.cartella, exist_ok=True)
+            totale = self._riprendi()
+            batch = self.db.begin_transfer_batch(self.destinazione, self._nome_file_libero())
+            if batch is not None:
+                totale += self._completa(batch)
+            return totale
+
+    def _nome_file_libero(self) -> str:
+        """Nome file mai usato dalla destinazione: il timestamp avanza di un secondo se già preso"""
+        quando = datetime.now()
+        while True:
+            nome = self.tracciato.nome_file(quando)
+            if not (os.path.exists(os.path.join(self.cartella, nome))
+                    or self.db.get_transfer_file_phase(self.destinazione, nome) is not None):
+                return nome
+            quando += timedelta(seconds=1)
+
+    def riprendi(self) -> int:
+        """Completa i batch rimasti aperti (es. all'avvio dopo un crash); ritorna le timbrature consegnate"""
+        with _lock_destinazione(self.destinazione):
+            return self._riprendi()
+
+    def _riprendi(self) -> int:
+        totale = 0
+        for batch in self.db.get_open_transfer_batches(self.destinazione):
+            print(f"[TRANSFER] Ripresa batch {batch['batch_id']} ({batch['file_name']}) in fase '{batch['fase']}'")
+            totale += self._completa(batch)
+        return totale
+
+    def _completa(self, batch: Dict) -> int:
+        batch_id = batch['batch_id']
+        fase = batch['fase']
+        righe = batch['righe'] or 0
+        path = os.path.join(self.cartella, batch['file_name'])
+        path_tmp = path + '.part'
+        try:
+            if fase == 'scritto' and batch['sha256'] is not None:
+                if _sha256_file(path_tmp) == batch['sha256']:
+                    pass
+                elif _sha256_file(path) == batch['sha256']:
+                    # Crash tra rename e registrazione della fase: già pubblicato
+                    fase = 'pubblicato'
+                    self.db.update_transfer_batch(batch_id, 'pubblicato')
+                else:
+                    fase = 'preparato'
+
+            if fase == 'preparato':
+                righe, sha256 = self.tracciato.scrivi_parziale(
+                    path_tmp, self.db.iter_timbrature_pending_export(batch['from_id'], batch['to_id'])
+                )
+                if righe == 0:
+                    # Range senza timbrature da esportare: nessun file, solo avanzamento watermark
+                    os.remove(path_tmp)
+                    self.db.update_transfer_batch(batch_id, 'pubblicato', righe=0)
+                    fase = 'pubblicato'
+                else:
+                    self.db.update_transfer_batch(batch_id, 'scritto', righe=righe, sha256=sha256)
+                    fase = 'scritto'
+
+            if fase == 'scritto':
+                os.replace(path_tmp, path)
+                _fsync_dir(self.cartella)
+                self.db.update_transfer_batch(batch_id, 'pubblicato')
+                fase = 'pubblicato'
+
+            if fase == 'pubblicato':
+                if not self.db.confirm_transfer_batch(batch_id):
+                    raise RuntimeError(f"conferma watermark del batch {batch_id} non riuscita")
+                if righe:
+                    self.ultimo_file = path
+            return righe
+        except Exception as e:
+            self.db.update_transfer_batch(batch_id, fase, errore=str(e))
+            raise
+
+
+class TimeoutCartella(Exception):
+    """Operazione sulla cartella di destinazione oltre il timeout (share lenta o irraggiungibile)"""
+
+
+class CorriereTrasferimenti:
+    """
+    Consegna in background i file dell'outbox locale alla cartella di trasferimento.
+
+    L'export scrive sempre nell'outbox (disco locale, mai bloccante); il corriere copia
+    ogni file nella destinazione (.part + fsync + rename), verifica lo sha256 e solo
+    allora lo rimuove dall'outbox. Ogni operazione sulla destinazione gira in un thread
+    separato con timeout: una share appesa non blocca né il corriere né la UI, e finché
+    l'operazione bloccata non ritorna non ne viene avviata un'altra. Dopo un errore il
+    tentativo successivo è ritardato con backoff esponenziale (retry_min_s .. retry_max_s).
+    """
+
+    def __init__(self, outbox: str, cartella: str, db=None, destinazione: str = DEFAULT_TRANSFER_DEST,
+                 timeout_s: float = 30, retry_min_s: float = 5, retry_max_s: float = 900):
+        self.outbox = outbox
+        self.cartella = cartella
+        self.db = db
+        self.destinazione = destinazione
+        self.timeout_s = timeout_s
+        self.retry_min_s = retry_min_s
+        self.retry_max_s = retry_max_s
+
+        self._lock = threading.Lock()
+        self._sveglia = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._bloccata: Optional[threading.Thread] = None  # operazione oltre timeout ancora in corso
+
+        self._errori_consecutivi = 0
+        self._prossimo_tentativo: Optional[float] = None  # time.monotonic()
+        self._ultima_consegna: Optional[datetime] = None
+        self._ultimo_errore: Optional[str] = None
+        self._consegnati = 0
+
+    # --- API ---
+    def start(self):
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"corriere-{self.destinazione}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        self._sveglia.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def sveglia(self):
+        """Nuovi file nell'outbox o cartella cambiata: tenta subito la consegna (azzera il backoff)"""
+        with self._lock:
+            self._prossimo_tentativo = None
+        self._sveglia.set()
+
+    def imposta_cartella(self, cartella: str):
+        with self._lock:
+            cambiata = cartella != self.cartella
+            self.cartella = cartella
+            if cambiata:
+                self._errori_consecutivi = 0
+        if cambiata:
+            self.sveglia()
+
+    def in_coda(self) -> List[str]:
+        """File dell'outbox in attesa di consegna, dal più vecchio (i .part appartengono all'export in corso)"""
+        try:
+            nomi = [n for n in os.listdir(self.outbox)
+                    if not n.endswith('.part') and os.path.isfile(os.path.join(self.outbox, n))]
+        except OSError:
+            return []
+        return sorted(nomi, key=lambda n: os.path.getmtime(os.path.join(self.outbox, n)))
+
+    def stato(self) -> Dict:
+        """Stato per la UI: file in coda, ultima consegna, ultimo errore, prossimo tentativo"""
+        with self._lock:
+            attesa = None
+            if self._prossimo_tentativo is not None:
+                attesa = max(0.0, self._prossimo_tentativo - time.monotonic())
+            return {
+                'cartella': self.cartella,
+                'in_coda': len(self.in_coda()),
+                'consegnati': self._consegnati,
+                'ultima_consegna': self._ultima_consegna,
+                'ultimo_errore': self._ultimo_errore,
+                'errori_consecutivi': self._errori_consecutivi,
+                'prossimo_tentativo_s': attesa,
+                'bloccata': bool(self._bloccata and self._bloccata.is_alive()),
+            }
+
+    def consegna(self) -> int:
+        """
+        Un giro di consegna (usato dal thread; richiamabile anche direttamente).
+
+        Returns:
+            int: file consegnati in questo giro
+
+        Raises:
+            Exception: primo errore sulla destinazione (i file restanti restano in coda)
+        """
+        consegnati = 0
+        for nome in self.in_coda():
+            if self._stop.is_set():
+                break
+            if not self._pronto(nome):
+                continue
+            self._con_timeout(self._consegna_file, nome, self.cartella)
+            consegnati += 1
+        return consegnati
+
+    # --- Interni ---
+    def _pronto(self, nome: str) -> bool:
+        """Consegna solo file di batch già pubblicati (o estranei al journal): mai un file di un batch in scrittura"""
+        if self.db is None:
+            return True
+        fase = self.db.get_transfer_file_phase(self.destinazione, nome)
+        return fase in (None, 'pubblicato', 'confermato')
+
+    def _con_timeout(self, funzione, *args):
+        if self._bloccata is not None:
+            if self._bloccata.is_alive():
+                raise TimeoutCartella("operazione precedente sulla cartella ancora bloccata")
+            self._bloccata = None
+        esito: Dict = {}
+
+        def _esegui():
+            try:
+                esito['risultato'] = funzione(*args)
+            except BaseException as e:
+                esito['errore'] = e
+
+        worker = threading.Thread(target=_esegui, name=f"corriere-io-{self.destinazione}", daemon=True)
+        worker.start()
+        worker.join(self.timeout_s)
+        if worker.is_alive():
+            self._bloccata = worker
+            raise TimeoutCartella(f"nessuna risposta da {args[-1]} entro {self.timeout_s:g}s")
+        if 'errore' in esito:
+            raise esito['errore']
+        return esito.get('risultato')
+
+    def _consegna_file(self, nome: str, cartella: str):
+        sorgente = os.path.join(self.outbox, nome)
+        destinazione = os.path.join(cartella, nome)
+        sha = _sha256_file(sorgente)
+        os.makedirs(cartella, exist_ok=True)
+        # Consegna già avvenuta (crash tra rename e rimozione dall'outbox): niente doppioni
+        if _sha256_file(destinazione) != sha:
+            tmp = destinazione + '.part'
+            with open(sorgente, 'rb') as src, open(tmp, 'wb') as dst:
+                for blocco in iter(lambda: src.read(1 << 20), b''):
+                    dst.write(blocco)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp, destinazione)
+            _fsync_dir(cartella)
+            if _sha256_file(destinazione) != sha:
+                raise IOError(f"verifica sha256 fallita per {destinazione}")
+        os.remove(sorgente)
+        # Aggiornato qui: vale anche per un'operazione conclusa dopo il timeout
+        with self._lock:
+            self._consegnati += 1
+            self._ultima_consegna = datetime.now()
+        print(f"[TRANSFER] Consegnato {nome} in {cartella}")
+
+    def _attesa_backoff(self) -> float:
+        esponente = min(self._errori_consecutivi - 1, 16)
+        attesa = min(self.retry_max_s, self.retry_min_s * (2 ** esponente))
+        return attesa * random.uniform(0.8, 1.0)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                prossimo = self._prossimo_tentativo
+            if prossimo is not None and time.monotonic() < prossimo:
+                self._sveglia.wait(prossimo - time.monotonic())
+                self._sveglia.clear()
+                continue
+            try:
+                self.consegna()
+                with self._lock:
+                    if self._errori_consecutivi:
+                        print(f"[TRANSFER] Cartella {self.cartella} di nuovo raggiungibile")
+                    self._errori_consecutivi = 0
+                    self._ultimo_errore = None
+                    self._prossimo_tentativo = None
+                # Idle fino al prossimo export (o a un controllo periodico dell'outbox)
+                self._sveglia.wait(self.retry_max_s)
+                self._sveglia.clear()
+            except Exception as e:
+                with self._lock:
+                    self._errori_consecutivi += 1
+                    self._ultimo_errore = f"{datetime.now().strftime('%H:%M:%S')} {e}"
+                    attesa = self._attesa_backoff()
+                    self._prossimo_tentativo = time.monotonic() + attesa
+                print(f"[TRANSFER] Consegna a {self.cartella} fallita ({e}): nuovo tentativo tra {attesa:.0f}s")
+
+
+class GestoreDestinazioni:
+    """
+    Più destinazioni di trasferimento (payroll, cartella HR locale, drop di sede...), ciascuna con
+    tracciato, watermark, outbox e corriere propri.
+
+    Gli export girano in parallelo su un piccolo pool di thread: una destinazione lenta o in
+    errore non ritarda le altre e viene ritentata da sola (backoff esponenziale). La consegna
+    alle cartelle resta ai corrieri, uno per destinazione.
+
+    destinazioni: lista di dict {'nome', 'cartella', 'tracciato'} (vedi leggi_destinazioni)
+    """
+
+    def __init__(self, db, outbox: str, contesto: Dict, destinazioni: List[Dict], workers: int = 3,
+                 timeout_s: float = 30, retry_min_s: float = 5, retry_max_s: float = 900,
+                 tentativi_export: int = 3):
+        self.db = db
+        self.outbox = outbox
+        self.contesto = dict(contesto)
+        self.workers = max(1, workers)
+        self.timeout_s = timeout_s
+        self.retry_min_s = retry_min_s
+        self.retry_max_s = retry_max_s
+        self.tentativi_export = max(1, tentativi_export)
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._destinazioni: Dict[str, Dict] = {}
+        self._esportatori: Dict[str, EsportatoreTrasferimenti] = {}
+        self._corrieri: Dict[str, CorriereTrasferimenti] = {}
+        self._esiti: Dict[str, Dict] = {}
+        self._avviato = False
+        self.configura(destinazioni)
+
+    # --- Configurazione ---
+    def configura(self, destinazioni: List[Dict], contesto: Optional[Dict] = None):
+        """Applica una nuova configurazione: aggiunge/rimuove destinazioni, cambia cartelle e tracciati"""
+        rimossi = []
+        with self._lock:
+            if contesto is not None and dict(contesto) != self.contesto:
+                self.contesto = dict(contesto)
+                self._esportatori.clear()  # sede/negozio cambiati: tracciati da ricompilare
+            nuove = {d['nome']: d for d in destinazioni}
+            for nome in list(self._destinazioni):
+                if nome not in nuove:
+                    rimossi.append(self._corrieri.pop(nome))
+                    self._esportatori.pop(nome, None)
+                    del self._destinazioni[nome]
+                    print(f"[TRANSFER] Destinazione {nome} rimossa")
+            for nome, dest in nuove.items():
+                vecchia = self._destinazioni.get(nome)
+                if vecchia is not None and vecchia['tracciato'] != dest['tracciato']:
+                    self._esportatori.pop(nome, None)
+                if nome not in self._esportatori:
+                    self._esportatori[nome] = EsportatoreTrasferimenti(
+                        self.db, os.path.join(self.outbox, nome), self.contesto, nome, dest['tracciato'])
+                if nome in self._corrieri:
+                    self._corrieri[nome].imposta_cartella(dest['cartella'])
+                else:
+                    corriere = CorriereTrasferimenti(
+                        os.path.join(self.outbox, nome), dest['cartella'], db=self.db, destinazione=nome,
+                        timeout_s=self.timeout_s, retry_min_s=self.retry_min_s, retry_max_s=self.retry_max_s)
+                    self._corrieri[nome] = corriere
+                    if self._avviato:
+                        corriere.start()
+                self._destinazioni[nome] = dict(dest)
+            # L'archiviazione attende solo i watermark delle destinazioni configurate
+            self.db.set_transfer_destinations('trasferimenti', self._destinazioni)
+        # Fermati fuori dal lock: il join può durare fino al timeout e stato() (UI) non deve attendere
+        for corriere in rimossi:
+            corriere.stop()
+
+    def nomi(self) -> List[str]:
+        with self._lock:
+            return list(self._destinazioni)
+
+    # --- Ciclo di vita ---
+    def start(self):
+        with self._lock:
+            self._avviato = True
+            self._stop.clear()
+            for corriere in self._corrieri.values():
+                corriere.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        with self._lock:
+            self._avviato = False
+            corrieri = list(self._corrieri.values())
+            pool, self._pool = self._pool, None
+        for corriere in corrieri:
+            corriere.stop(timeout)
+        if pool:
+            pool.shutdown(wait=False)
+
+    # --- Export ---
+    def esporta(self, nome: str) -> int:
+        """Export di una sola destinazione (con i suoi tentativi), poi sveglia il suo corriere"""
+        with self._lock:
+            esportatore = self._esportatori[nome]
+            corriere = self._corrieri[nome]
+        tentativo = 0
+        while True:
+            tentativo += 1
+            try:
+                count = esportatore.esporta()
+                break
+            except Exception as e:
+                with self._lock:
+                    self._esiti[nome] = {'quando': datetime.now(), 'righe': None, 'errore': str(e)}
+                if tentativo >= self.tentativi_export or self._stop.is_set():
+                    raise
+                attesa = min(self.retry_max_s, self.retry_min_s * (2 ** (tentativo - 1)))
+                print(f"[TRANSFER] Export {nome} fallito ({e}): tentativo {tentativo + 1} tra {attesa:.0f}s")
+                if self._stop.wait(attesa):
+                    raise
+        with self._lock:
+            self._esiti[nome] = {'quando': datetime.now(), 'righe': count, 'errore': None,
+                                 'file': esportatore.ultimo_file if count else None}
+        corriere.sveglia()
+        return count
+
+    def esporta_tutte(self) -> Dict[str, object]:
+        """
+        Export concorrente di tutte le destinazioni.
+
+        Returns:
+            Dict nome -> timbrature esportate (int) oppure l'eccezione della destinazione fallita
+        """
+        nomi = self.nomi()
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export-dest')
+            pool = self._pool
+        futures = {nome: pool.submit(self.esporta, nome) for nome in nomi}
+        esiti: Dict[str, object] = {}
+        for nome, future in futures.items():
+            try:
+                esiti[nome] = future.result()
+            except Exception as e:
+                esiti[nome] = e
+                print(f"[TRANSFER] Export {nome} non riuscito: {e}")
+        return esiti
+
+    def stato(self) -> Dict[str, Dict]:
+        """Per destinazione: cartella, tracciato, ultimo export e stato della consegna"""
+        with self._lock:
+            voci = [(nome, dict(dest), self._corrieri[nome], self._esiti.get(nome))
+                    for nome, dest in self._destinazioni.items()]
+        return {nome: {'tracciato': dest['tracciato'], 'export': esito, 'consegna': corriere.stato()}
+                for nome, dest, corriere, esito in voci}
+
+
+def leggi_destinazioni(cfg) -> List[Dict]:
+    """
+    Destinazioni dal config_negozio.ini: la cartella di [TRASFERIMENTO] (tracciato ORE) più una
+    sezione [DESTINAZIONE nome] per ogni consumatore aggiuntivo:
+
+        [DESTINAZIONE hr]
+        cartella = D:\\HR\\timbrature
+        tracciato = CSV_DETTAGLIO
+        attiva = true
+    """
+    destinazioni = []
+    if cfg.has_section('TRASFERIMENTO'):
+        cartella = (cfg.get('TRASFERIMENTO', 'cartella', fallback='') or '').strip()
+        if cartella:
+            tracciato = (cfg.get('TRASFERIMENTO', 'tracciato', fallback='ORE') or 'ORE').strip().upper()
+            destinazioni.append({'nome': DEFAULT_TRANSFER_DEST, 'cartella': cartella,
+                                 'tracciato': tracciato if tracciato in TRACCIATI else 'ORE'})
+    for sezione in cfg.sections():
+        if not sezione.upper().startswith('DESTINAZIONE '):
+            continue
+        nome = sezione.split(None, 1)[1].strip().lower()
+        if not nome.replace('_', '').replace('-', '').isalnum() or nome == DEFAULT_TRANSFER_DEST:
+            print(f"[TRANSFER] Sezione [{sezione}] ignorata: nome destinazione non valido")
+            continue
+        if not cfg.getboolean(sezione, 'attiva', fallback=True):
+            continue
+        cartella = (cfg.get(sezione, 'cartella', fallback='') or '').strip()
+        tracciato = (cfg.get(sezione, 'tracciato', fallback='ORE') or 'ORE').strip().upper()
+        if not cartella or tracciato not in TRACCIATI:
+            print(f"[TRANSFER] Sezione [{sezione}] ignorata: cartella mancante o tracciato '{tracciato}' sconosciuto")
+            continue
+        destinazioni.append({'nome': nome, 'cartella': cartella, 'tracciato': tracciato})
+    return destinazioni